@@ -0,0 +1,548 @@
+import sqlite3
+import argparse
+import json
+import os
+import time
+
+import numpy as np
+
+from dump_utils import parse_timestamp
+
+DB_PATH = "reddit_data.db"
+
+# Numeric columns copied out of SQLite into flat binary files next to the
+# database (<db>.columns/<kind>.<column>.bin), one value per row in rowid
+# order, and read back with np.memmap. subreddit and author are int32
+# codes into <db>.columns/<field>.txt (one name per line, -1 for NULL).
+# NULL numbers are stored as the column's NULLS value, which no real value
+# maps to, and select() leaves those rows out of anything that reads the
+# column. live is 0 for rows deleted since they were copied; every query
+# applies it.
+NULLS = {
+    'created_utc': np.iinfo(np.int64).min,
+    'score': np.iinfo(np.int32).min,
+    'num_comments': -1,
+    'controversiality': -1,
+}
+COLUMNS = {
+    'submissions': [
+        ('rowid', np.int64, 'rowid'),
+        ('created_utc', np.int64, f"COALESCE(CAST(created_utc AS INTEGER), {NULLS['created_utc']})"),
+        ('score', np.int32, f"COALESCE(MAX(MIN(score, 2147483647), -2147483647), {NULLS['score']})"),
+        ('num_comments', np.int32,
+         f"COALESCE(MAX(MIN(num_comments, 2147483647), 0), {NULLS['num_comments']})"),
+    ],
+    'comments': [
+        ('rowid', np.int64, 'rowid'),
+        ('created_utc', np.int64, f"COALESCE(CAST(created_utc AS INTEGER), {NULLS['created_utc']})"),
+        ('score', np.int32, f"COALESCE(MAX(MIN(score, 2147483647), -2147483647), {NULLS['score']})"),
+        ('controversiality', np.int8,
+         f"COALESCE(MAX(MIN(controversiality, 127), 0), {NULLS['controversiality']})"),
+    ],
+}
+# Bumped when the file layout or encoding changes; refresh() rebuilds a
+# store written by another version. 2: NULLs stored as NULLS, not 0.
+STORE_VERSION = 2
+# refresh() rewrites a table's files without its dead rows once they are
+# this share of the copy, so --conflict replace imports cannot grow it
+# without bound
+COMPACT_DEAD_FRACTION = 0.25
+NAME_FIELDS = ['subreddit', 'author']
+ALL_COLUMNS = {kind: [name for name, _, _ in cols] + NAME_FIELDS + ['live'] for kind, cols in COLUMNS.items()}
+DTYPES = {kind: dict([(name, dtype) for name, dtype, _ in cols] + [(f, np.int32) for f in NAME_FIELDS]
+                     + [('live', np.uint8)])
+          for kind, cols in COLUMNS.items()}
+
+FETCH_ROWS = 200000
+ID_CHUNK = 500
+DAY = 86400
+# hour and weekday are derived from created_utc
+SOURCE_COLUMNS = {'hour': 'created_utc', 'weekday': 'created_utc'}
+
+
+def store_dir_for(conn):
+    cursor = conn.cursor()
+    cursor.execute('PRAGMA database_list')
+    for _, name, path in cursor.fetchall():
+        if name == 'main':
+            return path + '.columns'
+
+
+def enabled(conn):
+    cursor = conn.cursor()
+    cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'column_store_state'")
+    return cursor.fetchone() is not None
+
+
+def _create_tables(conn):
+    # The importer logs the rowids it rewrites in column_store_dirty, so a
+    # refresh can patch them; rows past last_rowid are simply appended.
+    cursor = conn.cursor()
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS column_store_dirty (
+        kind TEXT,
+        row_id INTEGER,
+        PRIMARY KEY (kind, row_id)
+    ) WITHOUT ROWID
+    ''')
+    cursor.execute('CREATE TABLE IF NOT EXISTS column_store_state (kind TEXT PRIMARY KEY, last_rowid INTEGER)')
+    conn.commit()
+
+
+def track(cursor, kind, rows):
+    """Log the stored rowids of rows (matched by id) that a refresh has
+    already copied. Called before and after every batch is written: before
+    catches updates and the rows INSERT OR REPLACE deletes, after catches
+    rowids SQLite hands out again."""
+    cursor.execute('SELECT last_rowid FROM column_store_state WHERE kind = ?', (kind,))
+    row = cursor.fetchone()
+    if row is None or not row[0]:
+        return
+    ids = list(dict.fromkeys(r[0] for r in rows))
+    for i in range(0, len(ids), ID_CHUNK):
+        part = ids[i:i + ID_CHUNK]
+        cursor.execute(f'''
+        INSERT OR IGNORE INTO column_store_dirty (kind, row_id)
+        SELECT ?, rowid FROM main.{kind} WHERE id IN ({', '.join('?' for _ in part)}) AND rowid <= ?
+        ''', [kind] + part + [row[0]])
+
+
+class ColumnStore:
+    """Read side of the memory-mapped column files."""
+
+    def __init__(self, store_dir):
+        self.store_dir = store_dir
+        with open(os.path.join(store_dir, 'meta.json'), 'r', encoding='utf-8') as f:
+            self.meta = json.load(f)
+        self._columns = {}
+        self._names = {}
+        self._codes = {}
+
+    def rows(self, kind):
+        return self.meta['tables'][kind]['rows']
+
+    def column(self, kind, name):
+        key = (kind, name)
+        if key not in self._columns:
+            n = self.rows(kind)
+            dtype = DTYPES[kind][name]
+            if n == 0:
+                self._columns[key] = np.empty(0, dtype=dtype)
+            else:
+                self._columns[key] = np.memmap(_column_path(self.store_dir, kind, name), dtype=dtype,
+                                               mode='r', shape=(n,))
+        return self._columns[key]
+
+    def names(self, field):
+        if field not in self._names:
+            self._names[field] = _read_names(self.store_dir, field, self.meta['names'][field])
+        return self._names[field]
+
+    def codes(self, field, names):
+        if field not in self._codes:
+            self._codes[field] = {name: i for i, name in enumerate(self.names(field))}
+        lookup = self._codes[field]
+        return np.array([lookup[name] for name in names if name in lookup], dtype=np.int32)
+
+    def select(self, kind, subreddits=None, authors=None, after=None, before=None, columns=()):
+        """Boolean mask of the live rows matching the filters, leaving out
+        rows where any of columns (or created_utc, for a time filter) is
+        NULL."""
+        mask = self.column(kind, 'live').astype(bool)
+        if subreddits:
+            mask &= np.isin(self.column(kind, 'subreddit'), self.codes('subreddit', subreddits))
+        if authors:
+            mask &= np.isin(self.column(kind, 'author'), self.codes('author', authors))
+        if after is not None or before is not None:
+            columns = tuple(columns) + ('created_utc',)
+        for name in dict.fromkeys(SOURCE_COLUMNS.get(name, name) for name in columns if name):
+            if name in NULLS:
+                mask &= self.column(kind, name) != NULLS[name]
+        if after is not None:
+            mask &= self.column(kind, 'created_utc') >= after
+        if before is not None:
+            mask &= self.column(kind, 'created_utc') < before
+        return mask
+
+
+def _column_path(store_dir, kind, name):
+    return os.path.join(store_dir, f'{kind}.{name}.bin')
+
+
+def _names_path(store_dir, field):
+    return os.path.join(store_dir, f'{field}.txt')
+
+
+def _read_names(store_dir, field, info):
+    if not info['count']:
+        return []
+    with open(_names_path(store_dir, field), 'rb') as f:
+        data = f.read(info['bytes'])
+    return data.decode('utf-8').split('\n')[:-1]
+
+
+def _write_meta(store_dir, meta):
+    tmp_path = os.path.join(store_dir, 'meta.json.tmp')
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(meta, f)
+    os.replace(tmp_path, os.path.join(store_dir, 'meta.json'))
+
+
+class _Encoder:
+    # Name -> code for one field, appending unseen names to the .txt file
+    def __init__(self, store_dir, field, info):
+        self.path = _names_path(store_dir, field)
+        self.info = info
+        self.codes = {name: i for i, name in enumerate(_read_names(store_dir, field, info))}
+        self.pending = []
+
+    def encode(self, values):
+        codes = self.codes
+        out = np.empty(len(values), dtype=np.int32)
+        for i, value in enumerate(values):
+            if value is None:
+                out[i] = -1
+                continue
+            code = codes.get(value)
+            if code is None:
+                # Names are one per line; a newline would shift every later code
+                code = codes[value] = len(codes)
+                self.pending.append(value.replace('\n', ' '))
+            out[i] = code
+        return out
+
+    def flush(self):
+        if not self.pending:
+            return
+        data = ''.join(name + '\n' for name in self.pending).encode('utf-8')
+        with open(self.path, 'ab') as f:
+            f.truncate(self.info['bytes'])
+            f.write(data)
+        self.info['bytes'] += len(data)
+        self.info['count'] = len(self.codes)
+        self.pending = []
+
+
+def _select_sql(kind):
+    columns = ', '.join(expr for _, _, expr in COLUMNS[kind]) + ', ' + ', '.join(NAME_FIELDS)
+    return f'SELECT {columns} FROM main.{kind}'
+
+
+def _to_arrays(kind, rows, encoders):
+    values = list(zip(*rows))
+    arrays = {}
+    for i, (name, dtype, _) in enumerate(COLUMNS[kind]):
+        arrays[name] = np.array(values[i], dtype=dtype)
+    offset = len(COLUMNS[kind])
+    for j, field in enumerate(NAME_FIELDS):
+        arrays[field] = encoders[field].encode(values[offset + j])
+    arrays['live'] = np.ones(len(rows), dtype=np.uint8)
+    return arrays
+
+
+def _append(store_dir, kind, table_meta, arrays):
+    n = table_meta['rows']
+    for name in ALL_COLUMNS[kind]:
+        dtype = DTYPES[kind][name]
+        with open(_column_path(store_dir, kind, name), 'ab') as f:
+            # Drop anything a crashed refresh wrote past the recorded length
+            f.truncate(n * np.dtype(dtype).itemsize)
+            f.write(np.ascontiguousarray(arrays[name], dtype=dtype).tobytes())
+    table_meta['rows'] = n + len(arrays['rowid'])
+
+
+def _rewrite_sorted(store_dir, kind, table_meta, extra):
+    # Rows whose rowids SQLite reused below the copied range: merge them in
+    # by rowid, which means rewriting every column file once
+    n = table_meta['rows']
+    current = {}
+    for name in ALL_COLUMNS[kind]:
+        dtype = DTYPES[kind][name]
+        if n:
+            current[name] = np.fromfile(_column_path(store_dir, kind, name), dtype=dtype, count=n)
+        else:
+            current[name] = np.empty(0, dtype=dtype)
+    order = np.argsort(np.concatenate([current['rowid'], extra['rowid']]), kind='stable')
+    for name in ALL_COLUMNS[kind]:
+        merged = np.concatenate([current[name], extra[name].astype(DTYPES[kind][name])])[order]
+        merged.tofile(_column_path(store_dir, kind, name))
+    table_meta['rows'] = len(order)
+
+
+def _compact(store_dir, kind, table_meta):
+    # Drop the dead rows. Rowids stay sorted, so this is one filtered copy
+    # of every column file.
+    n = table_meta['rows']
+    live = np.fromfile(_column_path(store_dir, kind, 'live'), dtype=np.uint8, count=n).astype(bool)
+    for name in ALL_COLUMNS[kind]:
+        path = _column_path(store_dir, kind, name)
+        column = np.fromfile(path, dtype=DTYPES[kind][name], count=n)
+        column[live].tofile(path + '.tmp')
+        os.replace(path + '.tmp', path)
+    table_meta['rows'] = int(live.sum())
+    table_meta['dead'] = 0
+    return n - table_meta['rows']
+
+
+def _refresh_table(conn, store_dir, kind, table_meta, encoders):
+    cursor = conn.cursor()
+    n = table_meta['rows']
+    patched = deleted = inserted = 0
+
+    cursor.execute('SELECT row_id FROM column_store_dirty WHERE kind = ? ORDER BY row_id', (kind,))
+    dirty = np.array([row[0] for row in cursor.fetchall()], dtype=np.int64)
+    if len(dirty) and n:
+        rowids = np.memmap(_column_path(store_dir, kind, 'rowid'), dtype=np.int64, mode='r', shape=(n,))
+        found = {}
+        for i in range(0, len(dirty), ID_CHUNK):
+            part = [int(r) for r in dirty[i:i + ID_CHUNK]]
+            cursor.execute(f"{_select_sql(kind)} WHERE rowid IN ({', '.join('?' for _ in part)})", part)
+            found.update((row[0], row) for row in cursor.fetchall())
+
+        positions = np.searchsorted(rowids, dirty)
+        in_store = positions < n
+        in_store[in_store] = rowids[positions[in_store]] == dirty[in_store]
+        present = np.array([int(r) in found for r in dirty], dtype=bool)
+
+        live = np.memmap(_column_path(store_dir, kind, 'live'), dtype=np.uint8, mode='r+', shape=(n,))
+        update = in_store & present
+        if update.any():
+            # A dead row whose rowid SQLite handed out again comes back to life
+            table_meta['dead'] -= int(np.count_nonzero(live[positions[update]] == 0))
+            arrays = _to_arrays(kind, [found[int(r)] for r in dirty[update]], encoders)
+            for name in ALL_COLUMNS[kind]:
+                if name == 'rowid':
+                    continue
+                column = np.memmap(_column_path(store_dir, kind, name), dtype=DTYPES[kind][name],
+                                   mode='r+', shape=(n,))
+                column[positions[update]] = arrays[name]
+                column.flush()
+            patched = int(update.sum())
+        gone = in_store & ~present
+        if gone.any():
+            deleted = int(np.count_nonzero(live[positions[gone]]))
+            live[positions[gone]] = 0
+            live.flush()
+            table_meta['dead'] += deleted
+        del live
+        reused = ~in_store & present & (dirty <= table_meta['last_rowid'])
+        if reused.any():
+            _rewrite_sorted(store_dir, kind, table_meta,
+                            _to_arrays(kind, [found[int(r)] for r in dirty[reused]], encoders))
+            inserted += int(reused.sum())
+
+    # Everything past the copied range, in rowid order
+    last = table_meta['last_rowid']
+    while True:
+        cursor.execute(f'{_select_sql(kind)} WHERE rowid > ? ORDER BY rowid LIMIT ?', (last, FETCH_ROWS))
+        rows = cursor.fetchall()
+        if not rows:
+            break
+        _append(store_dir, kind, table_meta, _to_arrays(kind, rows, encoders))
+        last = rows[-1][0]
+        inserted += len(rows)
+        for encoder in encoders.values():
+            encoder.flush()
+        if table_meta['rows'] % (FETCH_ROWS * 10) == 0:
+            print(f"  Copied {table_meta['rows']:,} {kind}...")
+    table_meta['last_rowid'] = last
+    compacted = 0
+    if table_meta['dead'] and table_meta['dead'] >= COMPACT_DEAD_FRACTION * table_meta['rows']:
+        compacted = _compact(store_dir, kind, table_meta)
+    return patched, deleted, inserted, compacted, len(dirty)
+
+
+def refresh(conn, store_dir=None):
+    """Bring the column files up to date with the database: patch or drop
+    the rows the importer logged as rewritten, append the rows added since
+    the last refresh. Cost is proportional to what changed."""
+    store_dir = store_dir or store_dir_for(conn)
+    start = time.perf_counter()
+    meta_path = os.path.join(store_dir, 'meta.json')
+    meta = None
+    if os.path.exists(meta_path):
+        with open(meta_path, 'r', encoding='utf-8') as f:
+            meta = json.load(f)
+        if meta.get('version') != STORE_VERSION:
+            print(f"Column store {store_dir} was written by an older version, copying it again")
+            _clear(store_dir)
+            meta = None
+    if meta is None:
+        os.makedirs(store_dir, exist_ok=True)
+        meta = {'version': STORE_VERSION,
+                'tables': {kind: {'rows': 0, 'last_rowid': 0, 'dead': 0} for kind in COLUMNS},
+                'names': {field: {'count': 0, 'bytes': 0} for field in NAME_FIELDS}}
+    encoders = {field: _Encoder(store_dir, field, meta['names'][field]) for field in NAME_FIELDS}
+
+    cursor = conn.cursor()
+    for kind in COLUMNS:
+        table_meta = meta['tables'][kind]
+        patched, deleted, inserted, compacted, logged = _refresh_table(conn, store_dir, kind, table_meta,
+                                                                       encoders)
+        for encoder in encoders.values():
+            encoder.flush()
+        meta['refreshed_on'] = int(time.time())
+        _write_meta(store_dir, meta)
+        # Only once the files and meta.json are written: a crash before
+        # this point redoes the same (idempotent) patches next time
+        cursor.execute('DELETE FROM column_store_dirty WHERE kind = ?', (kind,))
+        cursor.execute('INSERT OR REPLACE INTO column_store_state (kind, last_rowid) VALUES (?, ?)',
+                       (kind, table_meta['last_rowid']))
+        conn.commit()
+        if patched or deleted or inserted:
+            print(f"  Column store {kind}: {inserted:,} added, {patched:,} updated, {deleted:,} removed")
+        if compacted:
+            print(f"  Column store {kind}: compacted away {compacted:,} dead rows")
+    print(f"Refreshed column store {store_dir} in {time.perf_counter() - start:.1f}s")
+
+
+def _clear(store_dir):
+    if os.path.isdir(store_dir):
+        for name in os.listdir(store_dir):
+            os.remove(os.path.join(store_dir, name))
+
+
+def build(conn, store_dir=None):
+    """Copy the columns from scratch and start tracking imports."""
+    store_dir = store_dir or store_dir_for(conn)
+    _clear(store_dir)
+    _create_tables(conn)
+    conn.execute('DELETE FROM column_store_dirty')
+    conn.execute('DELETE FROM column_store_state')
+    conn.commit()
+    refresh(conn, store_dir)
+
+
+# Vectorized queries over a ColumnStore. filters are select() keyword
+# arguments (subreddits, authors, after, before).
+
+def _values(store, kind, column):
+    if column == 'hour':
+        return store.column(kind, 'created_utc') % DAY // 3600
+    if column == 'weekday':
+        # 1970-01-01 was a Thursday; 0 is Monday
+        return (store.column(kind, 'created_utc') // DAY + 3) % 7
+    return store.column(kind, column)
+
+
+def group_by(store, kind, by, value=None, how='count', min_rows=1, **filters):
+    """Aggregate per subreddit, author, hour or weekday: how is count, sum
+    or mean of value (a column name). Returns [(group, result, rows)]
+    sorted by result, largest first."""
+    mask = store.select(kind, columns=(by, value), **filters)
+    groups = _values(store, kind, by)[mask]
+    keep = groups >= 0
+    groups = groups[keep].astype(np.int64)
+    size = int(groups.max()) + 1 if len(groups) else 0
+    counts = np.bincount(groups, minlength=size)
+    if how == 'count':
+        results = counts.astype(np.float64)
+    else:
+        weights = _values(store, kind, value)[mask][keep].astype(np.float64)
+        results = np.bincount(groups, weights=weights, minlength=size)
+        if how == 'mean':
+            results = np.divide(results, counts, out=np.zeros_like(results), where=counts > 0)
+    index = np.nonzero(counts >= max(min_rows, 1))[0]
+    index = index[np.argsort(-results[index], kind='stable')]
+    labels = store.names(by) if by in NAME_FIELDS else None
+    return [(labels[i] if labels is not None else int(i), float(results[i]), int(counts[i])) for i in index]
+
+
+def histogram(store, kind, column, bins=20, value_range=None, **filters):
+    """np.histogram of a column over the matching rows: (counts, edges)."""
+    values = _values(store, kind, column)[store.select(kind, columns=(column,), **filters)]
+    return np.histogram(values, bins=bins, range=value_range)
+
+
+def percentiles(store, kind, column, q=(50, 90, 99), by=None, min_rows=1, **filters):
+    """Percentiles of a column, overall ({None: [...]}) or per group
+    ({group: [...]}) from one sort of (group, value) pairs."""
+    mask = store.select(kind, columns=(column, by), **filters)
+    values = _values(store, kind, column)[mask]
+    if by is None:
+        return {None: np.percentile(values, q).tolist() if len(values) else []}
+
+    groups = _values(store, kind, by)[mask]
+    keep = groups >= 0
+    groups, values = groups[keep], values[keep]
+    order = np.lexsort((values, groups))
+    groups, values = groups[order], values[order]
+    starts = np.flatnonzero(np.r_[True, groups[1:] != groups[:-1]]) if len(groups) else np.array([], int)
+    ends = np.r_[starts[1:], len(groups)]
+    sizes = ends - starts
+    # Linear interpolation between closest ranks, as np.percentile does
+    result = {}
+    labels = store.names(by) if by in NAME_FIELDS else None
+    fractions = np.asarray(q, dtype=np.float64) / 100
+    big = sizes >= max(min_rows, 1)
+    for start, size in zip(starts[big], sizes[big]):
+        ranks = fractions * (size - 1)
+        low = np.floor(ranks).astype(np.int64)
+        high = np.minimum(low + 1, size - 1)
+        lo, hi = values[start + low].astype(np.float64), values[start + high].astype(np.float64)
+        label = labels[groups[start]] if labels is not None else int(groups[start])
+        result[label] = (lo + (hi - lo) * (ranks - low)).tolist()
+    return result
+
+
+def controversiality_rates(store, min_comments=100, **filters):
+    """Share of controversial comments per subreddit: [(subreddit, rate,
+    comments)], highest rate first."""
+    return group_by(store, 'comments', 'subreddit', 'controversiality', 'mean', min_comments, **filters)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Memory-mapped NumPy columns for fast aggregate analytics")
+    parser.add_argument("--db", default=DB_PATH, help="SQLite database path")
+    parser.add_argument("--build", action="store_true",
+                        help="Copy the columns from scratch; imports keep them up to date afterwards")
+    parser.add_argument("--refresh", action="store_true", help="Apply changes since the last refresh")
+    parser.add_argument("--kind", choices=list(COLUMNS), default='comments')
+    parser.add_argument("--subreddits", nargs="*", default=None)
+    parser.add_argument("--after", default=None, help="Unix time or YYYY-MM-DD")
+    parser.add_argument("--before", default=None, help="Unix time or YYYY-MM-DD")
+    parser.add_argument("--hours", action="store_true", help="Print activity per UTC hour of day")
+    parser.add_argument("--scores", action="store_true", help="Print score percentiles per subreddit")
+    parser.add_argument("--controversial", action="store_true",
+                        help="Print the subreddits with the highest share of controversial comments")
+    parser.add_argument("--min-rows", type=int, default=100, help="Skip groups with fewer rows")
+    parser.add_argument("--top", type=int, default=20)
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    conn = sqlite3.connect(args.db)
+    if args.build:
+        build(conn)
+    elif args.refresh:
+        refresh(conn)
+
+    store = ColumnStore(store_dir_for(conn))
+    conn.close()
+    filters = dict(subreddits=args.subreddits, after=parse_timestamp(args.after), before=parse_timestamp(args.before))
+
+    if args.hours:
+        start = time.perf_counter()
+        rows = sorted(group_by(store, args.kind, 'hour', **filters))
+        print(f"{args.kind} per UTC hour ({time.perf_counter() - start:.3f}s):")
+        peak = max((count for _, count, _ in rows), default=0) or 1
+        for hour, count, _ in rows:
+            print(f"  {hour:02d}:00  {int(count):>10,}  {'#' * int(50 * count / peak)}")
+    if args.scores:
+        start = time.perf_counter()
+        result = percentiles(store, args.kind, 'score', (50, 90, 99), by='subreddit', min_rows=args.min_rows,
+                             **filters)
+        print(f"{args.kind} score p50/p90/p99 per subreddit ({time.perf_counter() - start:.3f}s):")
+        for subreddit, (p50, p90, p99) in sorted(result.items(), key=lambda item: -item[1][1])[:args.top]:
+            print(f"  r/{subreddit}  {p50:.0f} / {p90:.0f} / {p99:.0f}")
+    if args.controversial:
+        start = time.perf_counter()
+        rows = controversiality_rates(store, args.min_rows, **filters)
+        print(f"Controversial comment share ({time.perf_counter() - start:.3f}s):")
+        for subreddit, rate, comments in rows[:args.top]:
+            print(f"  r/{subreddit}  {rate:.2%} of {comments:,} comments")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,265 @@
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import queue
+import random
+import resource
+import shutil
+import sqlite3
+import subprocess
+import tempfile
+import time
+
+import zstandard as zstd
+
+import reddit_import_script as importer
+
+SUBREDDITS = ["AskReddit", "teenagers", "bullying", "science", "worldnews", "Python", "aww", "gaming"]
+WORDS = ["school", "teacher", "friend", "the", "and", "bully", "class", "remember", "years", "later",
+         "really", "think", "never", "because", "people", "help", "felt", "alone", "still", "today"]
+UNICODE_SNIPPETS = ["h\u00e9llo w\u00f6rld", "\u65e5\u672c\u8a9e\u306e\u30c6\u30ad\u30b9\u30c8", "\U0001f642\U0001f525\U0001f44d",
+                    "\u0395\u03bb\u03bb\u03b7\u03bd\u03b9\u03ba\u03ac", "\u0442\u0435\u0441\u0442", "zero\u200bwidth",
+                    "quotes \"inside\" and \\backslashes\\"]
+
+
+def _text(rng, words):
+    parts = [rng.choice(WORDS) for _ in range(words)]
+    if rng.random() < 0.2:
+        parts.insert(rng.randrange(len(parts) + 1), rng.choice(UNICODE_SNIPPETS))
+    return " ".join(parts)
+
+
+def _drop_fields(rng, record, rate):
+    # Older dumps leave out fields that newer ones always have
+    for key in list(record):
+        if key != "id" and rng.random() < rate:
+            del record[key]
+    return record
+
+
+def synthetic_submission(rng, n, created_utc, long_body_rate, missing_rate):
+    sid = format(n + 36 ** 5, "x")
+    is_self = rng.random() < 0.6
+    body_words = rng.randint(2000, 6000) if rng.random() < long_body_rate else rng.randint(0, 120)
+    record = {
+        "id": sid,
+        "subreddit": rng.choice(SUBREDDITS),
+        "title": _text(rng, rng.randint(3, 15)),
+        "selftext": _text(rng, body_words) if is_self else "",
+        "author": rng.choice(["[deleted]", f"user_{rng.randint(0, 50000)}"]) if rng.random() < 0.1
+        else f"user_{rng.randint(0, 50000)}",
+        "created_utc": created_utc,
+        "score": rng.randint(-20, 5000),
+        "num_comments": rng.randint(0, 500),
+        "is_self": is_self,
+        "retrieved_on": created_utc + 86400,
+        "stickied": rng.random() < 0.01,
+        "over_18": rng.random() < 0.05,
+        "spoiler": False,
+        "locked": rng.random() < 0.02,
+        "distinguished": None,
+        "permalink": f"/r/x/comments/{sid}/",
+        "url": None if is_self else f"https://i.redd.it/{sid}.jpg",
+        "domain": "self.x" if is_self else "i.redd.it",
+        "post_hint": None if is_self else "image",
+    }
+    return _drop_fields(rng, record, missing_rate)
+
+
+def synthetic_comment(rng, n, created_utc, long_body_rate, missing_rate):
+    link = format(rng.randint(36 ** 5, 36 ** 5 + 100000), "x")
+    body_words = rng.randint(2000, 6000) if rng.random() < long_body_rate else rng.randint(1, 80)
+    parent = f"t3_{link}" if rng.random() < 0.4 else f"t1_{format(max(n - rng.randint(1, 50), 0), 'x')}"
+    record = {
+        "id": format(n, "x"),
+        "subreddit": rng.choice(SUBREDDITS),
+        "body": _text(rng, body_words),
+        "author": f"user_{rng.randint(0, 50000)}",
+        "created_utc": created_utc,
+        "score": rng.randint(-20, 2000),
+        "link_id": f"t3_{link}",
+        "parent_id": parent,
+        "retrieved_on": created_utc + 86400,
+        "stickied": False,
+        "distinguished": None,
+        "controversiality": int(rng.random() < 0.05),
+    }
+    return _drop_fields(rng, record, missing_rate)
+
+
+def generate_dump(file_path, kind, size_mb, seed=0, malformed_rate=0.001, long_body_rate=0.01,
+                  missing_rate=0.02, start_utc=1672531200):
+    """Write an RS_/RC_-style .zst of roughly size_mb decompressed MB.
+    Returns the number of lines written."""
+    rng = random.Random(seed)
+    make = synthetic_submission if kind == "submissions" else synthetic_comment
+    target = size_mb * 1024 * 1024
+    written = 0
+    lines = 0
+
+    cctx = zstd.ZstdCompressor(level=3)
+    with open(file_path, "wb") as f, cctx.stream_writer(f) as writer:
+        while written < target:
+            record = make(rng, lines, start_utc + lines, long_body_rate, missing_rate)
+            line = json.dumps(record, ensure_ascii=rng.random() < 0.5)
+            if rng.random() < malformed_rate:
+                line = line[:rng.randint(1, len(line) - 1)]
+            data = (line + "\n").encode("utf-8")
+            writer.write(data)
+            written += len(data)
+            lines += 1
+    return lines
+
+
+def _peak_rss_mb():
+    # ru_maxrss is KiB on Linux, bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if platform.system() == "Darwin" else peak / 1024
+
+
+def stage_decompress(file_path, kind):
+    lines = 0
+    size = 0
+    for batch, offset, _ in importer.read_zst_line_batches(file_path):
+        lines += len(batch)
+        size = offset
+    return {"rows": lines, "bytes_out": size}
+
+
+def stage_parse(file_path, kind):
+    parse = importer.ROW_PARSERS[kind]
+    rows = 0
+    errors = 0
+    size = 0
+    for batch, offset, _ in importer.read_zst_line_batches(file_path):
+        parsed, failed = importer.parse_lines(batch, parse)
+        rows += len(parsed)
+        errors += len(failed)
+        size = offset
+    return {"rows": rows, "errors": errors, "bytes_out": size}
+
+
+def stage_import(file_path, kind, db_path):
+    conn = importer.create_database(db_path)
+    importer.import_file(conn, kind, file_path, resume=False)
+    rows = conn.execute(f"SELECT COUNT(*) FROM {kind}").fetchone()[0]
+    conn.close()
+    return {"rows": rows, "db_mb": round(os.path.getsize(db_path) / (1024 * 1024), 2)}
+
+
+STAGES = {
+    "decompress": stage_decompress,
+    "parse": stage_parse,
+    "import": stage_import,
+}
+
+
+def _run_stage(stage, args, result_queue):
+    start = time.perf_counter()
+    result = STAGES[stage](*args)
+    result["seconds"] = round(time.perf_counter() - start, 3)
+    result["peak_rss_mb"] = round(_peak_rss_mb(), 1)
+    result_queue.put(result)
+
+
+def run_stage(stage, file_path, kind, work_dir):
+    # Each stage runs in a fresh spawned process so peak RSS is its own
+    args = (file_path, kind)
+    if stage == "import":
+        args += (os.path.join(work_dir, f"bench_{kind}.db"),)
+        if os.path.exists(args[2]):
+            os.remove(args[2])
+
+    ctx = multiprocessing.get_context("spawn")
+    result_queue = ctx.Queue()
+    process = ctx.Process(target=_run_stage, args=(stage, args, result_queue))
+    process.start()
+    while True:
+        try:
+            result = result_queue.get(timeout=1)
+            break
+        except queue.Empty:
+            if not process.is_alive():
+                raise RuntimeError(f"{stage} stage for {file_path} exited with code {process.exitcode}")
+    process.join()
+
+    compressed_mb = os.path.getsize(file_path) / (1024 * 1024)
+    result["rows_per_sec"] = round(result["rows"] / result["seconds"]) if result["seconds"] else None
+    result["compressed_mb_per_sec"] = round(compressed_mb / result["seconds"], 2) if result["seconds"] else None
+    if "bytes_out" in result and result["seconds"]:
+        result["decompressed_mb_per_sec"] = round(result["bytes_out"] / (1024 * 1024) / result["seconds"], 2)
+    return result
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"],
+                                       cwd=os.path.dirname(os.path.abspath(__file__)),
+                                       stderr=subprocess.DEVNULL, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Benchmark the importer on synthetic RS_/RC_ dumps")
+    parser.add_argument("--size-mb", type=float, default=50, help="Decompressed size of each synthetic dump")
+    parser.add_argument("--kinds", nargs="+", default=["submissions", "comments"],
+                        choices=["submissions", "comments"])
+    parser.add_argument("--stages", nargs="+", default=list(STAGES), choices=list(STAGES))
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--malformed-rate", type=float, default=0.001)
+    parser.add_argument("--long-body-rate", type=float, default=0.01)
+    parser.add_argument("--missing-rate", type=float, default=0.02)
+    parser.add_argument("--work-dir", default=None, help="Where dumps/databases go (default: a temp dir)")
+    parser.add_argument("--keep", action="store_true", help="Keep the generated dumps and databases")
+    parser.add_argument("--out", default=None, help="Also write the JSON report to this file")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    work_dir = args.work_dir or tempfile.mkdtemp(prefix="reddit_bench_")
+    os.makedirs(work_dir, exist_ok=True)
+
+    report = {
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "sqlite": sqlite3.sqlite_version,
+        "json_backend": importer.JSON_BACKEND,
+        "size_mb": args.size_mb,
+        "seed": args.seed,
+        "results": {},
+    }
+
+    try:
+        for kind in args.kinds:
+            prefix = "RS" if kind == "submissions" else "RC"
+            file_path = os.path.join(work_dir, f"{prefix}_2023-01_{kind}.zst")
+            start = time.perf_counter()
+            lines = generate_dump(file_path, kind, args.size_mb, args.seed, args.malformed_rate,
+                                  args.long_body_rate, args.missing_rate)
+            print(f"Generated {file_path}: {lines:,} lines, "
+                  f"{os.path.getsize(file_path) / (1024 * 1024):.2f} MB compressed "
+                  f"in {time.perf_counter() - start:.1f}s")
+
+            report["results"][kind] = {"lines": lines, "compressed_mb": round(os.path.getsize(file_path) / (1024 * 1024), 2)}
+            for stage in args.stages:
+                result = run_stage(stage, file_path, kind, work_dir)
+                report["results"][kind][stage] = result
+                print(f"  {stage:<10} {result['seconds']:>8.2f}s  {result['rows_per_sec'] or 0:>10,} rows/s  "
+                      f"peak RSS {result['peak_rss_mb']} MB")
+    finally:
+        if not args.keep and not args.work_dir:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    output = json.dumps(report, indent=2)
+    print(output)
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            f.write(output + "\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,10 +1,37 @@
 import os
-from openai import OpenAI
+import re
+import json
+import random
+import asyncio
+import hashlib
+import argparse
+from collections import Counter
+
+import openai
+from openai import OpenAI, AsyncOpenAI
+
+import compact_db
+import post_export
+from post_export import estimate_tokens
 
 OPENROUTER_API_KEY = os.environ.get("OPENROUTER_API_KEY", "")
-OPENROUTER_URL = "https://openrouter.ai/api/v1"
+# Overridable so the pipeline can be pointed at a local OpenAI-compatible mock server
+OPENROUTER_URL = os.environ.get("OPENROUTER_URL", "https://openrouter.ai/api/v1")
 FREE_MODEL = "x-ai/grok-4.1-fast:free" 
 
+# Map-reduce mode: posts are packed into chunks of about CHUNK_TOKENS
+# (see post_export.estimate_tokens), classified by up to CONCURRENCY requests
+# at a time, and every response is cached under CACHE_DIR so a rerun only
+# pays for prompts it has not seen.
+CHUNK_TOKENS = 12000
+CONCURRENCY = 4
+MAX_RETRIES = 5
+BACKOFF_SEC = 2.0
+CACHE_DIR = ".codebook_cache"
+POST_SEPARATOR = r"\n\s*\n"
+
+RETRYABLE_ERRORS = (openai.RateLimitError, openai.APIConnectionError, openai.InternalServerError)
+
 
 def write_to_file(filename: str, content: str):
     try:
@@ -15,17 +42,21 @@ def write_to_file(filename: str, content: str):
         print(f"ERROR: Could not write to file {filename}. Reason: {e}")
 
 
-def get_client(system_prompt: str, user_prompt: str) -> str:
-    
-    client = OpenAI(
-        api_key=OPENROUTER_API_KEY,
-        base_url=OPENROUTER_URL,
-    )
+_client = None
+
+
+def get_client(system_prompt: str, user_prompt: str, model: str = FREE_MODEL) -> str:
+    global _client
+    if _client is None:
+        _client = OpenAI(
+            api_key=OPENROUTER_API_KEY,
+            base_url=OPENROUTER_URL,
+        )
     
-    print(f"--- Making API Call to {FREE_MODEL} ---")
+    print(f"--- Making API Call to {model} ---")
     
-    response = client.chat.completions.create(
-        model=FREE_MODEL,
+    response = _client.chat.completions.create(
+        model=model,
         messages=[
             {"role": "system", "content": system_prompt},
             {"role": "user", "content": user_prompt},
@@ -36,17 +67,17 @@ def get_client(system_prompt: str, user_prompt: str) -> str:
     return response.choices[0].message.content
 
 
-def load_posts_content() -> str:
+def load_posts_content(path: str = 'posts.txt') -> str:
     try:
-        with open('posts.txt', 'r') as f:
+        with open(path, 'r') as f:
             return f.read()
     except FileNotFoundError:
-        print("WARNING: 'posts.txt' not found. Using empty content.")
+        print(f"WARNING: '{path}' not found. Using empty content.")
         return ""
 
 
 
-def generate_codebook(posts_content: str) -> str:
+def codebook_prompts(posts_content: str) -> tuple[str, str]:
     
     system_prompt = f"""
     Act as a qualitative researcher analyzing the following Reddit posts. Your task is to develop a **Codebook** based on an open coding process.
@@ -69,11 +100,33 @@ def generate_codebook(posts_content: str) -> str:
     {posts_content}
     """
     
-    return get_client(system_prompt, user_prompt)
+    return system_prompt, user_prompt
+
 
+def generate_codebook(posts_content: str) -> str:
+    return get_client(*codebook_prompts(posts_content))
 
 
-def classify_posts(codebook: str, posts_content: str) -> str:
+def merge_codebook_prompts(codebooks: list[str]) -> tuple[str, str]:
+
+    system_prompt = f"""
+    Act as a qualitative researcher. You are given several partial **Codebooks**, each developed from a different sample of the same Reddit posts. Merge them into a single Codebook: combine codes that describe the same concept under one name, keep codes that are distinct, and group them into Code Families.
+
+    **STRICT OUTPUT INSTRUCTION:** Provide ONLY the merged codebook content, in exactly the same Markdown format as the partial codebooks. Do not include any introductory or concluding conversational text.
+    """
+
+    partials = "\n\n".join(f"PARTIAL CODEBOOK {i}:\n{codebook}" for i, codebook in enumerate(codebooks, start=1))
+    user_prompt = f"""
+    Please merge the following partial codebooks.
+
+    {partials}
+    """
+
+    return system_prompt, user_prompt
+
+
+
+def classification_prompts(codebook: str, posts_content: str) -> tuple[str, str]:
     
     system_prompt = f"""
     You are a highly meticulous qualitative data coder. Your task is to process the raw POSTS CONTENT by applying the codes defined in the CODEBOOK. 
@@ -110,31 +163,65 @@ def classify_posts(codebook: str, posts_content: str) -> str:
     {posts_content}
     """
     
-    return get_client(system_prompt, user_prompt)
+    return system_prompt, user_prompt
+
+
+def classify_posts(codebook: str, posts_content: str) -> str:
+    return get_client(*classification_prompts(codebook, posts_content))
 
 # --- Step 3: Analytical Summary  ---
 
-def generate_summary(codebook: str, classification_report: str) -> str:
+def tally_classifications(classification_report: str) -> dict:
+    """Count posts, classified posts and code frequencies in a classification
+    report, the counting the summary step used to ask the model to do."""
+    posts = 0
+    classified = 0
+    codes = Counter()
+    post_has_code = False
+
+    for line in classification_report.splitlines():
+        # Models sometimes bold the labels: "**Post URL:** ..."
+        text = line.strip().replace('**', '').strip('-* ')
+        lower = text.lower()
+        if lower.startswith('post url:'):
+            if post_has_code:
+                classified += 1
+            posts += 1
+            post_has_code = False
+        elif lower.startswith('code applied:'):
+            code = text[len('code applied:'):].strip().strip('[]').strip()
+            if code and not code.lower().startswith('no code'):
+                codes[code] += 1
+                post_has_code = True
+    if post_has_code:
+        classified += 1
+
+    return {'posts': posts, 'classified': classified, 'codes': codes}
+
+
+def format_statistics(tally: dict) -> str:
+    lines = [
+        "### 1. Key Statistics and Code Frequency",
+        f"* **Total Posts Analyzed:** {tally['posts']}",
+        f"* **Total Posts Classified:** {tally['classified']}",
+        "* **Full Code Frequency List:**",
+    ]
+    for code, count in sorted(tally['codes'].items(), key=lambda item: (-item[1], item[0])):
+        lines.append(f"  - {code}: {count}")
+    return "\n".join(lines)
+
+
+def summary_prompts(codebook: str, statistics: str, classification_report: str = None) -> tuple[str, str]:
 
     system_prompt = f"""
-    Act as a senior qualitative data analyst. Your first task is to **meticulously count and aggregate** the data in the provided CLASSIFICATION REPORT. Your second task is to use those counts and the CODEBOOK to produce a structured, comprehensive **Analytical Summary**.
-
-    **COUNTING & REPORTING INSTRUCTIONS (CRITICAL):**
-    1.  Count the **Total Posts Analyzed** (count of 'post url:' lines).
-    2.  Count the **Total Posts Classified** (Total Posts Analyzed minus the count of 'No codes applied.' lines).
-    3.  Count the frequency of **EVERY SINGLE Code Name** used in the report (count of 'code applied: [Code Name]' lines).
-    4.  List the codes and their counts from highest to lowest frequency.
+    Act as a senior qualitative data analyst. You are given a CODEBOOK and the KEY STATISTICS (post counts and code frequencies) already computed from a classification report. Use them to produce a structured, comprehensive **Analytical Summary**.
 
     **SUMMARY GENERATION INSTRUCTIONS:**
     * The analysis must focus on connecting the code frequencies to the central themes: **Adult Retrospection** and **Current Student Perception**.
-    * The final output must strictly follow the Markdown structure below, incorporating the counts you calculated in Section 1.
+    * Use the counts exactly as given; do not recount them.
+    * The final output must strictly follow the Markdown structure below.
 
     **STRICT OUTPUT INSTRUCTION:** Provide ONLY the content for the analytical summary, using the Markdown headings specified below. Do not include any introductory or concluding conversational text.
-    
-    ### 1. Key Statistics and Code Frequency
-    * **Total Posts Analyzed:** [Your calculated count]
-    * **Total Posts Classified:** [Your calculated count]
-    * **Full Code Frequency List:** (List ALL codes and their exact counts, sorted high to low, one entry per line)
 
     ### 2. Thematic Interpretation
     (Provide a concise, insightful paragraph for the top three most frequent Codes/Code Families, interpreting what this frequency suggests about the lasting effects (Adult Retrospection) and/or immediate experience (Current Student Perception) of bullying.)
@@ -142,24 +229,274 @@ def generate_summary(codebook: str, classification_report: str) -> str:
     ### 3. Conclusion and Key Takeaways
     (Summarize the core finding in one to two sentences. Identify a maximum of two specific, actionable insights or suggestions for further research based on the strongest patterns.)
     """
-    
+
+    report = ""
+    if classification_report is not None:
+        report = f"""
+    CLASSIFICATION REPORT:
+    {classification_report}
+    """
     user_prompt = f"""
-    Please perform the counting task on the CLASSIFICATION REPORT and then generate the Analytical Summary based on the CODEBOOK and your calculated counts.
+    Please generate the Analytical Summary based on the CODEBOOK and the KEY STATISTICS.
 
     CODEBOOK:
     {codebook}
 
-    CLASSIFICATION REPORT:
-    {classification_report}
-    """
-    
-    return get_client(system_prompt, user_prompt)
+    KEY STATISTICS:
+    {statistics}
+    {report}"""
+
+    return system_prompt, user_prompt
+
+
+def generate_summary(codebook: str, classification_report: str) -> str:
+    statistics = format_statistics(tally_classifications(classification_report))
+    interpretation = get_client(*summary_prompts(codebook, statistics, classification_report))
+    return f"{statistics}\n\n{interpretation}"
+
+# --- Map-Reduce Mode ---
+
+def split_posts(posts_content: str, separator: str = POST_SEPARATOR) -> list[str]:
+    return [post.strip() for post in re.split(separator, posts_content) if post.strip()]
+
+
+def chunk_texts(texts: list[str], max_tokens: int = CHUNK_TOKENS) -> list[list[str]]:
+    """Pack texts in order into chunks of at most max_tokens (estimated). A
+    text larger than that gets a chunk of its own rather than being cut."""
+    chunks = []
+    current = []
+    size = 0
+    for text in texts:
+        tokens = estimate_tokens(text)
+        if current and size + tokens > max_tokens:
+            chunks.append(current)
+            current = []
+            size = 0
+        current.append(text)
+        size += tokens
+    if current:
+        chunks.append(current)
+    return chunks
+
+
+def cache_key(model: str, system_prompt: str, user_prompt: str) -> str:
+    return hashlib.sha256(json.dumps([model, system_prompt, user_prompt]).encode('utf-8')).hexdigest()
+
+
+def read_cache(cache_dir: str, key: str):
+    try:
+        with open(os.path.join(cache_dir, f"{key}.json"), 'r', encoding='utf-8') as f:
+            return json.load(f)['content']
+    except (OSError, ValueError, KeyError):
+        return None
+
+
+def write_cache(cache_dir: str, key: str, model: str, content: str):
+    os.makedirs(cache_dir, exist_ok=True)
+    path = os.path.join(cache_dir, f"{key}.json")
+    with open(path + '.tmp', 'w', encoding='utf-8') as f:
+        json.dump({'model': model, 'content': content}, f)
+    os.replace(path + '.tmp', path)
+
+
+class LLMPool:
+    """Chat completions through one shared async client, at most concurrency
+    at a time, with exponential backoff on rate limits and transient errors
+    and an on-disk response cache."""
+
+    def __init__(self, model: str = FREE_MODEL, concurrency: int = CONCURRENCY, retries: int = MAX_RETRIES,
+                 cache_dir: str = CACHE_DIR):
+        self.model = model
+        self.retries = retries
+        self.cache_dir = cache_dir
+        self.concurrency = concurrency
+        self.semaphore = asyncio.Semaphore(concurrency)
+        # Retries are done here so they also wait for a free slot
+        self.client = AsyncOpenAI(api_key=OPENROUTER_API_KEY, base_url=OPENROUTER_URL, max_retries=0)
+        self.calls = 0
+        self.cache_hits = 0
+
+    async def complete(self, system_prompt: str, user_prompt: str) -> str:
+        key = cache_key(self.model, system_prompt, user_prompt)
+        cached = read_cache(self.cache_dir, key)
+        if cached is not None:
+            self.cache_hits += 1
+            return cached
+
+        async with self.semaphore:
+            for attempt in range(self.retries + 1):
+                try:
+                    self.calls += 1
+                    response = await self.client.chat.completions.create(
+                        model=self.model,
+                        messages=[
+                            {"role": "system", "content": system_prompt},
+                            {"role": "user", "content": user_prompt},
+                        ],
+                        temperature=0.05,
+                    )
+                    break
+                except RETRYABLE_ERRORS as e:
+                    if attempt == self.retries:
+                        raise
+                    delay = BACKOFF_SEC * 2 ** attempt * random.uniform(0.5, 1.5)
+                    print(f"  {type(e).__name__}, retrying in {delay:.1f}s")
+                    await asyncio.sleep(delay)
+
+        content = response.choices[0].message.content or ""
+        if content:
+            write_cache(self.cache_dir, key, self.model, content)
+        return content
+
+    async def complete_all(self, prompts, label: str) -> list[str]:
+        """Responses to prompts, in order. prompts may be a lazy iterable:
+        it is only read as far as 2 * concurrency prompts ahead of the
+        requests in flight, so a corpus streamed from the database is never
+        held in memory as a whole."""
+        window = self.concurrency * 2
+        results = []
+        pending = set()
+
+        async def run(i, prompt):
+            try:
+                results[i] = await self.complete(*prompt)
+            except Exception as e:
+                results[i] = e
+
+        for i, prompt in enumerate(prompts):
+            if len(pending) >= window:
+                _, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            results.append(None)
+            pending.add(asyncio.ensure_future(run(i, prompt)))
+        if pending:
+            await asyncio.wait(pending)
+
+        failed = [i for i, result in enumerate(results, start=1) if isinstance(result, Exception)]
+        if failed:
+            for i in failed:
+                print(f"  {label} chunk {i} failed: {results[i - 1]}")
+            raise RuntimeError(f"{len(failed)} of {len(results)} {label} chunk(s) failed; "
+                               f"rerun to retry them (finished chunks are cached)")
+        return results
+
+    async def close(self):
+        await self.client.close()
+
+
+async def merge_codebooks(pool: LLMPool, codebooks: list[str], max_tokens: int) -> str:
+    # Merge in token-bounded groups until one codebook is left
+    while len(codebooks) > 1:
+        groups = chunk_texts(codebooks, max_tokens)
+        if len(groups) == len(codebooks):
+            groups = [codebooks[i:i + 2] for i in range(0, len(codebooks), 2)]
+        print(f"Merging {len(codebooks)} partial codebooks in {len(groups)} group(s)")
+        merged = await pool.complete_all(
+            [merge_codebook_prompts(group) for group in groups if len(group) > 1], "merge")
+        merged = iter(merged)
+        codebooks = [next(merged) if len(group) > 1 else group[0] for group in groups]
+    return codebooks[0]
+
+
+async def run_map_reduce(posts_content: str, model: str = FREE_MODEL, chunk_tokens: int = CHUNK_TOKENS,
+                         concurrency: int = CONCURRENCY, retries: int = MAX_RETRIES, cache_dir: str = CACHE_DIR,
+                         separator: str = POST_SEPARATOR) -> tuple[str, str, str]:
+    """Codebook, classification report and summary for a corpus of any size.
+    Returns (codebook, classification_report, summary)."""
+    posts = split_posts(posts_content, separator)
+    chunks = ["\n\n".join(chunk) for chunk in chunk_texts(posts, chunk_tokens)]
+    print(f"Split {len(posts)} post(s) into {len(chunks)} chunk(s) of up to ~{chunk_tokens} tokens")
+    return await run_map_reduce_chunks(chunks, model, chunk_tokens, concurrency, retries, cache_dir)
+
+
+async def run_map_reduce_chunks(chunks, model: str = FREE_MODEL, chunk_tokens: int = CHUNK_TOKENS,
+                                concurrency: int = CONCURRENCY, retries: int = MAX_RETRIES,
+                                cache_dir: str = CACHE_DIR) -> tuple[str, str, str]:
+    """run_map_reduce for posts that are already chunked. chunks is a list,
+    or a function returning a fresh iterable of chunks (for example over
+    post_export.iter_chunks), which is read lazily, once per step."""
+    read_chunks = chunks if callable(chunks) else lambda: chunks
+    pool = LLMPool(model, concurrency, retries, cache_dir)
+
+    try:
+        print("\n\n=== Executing Step 1: Generating Codebook ===")
+        partials = await pool.complete_all((codebook_prompts(chunk) for chunk in read_chunks()), "codebook")
+        print(f"Read {len(partials)} chunk(s) of up to ~{chunk_tokens} tokens")
+        codebook = await merge_codebooks(pool, partials, chunk_tokens)
+
+        print("\n\n=== Executing Step 2: Classifying Posts ===")
+        reports = await pool.complete_all((classification_prompts(codebook, chunk) for chunk in read_chunks()),
+                                          "classification")
+        classification_report = "\n\n".join(report.strip() for report in reports)
+
+        print("\n\n=== Executing Step 3: Generating Summary ===")
+        statistics = format_statistics(tally_classifications(classification_report))
+        # The whole report is only sent along when it fits in one chunk
+        report = classification_report if estimate_tokens(classification_report) <= chunk_tokens else None
+        interpretation = await pool.complete(*summary_prompts(codebook, statistics, report))
+        summary = f"{statistics}\n\n{interpretation}"
+    finally:
+        await pool.close()
+
+    print(f"\n{pool.calls} API call(s), {pool.cache_hits} cached response(s)")
+    return codebook, classification_report, summary
 
 # --- Main Execution ---
 
+def parse_args():
+    parser = argparse.ArgumentParser(description="Generate a codebook, classification report and summary for posts")
+    parser.add_argument("--posts", default="posts.txt", help="Text file with the posts")
+    parser.add_argument("--model", default=FREE_MODEL, help="Model for --map-reduce mode")
+    parser.add_argument("--map-reduce", action="store_true",
+                        help="Split the posts into chunks and process them concurrently with cached responses")
+    parser.add_argument("--chunk-tokens", type=int, default=CHUNK_TOKENS,
+                        help="Approximate prompt size per chunk in --map-reduce mode")
+    parser.add_argument("--concurrency", type=int, default=CONCURRENCY, help="Max requests in flight")
+    parser.add_argument("--retries", type=int, default=MAX_RETRIES, help="Retries on rate limits and server errors")
+    parser.add_argument("--cache-dir", default=CACHE_DIR, help="Where --map-reduce caches responses")
+    parser.add_argument("--separator", default=POST_SEPARATOR,
+                        help="Regex between posts in the posts file (default: a blank line)")
+    parser.add_argument("--from-db", action="store_true",
+                        help="Read posts straight from --db with post_export filters instead of --posts "
+                             "(implies --map-reduce)")
+    post_export.add_filter_arguments(parser)
+    return parser.parse_args()
+
+
+def run_map_reduce_main(args, posts_content):
+    if args.from_db:
+        conn = compact_db.connect(args.db)
+        print(f"Streaming posts from {args.db}")
+
+        def chunks():
+            # Keyset-paged and packed as the requests go out; the posts are
+            # read once for the codebook and once for the classification
+            return post_export.iter_chunks(post_export.iter_posts_from_args(conn, args), args.chunk_tokens)
+
+        pipeline = run_map_reduce_chunks(chunks, args.model, args.chunk_tokens, args.concurrency, args.retries,
+                                         args.cache_dir)
+    else:
+        pipeline = run_map_reduce(posts_content, args.model, args.chunk_tokens, args.concurrency, args.retries,
+                                  args.cache_dir, args.separator)
+    try:
+        codebook_output, classification_output, summary_output = asyncio.run(pipeline)
+    finally:
+        if args.from_db:
+            conn.close()
+    write_to_file("1_codebook.txt", codebook_output)
+    write_to_file("2_classification_report.txt", classification_output)
+    write_to_file("3_analytical_summary.txt", summary_output)
+    print("Pipeline Complete. Review the new files created.")
+
+
 def main():    
+    args = parse_args()
     try:
-        POSTS_CONTENT = load_posts_content()
+        POSTS_CONTENT = "" if args.from_db else load_posts_content(args.posts)
+
+        if args.map_reduce or args.from_db:
+            print(f"Starting map-reduce analysis pipeline using {args.model}.")
+            run_map_reduce_main(args, POSTS_CONTENT)
+            return
         
         print(f"Starting OpenRouter analysis pipeline using the free model: {FREE_MODEL} (Minimal Implementation).")
 
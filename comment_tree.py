@@ -0,0 +1,227 @@
+import sqlite3
+import argparse
+import time
+
+DB_PATH = "reddit_data.db"
+
+# Each level of the materialized path is a fixed-width base36 ordinal, so
+# sorting by path gives the thread in depth-first order (children by
+# created_utc). Four characters allow 1.6M replies per parent.
+PATH_DIGITS = 4
+BASE36 = "0123456789abcdefghijklmnopqrstuvwxyz"
+
+
+def create_tree_table(conn):
+    cursor = conn.cursor()
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS comment_tree (
+        comment_id TEXT PRIMARY KEY,
+        link_id TEXT,
+        parent_comment_id TEXT,
+        depth INTEGER,
+        path TEXT,
+        child_count INTEGER,
+        descendant_count INTEGER
+    )
+    ''')
+    cursor.execute('CREATE UNIQUE INDEX IF NOT EXISTS idx_comment_tree_link_path ON comment_tree(link_id, path)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_comment_tree_parent ON comment_tree(parent_comment_id)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_comments_parent_id ON comments(parent_id)')
+    # Threads that got new or changed comments since they were laid out.
+    # The importer adds to it once comment_tree exists; refresh_stale()
+    # rebuilds just those threads.
+    cursor.execute('CREATE TABLE IF NOT EXISTS comment_tree_stale (link_id TEXT PRIMARY KEY) WITHOUT ROWID')
+    conn.commit()
+
+
+def enabled(conn):
+    cursor = conn.cursor()
+    cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'comment_tree'")
+    return cursor.fetchone() is not None
+
+
+def mark_stale(cursor, link_ids):
+    cursor.executemany('INSERT OR IGNORE INTO comment_tree_stale (link_id) VALUES (?)',
+                       [(link_id,) for link_id in set(link_ids) if link_id])
+
+
+def refresh_stale(conn):
+    """Rebuild the threads marked stale by imports; returns how many."""
+    cursor = conn.cursor()
+    cursor.execute('SELECT link_id FROM comment_tree_stale')
+    link_ids = [row[0] for row in cursor.fetchall()]
+    if not link_ids:
+        return 0
+    build_comment_tree(conn, link_ids)
+    cursor.executemany('DELETE FROM comment_tree_stale WHERE link_id = ?', [(l,) for l in link_ids])
+    conn.commit()
+    return len(link_ids)
+
+
+def encode_ordinal(n):
+    digits = []
+    for _ in range(PATH_DIGITS):
+        n, r = divmod(n, 36)
+        digits.append(BASE36[r])
+    return "".join(reversed(digits))
+
+
+def build_thread(link_id, comments):
+    """Lay out one thread.
+
+    comments is a list of (id, parent_id, created_utc) for a single link_id.
+    Returns comment_tree rows. A comment whose parent is not in the database
+    (deleted, or in a month that was not imported) is placed at the top level
+    but keeps its real parent_comment_id.
+    """
+    known = {comment_id for comment_id, _, _ in comments}
+    children = {}
+    parents = {}
+
+    for comment_id, parent_id, created_utc in comments:
+        parent = None
+        if parent_id and parent_id.startswith("t1_"):
+            parent = parent_id[3:]
+        parents[comment_id] = parent
+        key = parent if parent in known else None
+        children.setdefault(key, []).append((created_utc or 0, comment_id))
+
+    rows = []
+    descendants = {}
+
+    # Iterative DFS: viral threads can be thousands of levels deep
+    stack = [(comment_id, 0, "", ordinal)
+             for ordinal, (_, comment_id) in enumerate(sorted(children.get(None, [])))]
+    stack.reverse()
+    order = []
+    while stack:
+        comment_id, depth, prefix, ordinal = stack.pop()
+        path = prefix + encode_ordinal(ordinal)
+        kids = sorted(children.get(comment_id, []))
+        order.append((comment_id, depth, path, len(kids)))
+        for kid_ordinal in range(len(kids) - 1, -1, -1):
+            stack.append((kids[kid_ordinal][1], depth + 1, path + ".", kid_ordinal))
+
+    # Pre-order reversed visits children before parents
+    for comment_id, _, _, _ in reversed(order):
+        total = 0
+        for _, kid in children.get(comment_id, []):
+            total += 1 + descendants.get(kid, 0)
+        descendants[comment_id] = total
+
+    for comment_id, depth, path, child_count in order:
+        rows.append((comment_id, link_id, parents[comment_id], depth, path, child_count, descendants[comment_id]))
+    return rows
+
+
+def _iter_threads(conn, link_ids=None, chunk_threads=1000):
+    # Keyset pages over the link_id index; every page is fetched completely
+    # so no read cursor is left open while comment_tree is being written.
+    cursor = conn.cursor()
+    if link_ids is not None:
+        for link_id in link_ids:
+            cursor.execute('SELECT id, parent_id, created_utc FROM comments WHERE link_id = ?', (link_id,))
+            yield link_id, cursor.fetchall()
+        return
+
+    last = ""
+    while True:
+        cursor.execute('''
+        SELECT DISTINCT link_id FROM comments WHERE link_id > ? ORDER BY link_id LIMIT ?
+        ''', (last, chunk_threads))
+        page = [row[0] for row in cursor.fetchall()]
+        if not page:
+            return
+
+        cursor.execute('''
+        SELECT link_id, id, parent_id, created_utc FROM comments
+        WHERE link_id BETWEEN ? AND ? ORDER BY link_id
+        ''', (page[0], page[-1]))
+        threads = {}
+        for link_id, comment_id, parent_id, created_utc in cursor.fetchall():
+            threads.setdefault(link_id, []).append((comment_id, parent_id, created_utc))
+        yield from threads.items()
+        last = page[-1]
+
+
+def build_comment_tree(conn, link_ids=None, batch_rows=100000):
+    """Materialize comment_tree for every thread, or only for link_ids."""
+    create_tree_table(conn)
+    start = time.perf_counter()
+    cursor = conn.cursor()
+
+    if link_ids is None:
+        cursor.execute('DELETE FROM comment_tree')
+        cursor.execute('DELETE FROM comment_tree_stale')
+    else:
+        link_ids = list(link_ids)
+        cursor.executemany('DELETE FROM comment_tree WHERE link_id = ?', [(l,) for l in link_ids])
+
+    pending = []
+    threads = 0
+    rows_written = 0
+    for link_id, comments in _iter_threads(conn, link_ids):
+        pending.extend(build_thread(link_id, comments))
+        threads += 1
+        if len(pending) >= batch_rows:
+            cursor.executemany('INSERT OR REPLACE INTO comment_tree VALUES (?, ?, ?, ?, ?, ?, ?)', pending)
+            conn.commit()
+            rows_written += len(pending)
+            print(f"  Built {threads} threads ({rows_written} comments)...")
+            pending = []
+
+    if pending:
+        cursor.executemany('INSERT OR REPLACE INTO comment_tree VALUES (?, ?, ?, ?, ?, ?, ?)', pending)
+        rows_written += len(pending)
+    conn.commit()
+
+    print(f"Built comment tree for {threads} threads ({rows_written} comments) "
+          f"in {time.perf_counter() - start:.1f}s")
+
+
+def get_thread(conn, link_id):
+    """Return a whole thread in depth-first order with one range scan on
+    (link_id, path). Each row: (id, parent_comment_id, depth, path,
+    child_count, descendant_count, author, body, score, created_utc)."""
+    link_id = link_id[3:] if link_id.startswith("t3_") else link_id
+    cursor = conn.cursor()
+    cursor.execute('''
+    SELECT t.comment_id, t.parent_comment_id, t.depth, t.path, t.child_count, t.descendant_count,
+           c.author, c.body, c.score, c.created_utc
+    FROM comment_tree t
+    JOIN comments c ON c.id = t.comment_id
+    WHERE t.link_id = ?
+    ORDER BY t.path
+    ''', (link_id,))
+    return cursor.fetchall()
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Precompute comment thread structure")
+    parser.add_argument("--db", default=DB_PATH, help="SQLite database path")
+    parser.add_argument("--links", nargs="*", default=None, help="Only rebuild these submission ids")
+    parser.add_argument("--thread", default=None, help="Print one thread instead of building")
+    parser.add_argument("--stale", action="store_true",
+                        help="Only rebuild the threads that imports have changed since the last build")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    conn = sqlite3.connect(args.db)
+
+    if args.thread:
+        for row in get_thread(conn, args.thread):
+            comment_id, _, depth, _, _, _, author, body, score, _ = row
+            text = (body or "").replace("\n", " ")[:80]
+            print(f"{'  ' * depth}[{score}] {author} ({comment_id}): {text}")
+    elif args.stale:
+        print(f"Rebuilt {refresh_stale(conn)} stale thread(s)")
+    else:
+        build_comment_tree(conn, args.links)
+
+    conn.close()
+
+
+if __name__ == "__main__":
+    main()
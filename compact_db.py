@@ -0,0 +1,409 @@
+import sqlite3
+import argparse
+import os
+import re
+import time
+
+import zstandard as zstd
+
+from reddit_import_script import TABLE_COLUMNS
+
+DB_PATH = "reddit_data.db"
+COMPACT_DB_PATH = "reddit_data_compact.db"
+
+BASE36 = "0123456789abcdefghijklmnopqrstuvwxyz"
+# Only ids that survive a decode/encode round trip can become integers
+BASE36_ID_RE = re.compile(r'^(0|[1-9a-z][0-9a-z]*)$')
+
+# Text columns stored zstd-compressed with the shared dictionary. A value
+# that does not get smaller stays plain TEXT; the BLOB column affinity keeps
+# both as they are and unzstd() tells them apart by type.
+COMPRESSED_COLUMNS = {
+    'submissions': ['title', 'selftext', 'permalink'],
+    'comments': ['body'],
+}
+
+DICT_SIZE = 112640
+DICT_SAMPLES = 20000
+COMPRESSION_LEVEL = 9
+
+COMPACT_INDEXES = [
+    ('idx_submissions_compact_subreddit', 'submissions_compact(subreddit_id)'),
+    ('idx_submissions_compact_author', 'submissions_compact(author_id)'),
+    ('idx_submissions_compact_created', 'submissions_compact(created_utc)'),
+    ('idx_comments_compact_link_id', 'comments_compact(link_id)'),
+    ('idx_comments_compact_author', 'comments_compact(author_id)'),
+    ('idx_comments_compact_subreddit', 'comments_compact(subreddit_id)'),
+    ('idx_comments_compact_parent', 'comments_compact(parent_ref)'),
+]
+
+# Rows whose id, link_id or parent_id cannot become an integer are copied
+# as they are into <kind>_unconverted (the original columns, keyed by the
+# TEXT id), so the compact copy still holds every row of the source
+UNCONVERTED_TABLES = {kind: f'{kind}_unconverted' for kind in TABLE_COLUMNS}
+
+
+def base36_encode(n):
+    if n is None:
+        return None
+    digits = []
+    while True:
+        n, r = divmod(n, 36)
+        digits.append(BASE36[r])
+        if not n:
+            return "".join(reversed(digits))
+
+
+def base36_decode(value, prefix=None):
+    """Reddit id (optionally with a t1_/t3_ prefix) to int, or None if it
+    would not encode back to the same string."""
+    if value is None:
+        return None
+    if prefix is not None:
+        if not value.startswith(prefix):
+            return None
+        value = value[len(prefix):]
+    if not BASE36_ID_RE.match(value):
+        return None
+    return int(value, 36)
+
+
+def encode_parent(parent_id):
+    # Comment parents are t1_ (comment) or t3_ (submission); the kind goes
+    # into the low bit so one indexed integer column holds both
+    if not parent_id:
+        return None
+    if parent_id.startswith('t1_'):
+        n, is_link = base36_decode(parent_id, 't1_'), 0
+    else:
+        n, is_link = base36_decode(parent_id, 't3_'), 1
+    return None if n is None else n * 2 + is_link
+
+
+def create_compact_schema(conn):
+    cursor = conn.cursor()
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS subreddit_names (
+        id INTEGER PRIMARY KEY,
+        name TEXT UNIQUE
+    )
+    ''')
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS author_names (
+        id INTEGER PRIMARY KEY,
+        name TEXT UNIQUE
+    )
+    ''')
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS compression_dict (
+        id INTEGER PRIMARY KEY,
+        dict BLOB
+    )
+    ''')
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS submissions_compact (
+        id INTEGER PRIMARY KEY,
+        subreddit_id INTEGER,
+        title BLOB,
+        selftext BLOB,
+        author_id INTEGER,
+        created_utc INTEGER,
+        score INTEGER,
+        num_comments INTEGER,
+        is_self BOOLEAN,
+        retrieved_on INTEGER,
+        stickied BOOLEAN,
+        over_18 BOOLEAN,
+        spoiler BOOLEAN,
+        locked BOOLEAN,
+        distinguished TEXT,
+        permalink BLOB,
+        has_image BOOLEAN,
+        image_url TEXT
+    )
+    ''')
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS comments_compact (
+        id INTEGER PRIMARY KEY,
+        subreddit_id INTEGER,
+        body BLOB,
+        author_id INTEGER,
+        created_utc INTEGER,
+        score INTEGER,
+        link_id INTEGER,
+        parent_ref INTEGER,
+        retrieved_on INTEGER,
+        stickied BOOLEAN,
+        distinguished TEXT,
+        controversiality INTEGER
+    )
+    ''')
+    for kind, columns in TABLE_COLUMNS.items():
+        cursor.execute(f'''
+        CREATE TABLE IF NOT EXISTS {UNCONVERTED_TABLES[kind]} (
+            {columns[0]} TEXT PRIMARY KEY, {', '.join(columns[1:])}
+        )
+        ''')
+    conn.commit()
+
+
+# The SELECTs behind the compatibility views, with the alias of the
+# _compact table in each
+VIEW_SELECTS = {
+    'submissions': ('s', '''
+    SELECT base36(s.id) AS id, r.name AS subreddit, unzstd(s.title) AS title,
+           unzstd(s.selftext) AS selftext, a.name AS author, s.created_utc, s.score,
+           s.num_comments, s.is_self, s.retrieved_on, s.stickied, s.over_18, s.spoiler,
+           s.locked, s.distinguished, unzstd(s.permalink) AS permalink, s.has_image, s.image_url
+    FROM submissions_compact s
+    LEFT JOIN subreddit_names r ON r.id = s.subreddit_id
+    LEFT JOIN author_names a ON a.id = s.author_id
+    '''),
+    'comments': ('c', '''
+    SELECT base36(c.id) AS id, r.name AS subreddit, unzstd(c.body) AS body, a.name AS author,
+           c.created_utc, c.score, COALESCE(base36(c.link_id), '') AS link_id,
+           COALESCE(CASE c.parent_ref % 2 WHEN 1 THEN 't3_' ELSE 't1_' END || base36(c.parent_ref / 2), '')
+               AS parent_id,
+           c.retrieved_on, c.stickied, c.distinguished, c.controversiality
+    FROM comments_compact c
+    LEFT JOIN subreddit_names r ON r.id = c.subreddit_id
+    LEFT JOIN author_names a ON a.id = c.author_id
+    '''),
+}
+
+
+def create_compat_views(conn):
+    # Same names and columns as the regular schema. They need the functions
+    # registered by connect(), and lookups by id through a view cannot use
+    # the primary key: read those through lookup_source() instead.
+    cursor = conn.cursor()
+    for kind, (_, select) in VIEW_SELECTS.items():
+        cursor.execute(f'CREATE VIEW IF NOT EXISTS {kind} AS {select} '
+                       f'UNION ALL SELECT * FROM {UNCONVERTED_TABLES[kind]}')
+    conn.commit()
+
+
+def lookup_source(conn, kind, column):
+    """(source, binds) for reading the rows of kind whose id or link_id
+    (column) equals one value: use FROM {source} and bind the value binds
+    times. On a compact copy the source filters the _compact table on its
+    integer index rather than going through the view, which would scan it;
+    on a regular database it is the table itself."""
+    cursor = conn.cursor()
+    cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'view' AND name = ?", (kind,))
+    if cursor.fetchone() is None:
+        return f'(SELECT * FROM {kind} WHERE {column} = ?)', 1
+    alias, select = VIEW_SELECTS[kind]
+    return (f'({select} WHERE {alias}.{column} = base36_decode(?) '
+            f'UNION ALL SELECT * FROM {UNCONVERTED_TABLES[kind]} WHERE {column} = ?)'), 2
+
+
+def register_functions(conn):
+    """Register base36(n), base36_decode(text) and unzstd(value), which the
+    views of a compact database call, on conn. Leaves a regular database's
+    connection alone, so readers can open any database through connect()."""
+    try:
+        row = conn.execute('SELECT dict FROM compression_dict ORDER BY id LIMIT 1').fetchone()
+    except sqlite3.OperationalError:
+        return conn
+    if row is not None:
+        decompressor = zstd.ZstdDecompressor(dict_data=zstd.ZstdCompressionDict(row[0]))
+    else:
+        decompressor = zstd.ZstdDecompressor()
+
+    def unzstd(value):
+        if isinstance(value, bytes):
+            return decompressor.decompress(value).decode('utf-8')
+        return value
+
+    conn.create_function('base36', 1, base36_encode, deterministic=True)
+    conn.create_function('base36_decode', 1, base36_decode, deterministic=True)
+    conn.create_function('unzstd', 1, unzstd, deterministic=True)
+    return conn
+
+
+def connect(db_path=COMPACT_DB_PATH, **kwargs):
+    """sqlite3.connect(db_path, **kwargs) with register_functions() applied.
+    A plain sqlite3 connection to a compact database fails with "no such
+    function" as soon as it reads a view."""
+    return register_functions(sqlite3.connect(db_path, **kwargs))
+
+
+def train_text_dictionary(source, dict_size=DICT_SIZE, samples=DICT_SAMPLES):
+    """Train one zstd dictionary on an evenly spaced sample of the text
+    columns. Returns None if there is too little text to train on."""
+    cursor = source.cursor()
+    texts = []
+    for kind, columns in COMPRESSED_COLUMNS.items():
+        cursor.execute(f'SELECT MAX(rowid) FROM {kind}')
+        max_rowid = cursor.fetchone()[0] or 0
+        step = max(max_rowid // samples, 1)
+        cursor.execute(f'''
+        SELECT {', '.join(columns)} FROM {kind} WHERE rowid % ? = 0 LIMIT ?
+        ''', (step, samples))
+        for row in cursor.fetchall():
+            texts.extend(value.encode('utf-8') for value in row if value)
+
+    try:
+        return zstd.train_dictionary(dict_size, texts)
+    except zstd.ZstdError as e:
+        print(f"Not enough text to train a dictionary ({e}), compressing without one")
+        return None
+
+
+class _Interner:
+    # name -> integer key, backed by one of the *_names tables
+    def __init__(self, conn, table):
+        self.table = table
+        self.ids = {name: key for key, name in conn.execute(f'SELECT id, name FROM {table}')}
+        self.pending = []
+
+    def __call__(self, name):
+        if name is None:
+            return None
+        key = self.ids.get(name)
+        if key is None:
+            key = len(self.ids) + 1
+            self.ids[name] = key
+            self.pending.append((key, name))
+        return key
+
+    def flush(self, cursor):
+        cursor.executemany(f'INSERT INTO {self.table} (id, name) VALUES (?, ?)', self.pending)
+        self.pending = []
+
+
+def _compress(compressor, value):
+    if not value:
+        return value
+    data = compressor.compress(value.encode('utf-8'))
+    return data if len(data) < len(value.encode('utf-8')) else value
+
+
+def compact_submission(row, subreddits, authors, compressor):
+    (id_, subreddit, title, selftext, author, created_utc, score, num_comments, is_self, retrieved_on,
+     stickied, over_18, spoiler, locked, distinguished, permalink, has_image, image_url) = row
+    key = base36_decode(id_)
+    if key is None:
+        return None
+    return (key, subreddits(subreddit), _compress(compressor, title), _compress(compressor, selftext),
+            authors(author), created_utc, score, num_comments, is_self, retrieved_on, stickied, over_18,
+            spoiler, locked, distinguished, _compress(compressor, permalink), has_image, image_url)
+
+
+def compact_comment(row, subreddits, authors, compressor):
+    (id_, subreddit, body, author, created_utc, score, link_id, parent_id, retrieved_on,
+     stickied, distinguished, controversiality) = row
+    # The importer stores link_id without its t3_ prefix, and a missing
+    # link_id/parent_id as '', which becomes NULL here
+    key = base36_decode(id_)
+    link = base36_decode(link_id)
+    parent = encode_parent(parent_id)
+    if key is None or (link_id and link is None) or (parent_id and parent is None):
+        return None
+    return (key, subreddits(subreddit), _compress(compressor, body), authors(author), created_utc, score,
+            link, parent, retrieved_on, stickied, distinguished, controversiality)
+
+
+COMPACT_ROW = {
+    'submissions': compact_submission,
+    'comments': compact_comment,
+}
+
+
+def convert_table(source, target, kind, subreddits, authors, compressor, batch_size=50000):
+    compact = COMPACT_ROW[kind]
+    read = source.cursor()
+    write = target.cursor()
+    placeholders = ', '.join('?' for _ in TABLE_COLUMNS[kind])
+    last_rowid = 0
+    converted = 0
+    unconverted = 0
+
+    while True:
+        read.execute(f'SELECT rowid, * FROM {kind} WHERE rowid > ? ORDER BY rowid LIMIT ?',
+                     (last_rowid, batch_size))
+        rows = read.fetchall()
+        if not rows:
+            break
+        last_rowid = rows[-1][0]
+
+        batch = []
+        kept = []
+        for row in rows:
+            compacted = compact(row[1:], subreddits, authors, compressor)
+            if compacted is None:
+                kept.append(row[1:])
+            else:
+                batch.append(compacted)
+
+        subreddits.flush(write)
+        authors.flush(write)
+        write.executemany(f'INSERT OR REPLACE INTO {kind}_compact VALUES ({placeholders})', batch)
+        write.executemany(f'INSERT OR REPLACE INTO {UNCONVERTED_TABLES[kind]} VALUES ({placeholders})', kept)
+        target.commit()
+        converted += len(batch)
+        unconverted += len(kept)
+        print(f"  Converted {converted} {kind}...")
+
+    print(f"Converted {converted} {kind}" + (f", and copied {unconverted} whose ids are not plain base36 "
+                                             f"unchanged to {UNCONVERTED_TABLES[kind]}" if unconverted else ""))
+    return converted, unconverted
+
+
+def convert(source_path, target_path, batch_size=50000, level=COMPRESSION_LEVEL):
+    """Build a compact copy of an imported database at target_path."""
+    if os.path.exists(target_path):
+        raise FileExistsError(f"{target_path} already exists")
+
+    start = time.perf_counter()
+    source = sqlite3.connect(f"file:{source_path}?mode=ro", uri=True)
+    target = sqlite3.connect(target_path)
+    for pragma, value in (('journal_mode', 'MEMORY'), ('synchronous', 'OFF')):
+        target.execute(f"PRAGMA {pragma} = {value}")
+    create_compact_schema(target)
+
+    dictionary = train_text_dictionary(source)
+    if dictionary is not None:
+        target.execute('INSERT INTO compression_dict (id, dict) VALUES (1, ?)', (dictionary.as_bytes(),))
+        print(f"Trained a {len(dictionary.as_bytes()) // 1024} KB compression dictionary")
+    compressor = zstd.ZstdCompressor(level=level, dict_data=dictionary, write_dict_id=False)
+
+    subreddits = _Interner(target, 'subreddit_names')
+    authors = _Interner(target, 'author_names')
+    for kind in ('submissions', 'comments'):
+        convert_table(source, target, kind, subreddits, authors, compressor, batch_size)
+
+    for index_name, definition in COMPACT_INDEXES:
+        target.execute(f'CREATE INDEX IF NOT EXISTS {index_name} ON {definition}')
+    create_compat_views(target)
+    for pragma, value in (('journal_mode', 'DELETE'), ('synchronous', 'FULL')):
+        target.execute(f"PRAGMA {pragma} = {value}")
+    target.close()
+    source.close()
+
+    before = os.path.getsize(source_path) / (1024 * 1024)
+    after = os.path.getsize(target_path) / (1024 * 1024)
+    print(f"Compact database: {after:,.1f} MB (was {before:,.1f} MB, {before / after if after else 0:.1f}x smaller) "
+          f"in {time.perf_counter() - start:.1f}s")
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Write a compact copy of an imported database. Its submissions and comments views call "
+                    "Python SQL functions, so open it with compact_db.connect(); the repo's own readers do. "
+                    "A plain sqlite3 connection fails with 'no such function' on the views.")
+    parser.add_argument("--db", default=DB_PATH, help="Database written by reddit_import_script.py")
+    parser.add_argument("--out", default=COMPACT_DB_PATH, help="Compact database to create")
+    parser.add_argument("--batch-size", type=int, default=50000)
+    parser.add_argument("--level", type=int, default=COMPRESSION_LEVEL, help="zstd compression level")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    convert(args.db, args.out, args.batch_size, args.level)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,11 @@
+from datetime import datetime, timezone
+
+
+def parse_timestamp(value):
+    # Unix timestamp or YYYY-MM-DD (UTC); None passes through, so unset
+    # --after/--before options can be handed over as they are
+    if value is None:
+        return None
+    if value.isdigit():
+        return int(value)
+    return int(datetime.strptime(value, '%Y-%m-%d').replace(tzinfo=timezone.utc).timestamp())
@@ -2,26 +2,58 @@ import sqlite3
 import time
 import praw
 import os  
+import re
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
 
-ID = os.environ.get("REDDIT_ID")
-SECRET = os.environ.get("REDDIT_SECRET")
+import requests
 
-if not ID or not SECRET:
-    print("Error: REDDIT_ID and REDDIT_SECRET environment variables not set.")
-    print("Please set them before running the script:")
-    print("  export REDDIT_ID='your_client_id'")
-    print("  export REDDIT_SECRET='your_client_secret'")
-    exit(1)  
+import compact_db
+import rollups
+from reddit_import_script import ensure_authors_table
 
-reddit = praw.Reddit(
-    client_id=ID,
-    client_secret=SECRET,
-    user_agent="userinfo_script"
-)
+ID = os.environ.get("REDDIT_ID")
+SECRET = os.environ.get("REDDIT_SECRET")
 
 DB_PATH = "reddit_data.db"
 BATCH_SIZE = 100
 SLEEP_SEC = 0.3 
+USER_AGENT = "userinfo_script"
+
+# Overridable so the concurrent fetcher can be pointed at a local stub server
+AUTH_URL = os.environ.get("REDDIT_AUTH_URL", "https://www.reddit.com/api/v1/access_token")
+API_URL = os.environ.get("REDDIT_API_URL", "https://oauth.reddit.com")
+MAX_WORKERS = 8
+MAX_RETRIES = 3
+
+DAY = 86400
+# Profiles older than this are due for a refresh
+REFRESH_DAYS = 30
+# Staleness stops adding priority past this age, so a very active user
+# fetched a year ago still outranks a one-post user never fetched at all
+MAX_AGE_DAYS = 365
+# Deleted, suspended and not-found accounts are retried after a long TTL;
+# anything else (network errors, 5xx, rate limits) backs off exponentially
+PERMANENT_TTL_DAYS = 90
+RETRY_BASE_SECONDS = 3600
+RETRY_MAX_SECONDS = 7 * DAY
+PERMANENT_REASON_RE = re.compile(r'suspended_or_none|(?<!\d)40[34](?!\d)')
+
+def check_credentials():
+    if not ID or not SECRET:
+        print("Error: REDDIT_ID and REDDIT_SECRET environment variables not set.")
+        print("Please set them before running the script:")
+        print("  export REDDIT_ID='your_client_id'")
+        print("  export REDDIT_SECRET='your_client_secret'")
+        exit(1)  
+
+def get_reddit():
+    return praw.Reddit(
+        client_id=ID,
+        client_secret=SECRET,
+        user_agent=USER_AGENT
+    )
 
 def create_users_tables(conn):
     cursor = conn.cursor()
@@ -43,37 +75,185 @@ def create_users_tables(conn):
     CREATE TABLE IF NOT EXISTS reddit_users_failed (
         username TEXT PRIMARY KEY,
         reason TEXT,
-        retrieved_on INTEGER
+        retrieved_on INTEGER,
+        failure_class TEXT,
+        attempts INTEGER,
+        next_attempt INTEGER
     )
     ''')
+    # Needed by the retrieved_on lookups in plan_refresh
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_reddit_users_username ON reddit_users(username)')
+
+    # Failures recorded before retry classes existed: classify them and
+    # schedule their first retry from when they failed
+    cursor.execute('PRAGMA table_info(reddit_users_failed)')
+    columns = {row[1] for row in cursor.fetchall()}
+    if 'next_attempt' not in columns:
+        for column in ('failure_class TEXT', 'attempts INTEGER', 'next_attempt INTEGER'):
+            if column.split()[0] not in columns:
+                cursor.execute(f'ALTER TABLE reddit_users_failed ADD COLUMN {column}')
+        conn.create_function('classify_failure', 1, classify_failure, deterministic=True)
+        cursor.execute('''
+        UPDATE reddit_users_failed SET failure_class = classify_failure(reason), attempts = 1
+        ''')
+        cursor.execute(f'''
+        UPDATE reddit_users_failed
+        SET next_attempt = COALESCE(retrieved_on, 0) + CASE failure_class
+            WHEN 'permanent' THEN {PERMANENT_TTL_DAYS * DAY} ELSE {RETRY_BASE_SECONDS} END
+        ''')
     conn.commit()
 
-def get_unique_users(conn):
+def classify_failure(reason):
+    return 'permanent' if reason and PERMANENT_REASON_RE.search(reason) else 'transient'
+
+def retry_delay(failure_class, attempts):
+    if failure_class == 'permanent':
+        return PERMANENT_TTL_DAYS * DAY
+    return min(RETRY_BASE_SECONDS * 2 ** (attempts - 1), RETRY_MAX_SECONDS)
+
+def update_author_activity(conn):
+    # Rows per author for databases without rollups, kept between runs in
+    # author_activity. Each run only counts the rows past the last rowid it
+    # saw, so a refresh costs about as much as what was imported since.
+    # Rows rewritten by --conflict replace get new rowids and are counted
+    # again, which only nudges the fetch priority; a table whose rowids went
+    # backwards (VACUUM renumbers them) is recounted from scratch. The views
+    # of a compact copy (compact_db.py) have no usable rowids and are never
+    # imported into, so they are counted whole, once, keyed by their size.
     cursor = conn.cursor()
+    cursor.execute("SELECT name FROM sqlite_master WHERE type = 'view' AND name IN ('submissions', 'comments')")
+    views = {name for (name,) in cursor.fetchall()}
     cursor.execute('''
-    SELECT DISTINCT author FROM (
-        SELECT author FROM submissions
-        UNION
-        SELECT author FROM comments
-    )
+    CREATE TABLE IF NOT EXISTS author_activity (
+        author TEXT PRIMARY KEY,
+        n INTEGER
+    ) WITHOUT ROWID
     ''')
-    return [row[0] for row in cursor.fetchall() if row[0] != "[deleted]"]
+    cursor.execute('CREATE TABLE IF NOT EXISTS author_activity_state (kind TEXT PRIMARY KEY, last_rowid INTEGER)')
+    cursor.execute('SELECT kind, last_rowid FROM author_activity_state')
+    counted = dict(cursor.fetchall())
+
+    last_rowids = {}
+    for kind in ('submissions', 'comments'):
+        cursor.execute(f'SELECT COUNT(*) FROM {kind}' if kind in views else f'SELECT COALESCE(MAX(rowid), 0) FROM {kind}')
+        last_rowids[kind] = cursor.fetchone()[0]
+    if any(last_rowids[kind] < counted.get(kind, 0) or kind in views and counted.get(kind, 0) not in (0, last_rowids[kind])
+           for kind in last_rowids):
+        cursor.execute('DELETE FROM author_activity')
+        counted = {}
 
-def fetch_and_store_users(conn, usernames):
+    for kind, last_rowid in last_rowids.items():
+        if last_rowid <= counted.get(kind, 0):
+            continue
+        if kind in views:
+            where, params = 'author IS NOT NULL', ()
+        else:
+            where, params = 'rowid > ? AND rowid <= ? AND author IS NOT NULL', (counted.get(kind, 0), last_rowid)
+        cursor.execute(f'''
+        INSERT INTO author_activity (author, n)
+        SELECT author, COUNT(*) FROM {kind}
+        WHERE {where}
+        GROUP BY author
+        ORDER BY author
+        ON CONFLICT(author) DO UPDATE SET n = n + excluded.n
+        ''', params)
+    cursor.executemany('INSERT OR REPLACE INTO author_activity_state (kind, last_rowid) VALUES (?, ?)',
+                       last_rowids.items())
+    conn.commit()
+
+def activity_sql(conn):
+    # Rows per author: from the rollups when they exist, otherwise from
+    # author_activity (see update_author_activity)
+    if rollups.enabled(conn):
+        return 'SELECT author, SUM(submissions + comments) AS n FROM rollup_author_month GROUP BY author'
+    return 'SELECT author, n FROM author_activity'
+
+def plan_refresh(conn, budget=None, refresh_days=REFRESH_DAYS, now=None):
+    """Rank the users that are due and keep the top budget of them in
+    temp.refresh_queue. Due means never fetched, fetched more than
+    refresh_days ago, or failed with its retry time passed. Priority is
+    (rows + 1) * (seconds since the last fetch or attempt, capped at
+    MAX_AGE_DAYS), so active users with old profiles come first. Returns
+    the number of users queued."""
+    now = int(now if now is not None else time.time())
+    if not rollups.enabled(conn):
+        update_author_activity(conn)
     cursor = conn.cursor()
-    total = len(usernames)
+    cursor.execute('DROP TABLE IF EXISTS temp.refresh_queue')
+    cursor.execute('CREATE TEMP TABLE refresh_queue (rank INTEGER PRIMARY KEY, username TEXT)')
+    cursor.execute(f'''
+    INSERT INTO temp.refresh_queue (username)
+    SELECT author FROM (
+        SELECT a.author,
+               COALESCE(act.n, 0) AS n,
+               (SELECT MAX(u.retrieved_on) FROM reddit_users u WHERE u.username = a.author) AS fetched,
+               f.username AS failed, f.retrieved_on AS tried, f.next_attempt
+        FROM authors a
+        LEFT JOIN ({activity_sql(conn)}) act ON act.author = a.author
+        LEFT JOIN reddit_users_failed f ON f.username = a.author
+    )
+    WHERE CASE WHEN failed IS NOT NULL THEN COALESCE(next_attempt, 0) <= :now
+               ELSE fetched IS NULL OR fetched <= :now - :refresh_age END
+    ORDER BY (n + 1) * MIN(:now - COALESCE(tried, fetched, 0), :max_age) DESC, author
+    LIMIT :budget
+    ''', {'now': now, 'refresh_age': int(refresh_days * DAY), 'max_age': MAX_AGE_DAYS * DAY,
+          'budget': -1 if budget is None else budget})
+    conn.commit()
+    cursor.execute('SELECT COUNT(*) FROM temp.refresh_queue')
+    return cursor.fetchone()[0]
 
-    cursor.execute('SELECT username FROM reddit_users')
-    existing_users = set(row[0] for row in cursor.fetchall())
+def iter_refresh_queue(conn, chunk_size=10000):
+    # Keyset pagination over the queue's rank: only one chunk is held in
+    # memory, and no read cursor stays open while batches are written.
+    cursor = conn.cursor()
+    last = 0
+    while True:
+        cursor.execute('SELECT rank, username FROM temp.refresh_queue WHERE rank > ? ORDER BY rank LIMIT ?',
+                       (last, chunk_size))
+        chunk = cursor.fetchall()
+        if not chunk:
+            return
+        for _, username in chunk:
+            yield username
+        last = chunk[-1][0]
 
-    cursor.execute('SELECT username FROM reddit_users_failed')
-    failed_users = set(row[0] for row in cursor.fetchall())
+def write_user_batch(conn, batch_success, batch_failed):
+    cursor = conn.cursor()
+    if batch_success:
+        cursor.executemany('''
+            INSERT OR REPLACE INTO reddit_users
+            (id, username, created_utc, comment_karma, link_karma, is_mod, is_suspended, profile_name, profile_description, retrieved_on)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        ''', batch_success)
+        cursor.executemany('DELETE FROM reddit_users_failed WHERE username = ?',
+                           [(row[1],) for row in batch_success])
+    if batch_failed:
+        # A failure of the same class as last time counts as another
+        # attempt; a different class starts the backoff over
+        previous = {}
+        for i in range(0, len(batch_failed), 500):
+            part = [row[0] for row in batch_failed[i:i + 500]]
+            cursor.execute(f'''
+            SELECT username, failure_class, attempts FROM reddit_users_failed
+            WHERE username IN ({', '.join('?' for _ in part)})
+            ''', part)
+            previous.update((row[0], row[1:]) for row in cursor.fetchall())
 
-    usernames_to_fetch = [u for u in usernames if u not in existing_users and u not in failed_users]
-    removed_count = len(usernames) - len(usernames_to_fetch)
-    if removed_count > 0:
-        print(f"Skipped {removed_count} users already in DB or failed previously.")
+        rows = []
+        for username, reason, retrieved_on in batch_failed:
+            failure_class = classify_failure(reason)
+            last_class, attempts = previous.get(username, (None, 0))
+            attempts = (attempts or 0) + 1 if last_class == failure_class else 1
+            rows.append((username, reason, retrieved_on, failure_class, attempts,
+                         retrieved_on + retry_delay(failure_class, attempts)))
+        cursor.executemany('''
+            INSERT OR REPLACE INTO reddit_users_failed
+            (username, reason, retrieved_on, failure_class, attempts, next_attempt)
+            VALUES (?, ?, ?, ?, ?, ?)
+        ''', rows)
+    conn.commit()
 
+def fetch_and_store_users(conn, usernames, reddit):
     batch_success = []
     batch_failed = []
     batch_count = 0
@@ -81,7 +261,7 @@ def fetch_and_store_users(conn, usernames):
     errors = 0
     skipped = 0
 
-    for i, username in enumerate(usernames_to_fetch, start=1):
+    for i, username in enumerate(usernames, start=1):
         try:
             user = reddit.redditor(username)
             user_id = getattr(user, "id", None)
@@ -115,19 +295,7 @@ def fetch_and_store_users(conn, usernames):
             errors += 1
 
         if len(batch_success) + len(batch_failed) >= BATCH_SIZE:
-            if batch_success:
-                cursor.executemany('''
-                    INSERT OR REPLACE INTO reddit_users
-                    (id, username, created_utc, comment_karma, link_karma, is_mod, is_suspended, profile_name, profile_description, retrieved_on)
-                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-                ''', batch_success)
-            if batch_failed:
-                cursor.executemany('''
-                    INSERT OR REPLACE INTO reddit_users_failed
-                    (username, reason, retrieved_on)
-                    VALUES (?, ?, ?)
-                ''', batch_failed)
-            conn.commit()
+            write_user_batch(conn, batch_success, batch_failed)
             batch_count += 1
             print(f"Batch {batch_count}: Added {additions}, Skipped {skipped}, Errors {errors}")
             batch_success.clear()
@@ -138,28 +306,285 @@ def fetch_and_store_users(conn, usernames):
             time.sleep(SLEEP_SEC)
 
     if batch_success or batch_failed:
-        if batch_success:
-            cursor.executemany('''
-                INSERT OR REPLACE INTO reddit_users
-                (id, username, created_utc, comment_karma, link_karma, is_mod, is_suspended, profile_name, profile_description, retrieved_on)
-                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-            ''', batch_success)
-        if batch_failed:
-            cursor.executemany('''
-                INSERT OR REPLACE INTO reddit_users_failed
-                (username, reason, retrieved_on)
-                VALUES (?, ?, ?)
-            ''', batch_failed)
-        conn.commit()
+        write_user_batch(conn, batch_success, batch_failed)
         batch_count += 1
         print(f"Final Batch {batch_count}: Added {additions}, Skipped {skipped}, Errors {errors}")
 
+class RateLimiter:
+    """Token bucket whose refill rate follows Reddit's X-Ratelimit-* headers.
+
+    Each response reports how many requests are left in the current window
+    and how many seconds until it resets; the rate is set so the remaining
+    budget is spread over the rest of the window. When the budget is gone
+    (or a 429 comes back) every worker waits for the reset.
+    """
+
+    def __init__(self, rate=1.0, burst=10):
+        self.rate = rate
+        self.capacity = burst
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                if now >= self.updated:
+                    self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                    self.updated = now
+                    if self.tokens >= 1:
+                        self.tokens -= 1
+                        return
+                    wait_sec = (1 - self.tokens) / self.rate
+                else:
+                    # Paused until self.updated
+                    wait_sec = self.updated - now
+            time.sleep(wait_sec)
+
+    def pause(self, seconds):
+        with self.lock:
+            self.tokens = 0.0
+            self.updated = max(self.updated, time.monotonic() + seconds)
+
+    def update(self, headers):
+        remaining = headers.get("X-Ratelimit-Remaining")
+        reset = headers.get("X-Ratelimit-Reset")
+        if remaining is None or reset is None:
+            return
+        try:
+            remaining = float(remaining)
+            reset = max(float(reset), 1.0)
+        except ValueError:
+            return
+
+        if remaining < 1:
+            self.pause(reset)
+        else:
+            with self.lock:
+                self.rate = remaining / reset
+
+
+class ApiBudget:
+    """Caps the API requests of one run, retries included, across threads."""
+
+    def __init__(self, limit=None):
+        self.limit = limit
+        self.used = 0
+        self.lock = threading.Lock()
+
+    def take(self):
+        with self.lock:
+            if self.limit is not None and self.used >= self.limit:
+                return False
+            self.used += 1
+            return True
+
+
+# What _access_token can raise: HTTP and connection errors, a body that is
+# not JSON, or JSON without an access_token
+TOKEN_ERRORS = (requests.RequestException, ValueError, KeyError)
+
+
+class RedditUserClient:
+    """Fetches /user/{name}/about over app-only OAuth with plain HTTP.
+
+    Safe to share between threads: each thread gets its own requests
+    session and the access token is refreshed under a lock.
+    """
+
+    def __init__(self, client_id, client_secret, limiter, auth_url=AUTH_URL, api_url=API_URL,
+                 user_agent=USER_AGENT, max_retries=MAX_RETRIES, timeout=30, budget=None):
+        self.client_id = client_id
+        self.client_secret = client_secret
+        self.limiter = limiter
+        self.auth_url = auth_url
+        self.api_url = api_url.rstrip("/")
+        self.user_agent = user_agent
+        self.max_retries = max_retries
+        self.timeout = timeout
+        self.budget = budget
+        self.token = None
+        self.token_expires = 0
+        self.token_lock = threading.Lock()
+        self.local = threading.local()
+
+    def _session(self):
+        session = getattr(self.local, "session", None)
+        if session is None:
+            session = requests.Session()
+            session.headers["User-Agent"] = self.user_agent
+            self.local.session = session
+        return session
+
+    def _access_token(self, force=False):
+        with self.token_lock:
+            if force or not self.token or time.time() >= self.token_expires:
+                response = self._session().post(
+                    self.auth_url,
+                    auth=(self.client_id, self.client_secret),
+                    data={"grant_type": "client_credentials"},
+                    timeout=self.timeout,
+                )
+                response.raise_for_status()
+                payload = response.json()
+                self.token = payload["access_token"]
+                self.token_expires = time.time() + payload.get("expires_in", 3600) - 60
+            return self.token
+
+    def fetch_user(self, username):
+        # Returns ("ok", reddit_users row), ("failed", reddit_users_failed
+        # row), or ("skipped", None) once the run's API budget is spent.
+        # Never raises: a broken token endpoint or response body is a
+        # transient failure of this user, not the end of the run.
+        reason = None
+        for attempt in range(self.max_retries + 1):
+            if self.budget is not None and not self.budget.take():
+                return "skipped", None
+            self.limiter.acquire()
+            try:
+                token = self._access_token()
+            except TOKEN_ERRORS:
+                # Not str(e): an HTTP 403/404 from the token endpoint says
+                # nothing about the user, and would classify as permanent
+                reason = "token_error"
+                time.sleep(2 ** attempt)
+                continue
+            try:
+                response = self._session().get(
+                    f"{self.api_url}/user/{username}/about",
+                    headers={"Authorization": f"bearer {token}"},
+                    params={"raw_json": 1},
+                    timeout=self.timeout,
+                )
+            except requests.RequestException as e:
+                reason = str(e)
+                time.sleep(2 ** attempt)
+                continue
+
+            self.limiter.update(response.headers)
+
+            if response.status_code == 200:
+                try:
+                    return parse_user_about(username, response.json())
+                except (ValueError, AttributeError):
+                    reason = "invalid_response"
+                    time.sleep(2 ** attempt)
+                    continue
+            if response.status_code == 401:
+                try:
+                    self._access_token(force=True)
+                except TOKEN_ERRORS:
+                    time.sleep(2 ** attempt)
+                reason = "unauthorized"
+                continue
+            if response.status_code == 429:
+                self.limiter.pause(float(response.headers.get("Retry-After") or
+                                         response.headers.get("X-Ratelimit-Reset") or 60))
+                reason = "rate_limited"
+                continue
+            if response.status_code in (403, 404):
+                return "failed", (username, f"http_{response.status_code}", int(time.time()))
+            if response.status_code >= 500:
+                reason = f"http_{response.status_code}"
+                time.sleep(2 ** attempt)
+                continue
+            return "failed", (username, f"http_{response.status_code}", int(time.time()))
+
+        return "failed", (username, reason or "retries_exhausted", int(time.time()))
+
+
+def parse_user_about(username, payload):
+    data = payload.get("data") or {}
+    user_id = data.get("id")
+
+    if not user_id:
+        return "failed", (username, "suspended_or_none", int(time.time()))
+
+    profile_subreddit = data.get("subreddit") or {}
+
+    return "ok", (
+        user_id,
+        username,
+        data.get("created_utc"),
+        data.get("comment_karma"),
+        data.get("link_karma"),
+        data.get("is_mod"),
+        data.get("is_suspended", False),
+        profile_subreddit.get("display_name"),
+        profile_subreddit.get("public_description"),
+        int(time.time())
+    )
+
+
+def fetch_and_store_users_concurrent(conn, usernames, client, workers=MAX_WORKERS):
+    # Fetches run in a thread pool; this thread is the only one touching
+    # SQLite and writes results in batches of BATCH_SIZE. At most
+    # workers * 4 lookups are in flight, so memory stays flat.
+    batch_success = []
+    batch_failed = []
+    batch_count = 0
+    max_in_flight = workers * 4
+
+    def collect(futures):
+        nonlocal batch_count
+        for future in futures:
+            status, row = future.result()
+            if status == "ok":
+                batch_success.append(row)
+            elif status == "failed":
+                batch_failed.append(row)
+
+        if len(batch_success) + len(batch_failed) >= BATCH_SIZE:
+            write_user_batch(conn, batch_success, batch_failed)
+            batch_count += 1
+            print(f"Batch {batch_count}: Added {len(batch_success)}, Failed {len(batch_failed)}")
+            batch_success.clear()
+            batch_failed.clear()
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        in_flight = set()
+        for username in usernames:
+            if len(in_flight) >= max_in_flight:
+                done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                collect(done)
+            in_flight.add(pool.submit(client.fetch_user, username))
+
+        done, _ = wait(in_flight)
+        collect(done)
+
+    if batch_success or batch_failed:
+        write_user_batch(conn, batch_success, batch_failed)
+        batch_count += 1
+        print(f"Final Batch {batch_count}: Added {len(batch_success)}, Failed {len(batch_failed)}")
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Fetch or refresh Reddit profiles for the authors in the database")
+    parser.add_argument("--db", default=DB_PATH, help="SQLite database path")
+    parser.add_argument("--budget", type=int, default=None,
+                        help="Most API requests to make in this run; the highest-priority users go first")
+    parser.add_argument("--refresh-days", type=float, default=REFRESH_DAYS,
+                        help="Refetch profiles retrieved more than this many days ago")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="Concurrent API requests (1 = the original serial PRAW fetcher)")
+    return parser.parse_args()
+
 def main():
-    conn = sqlite3.connect(DB_PATH)
+    args = parse_args()
+    check_credentials()
+    conn = compact_db.connect(args.db)
     create_users_tables(conn)
-    usernames = get_unique_users(conn)
-    print(f"Found {len(usernames)} unique users.")
-    fetch_and_store_users(conn, usernames)
+    ensure_authors_table(conn)
+    # The serial fetcher makes one request per user, so the queue length is
+    # its budget; the concurrent one also counts retries against it
+    queued = plan_refresh(conn, args.budget, args.refresh_days)
+    print(f"Found {queued} users to fetch or refresh.")
+    usernames = iter_refresh_queue(conn)
+    if args.workers > 1:
+        client = RedditUserClient(ID, SECRET, RateLimiter(), budget=ApiBudget(args.budget))
+        fetch_and_store_users_concurrent(conn, usernames, client, args.workers)
+    else:
+        fetch_and_store_users(conn, usernames, get_reddit())
     conn.close()
     print("All user data fetched and stored.")
 
@@ -0,0 +1,106 @@
+import os
+
+MB = 1024 ** 2
+
+# Rough cost of a parsed row in memory relative to the JSON line it came
+# from: the row keeps fewer fields than the line, but each one is a boxed
+# Python object.
+ROW_MEMORY_FACTOR = 1.5
+
+DEFAULT_BATCH_BYTES = 32 * MB
+MIN_BATCH_BYTES = 1 * MB
+MAX_BATCH_BYTES = 256 * MB
+COMMIT_SECONDS = 2.0
+
+
+class BatchSizer:
+    """Target batch size in raw JSON bytes, adapted to commit latency.
+
+    After every commit the target is halved if the write took longer than
+    commit_seconds and grown by a quarter if it took less than a quarter of
+    that, within [min_bytes, max_bytes]. With shared (a multiprocessing
+    Value), the target lives in shared memory: the writer adjusts it and
+    parse workers read it.
+    """
+
+    def __init__(self, target_bytes=DEFAULT_BATCH_BYTES, min_bytes=MIN_BATCH_BYTES, max_bytes=MAX_BATCH_BYTES,
+                 commit_seconds=COMMIT_SECONDS, shared=None):
+        self.min_bytes = min_bytes
+        self.max_bytes = max(max_bytes, min_bytes)
+        self.commit_seconds = commit_seconds
+        self.shared = shared
+        self._target = self._clamp(target_bytes)
+        if shared is not None:
+            shared.value = self._target
+
+    def _clamp(self, value):
+        return int(min(max(value, self.min_bytes), self.max_bytes))
+
+    @property
+    def target(self):
+        return self.shared.value if self.shared is not None else self._target
+
+    def observe(self, seconds):
+        target = self.target
+        if seconds > self.commit_seconds:
+            target = self._clamp(target * 0.5)
+        elif seconds < self.commit_seconds / 4:
+            target = self._clamp(target * 1.25)
+        return self._set(target)
+
+    def shrink(self):
+        """Halve the target, e.g. when a batch was cut early for memory."""
+        return self._set(self._clamp(self.target * 0.5))
+
+    def _set(self, target):
+        self._target = target
+        if self.shared is not None:
+            self.shared.value = target
+        return target
+
+
+class ByteBudget:
+    """A cap on the bytes of row batches between parse workers and the
+    writer, shared across processes. Workers acquire a batch's size before
+    queueing it and block while the budget is used up; the writer releases
+    it once the batch is written. A batch larger than the whole budget is
+    let through when nothing else is in flight, so it can never deadlock.
+    """
+
+    def __init__(self, limit_bytes, context):
+        self.limit = limit_bytes
+        self.used = context.Value('q', 0, lock=False)
+        self.condition = context.Condition()
+
+    def acquire(self, nbytes):
+        with self.condition:
+            while self.used.value and self.used.value + nbytes > self.limit:
+                self.condition.wait()
+            self.used.value += nbytes
+
+    def release(self, nbytes):
+        with self.condition:
+            self.used.value -= nbytes
+            self.condition.notify_all()
+
+
+def current_rss_bytes():
+    """Resident set size of this process, or None where /proc is missing."""
+    try:
+        with open('/proc/self/statm', 'r') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+def plan_memory(memory_bytes, workers=1):
+    """Split a memory ceiling into (max batch bytes, in-flight byte budget,
+    SQLite cache KiB). A quarter each goes to the batches being built (one
+    per worker plus the one being written), to batches waiting for the
+    writer and to SQLite's page cache; the rest is left for the
+    interpreter itself."""
+    if memory_bytes is None:
+        return MAX_BATCH_BYTES, None, None
+    quarter = memory_bytes // 4
+    max_batch = min(int(quarter / ROW_MEMORY_FACTOR / (workers + 1)), MAX_BATCH_BYTES)
+    return max(max_batch, MIN_BATCH_BYTES), quarter, quarter // 1024
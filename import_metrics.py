@@ -0,0 +1,205 @@
+import json
+import os
+import time
+from collections import Counter
+
+# Commit latency histogram buckets in seconds (Prometheus "le" bounds)
+COMMIT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, float('inf'))
+
+# Every Nth parsed block is timed line by line to split parse time into
+# JSON decoding vs. row tuple building; the other blocks get one timer.
+PARSE_SAMPLE_EVERY = 20
+
+STAGES = ('decompress', 'json', 'rows', 'write', 'commit')
+# Stages that run in the parse workers. With several workers their times
+# add up across processes, so the summary divides them by the worker count
+# before comparing them with the single writer's stages.
+WORKER_STAGES = ('decompress', 'json', 'rows')
+
+
+class ImportMetrics:
+    """Cumulative per-stage timings and counters for one import run.
+
+    Timers are taken per block/batch, never per line, so collecting is cheap
+    enough to stay on. Output is optional: JSON lines appended every
+    emit_interval seconds, a Prometheus textfile rewritten in place, and a
+    summary at the end that names the slowest stage. workers is the number
+    of processes that decompress and parse concurrently.
+    """
+
+    def __init__(self, jsonl_path=None, prom_path=None, emit_interval=10.0, workers=1):
+        self.jsonl_path = jsonl_path
+        self.prom_path = prom_path
+        self.emit_interval = emit_interval
+        self.started = time.perf_counter()
+        self.last_emit = self.started
+        self.stage_seconds = dict.fromkeys(STAGES + ('parse',), 0.0)
+        self.sampled = {'json': 0.0, 'rows': 0.0}
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.lines = 0
+        self.rows = 0
+        self.errors = Counter()
+        self.commit_buckets = [0] * len(COMMIT_BUCKETS)
+        self.commit_count = 0
+        self.commit_sum = 0.0
+        self.parse_blocks = 0
+        self.workers = workers
+
+    def add_time(self, stage, seconds):
+        self.stage_seconds[stage] += seconds
+
+    def should_sample_parse(self):
+        self.parse_blocks += 1
+        return self.parse_blocks % PARSE_SAMPLE_EVERY == 1
+
+    def add_parse(self, seconds, sample=None):
+        # sample is {'json': s, 'rows': s} when the block was timed per line
+        self.stage_seconds['parse'] += seconds
+        if sample:
+            self.sampled['json'] += sample['json']
+            self.sampled['rows'] += sample['rows']
+
+    def add_block(self, lines, bytes_in, bytes_out):
+        self.lines += lines
+        self.bytes_in += bytes_in
+        self.bytes_out += bytes_out
+
+    def add_errors(self, errors):
+        for label, _, _ in errors:
+            self.errors[label.lower()] += 1
+
+    def add_commit(self, seconds):
+        self.commit_count += 1
+        self.commit_sum += seconds
+        self.stage_seconds['commit'] += seconds
+        for i, bound in enumerate(COMMIT_BUCKETS):
+            if seconds <= bound:
+                self.commit_buckets[i] += 1
+                break
+        self.maybe_emit()
+
+    def merge(self, stats):
+        # Stats dict sent back by a parallel parse worker
+        self.stage_seconds['decompress'] += stats.get('decompress', 0.0)
+        self.stage_seconds['parse'] += stats.get('parse', 0.0)
+        self.sampled['json'] += stats.get('sampled_json', 0.0)
+        self.sampled['rows'] += stats.get('sampled_rows', 0.0)
+        self.bytes_in += stats.get('bytes_in', 0)
+        self.bytes_out += stats.get('bytes_out', 0)
+        self.lines += stats.get('lines', 0)
+        for label, count in stats.get('errors', {}).items():
+            self.errors[label] += count
+
+    def drain(self):
+        # Worker side of merge(): hand over what was counted since the last
+        # call and start again from zero
+        stats = {
+            'decompress': self.stage_seconds['decompress'],
+            'parse': self.stage_seconds['parse'],
+            'sampled_json': self.sampled['json'],
+            'sampled_rows': self.sampled['rows'],
+            'bytes_in': self.bytes_in,
+            'bytes_out': self.bytes_out,
+            'lines': self.lines,
+            'errors': dict(self.errors),
+        }
+        self.stage_seconds['decompress'] = self.stage_seconds['parse'] = 0.0
+        self.sampled = {'json': 0.0, 'rows': 0.0}
+        self.bytes_in = self.bytes_out = self.lines = 0
+        self.errors = Counter()
+        return stats
+
+    def stage_breakdown(self):
+        stages = dict(self.stage_seconds)
+        parse = stages.pop('parse')
+        sampled_total = self.sampled['json'] + self.sampled['rows']
+        json_share = self.sampled['json'] / sampled_total if sampled_total else 1.0
+        stages['json'] += parse * json_share
+        stages['rows'] += parse * (1 - json_share)
+        return stages
+
+    def snapshot(self):
+        elapsed = time.perf_counter() - self.started
+        return {
+            'time': time.time(),
+            'elapsed_sec': round(elapsed, 3),
+            'stage_seconds': {k: round(v, 3) for k, v in self.stage_breakdown().items()},
+            'bytes_in': self.bytes_in,
+            'bytes_out': self.bytes_out,
+            'lines': self.lines,
+            'rows': self.rows,
+            'rows_per_sec': round(self.rows / elapsed, 1) if elapsed else 0.0,
+            'workers': self.workers,
+            'errors': dict(self.errors),
+            'commits': self.commit_count,
+            'commit_seconds_sum': round(self.commit_sum, 3),
+            'commit_buckets': {('+Inf' if b == float('inf') else str(b)): n
+                               for b, n in zip(COMMIT_BUCKETS, self.commit_buckets)},
+        }
+
+    def maybe_emit(self, force=False):
+        now = time.perf_counter()
+        if not force and now - self.last_emit < self.emit_interval:
+            return
+        self.last_emit = now
+        if not self.jsonl_path and not self.prom_path:
+            return
+
+        snapshot = self.snapshot()
+        if self.jsonl_path:
+            with open(self.jsonl_path, 'a', encoding='utf-8') as f:
+                f.write(json.dumps(snapshot) + '\n')
+        if self.prom_path:
+            self.write_prometheus(snapshot)
+
+    def write_prometheus(self, snapshot):
+        lines = [
+            '# TYPE reddit_import_stage_seconds counter',
+            *(f'reddit_import_stage_seconds{{stage="{stage}"}} {seconds}'
+              for stage, seconds in snapshot['stage_seconds'].items()),
+            '# TYPE reddit_import_bytes_in counter',
+            f'reddit_import_bytes_in {snapshot["bytes_in"]}',
+            '# TYPE reddit_import_bytes_out counter',
+            f'reddit_import_bytes_out {snapshot["bytes_out"]}',
+            '# TYPE reddit_import_rows counter',
+            f'reddit_import_rows {snapshot["rows"]}',
+            '# TYPE reddit_import_errors counter',
+            *(f'reddit_import_errors{{category="{category}"}} {count}'
+              for category, count in snapshot['errors'].items()),
+            '# TYPE reddit_import_commit_seconds histogram',
+        ]
+        cumulative = 0
+        for bucket, count in snapshot['commit_buckets'].items():
+            cumulative += count
+            lines.append(f'reddit_import_commit_seconds_bucket{{le="{bucket}"}} {cumulative}')
+        lines.append(f'reddit_import_commit_seconds_sum {snapshot["commit_seconds_sum"]}')
+        lines.append(f'reddit_import_commit_seconds_count {snapshot["commits"]}')
+
+        # Write then rename so node_exporter never reads a half-written file
+        tmp_path = self.prom_path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.write('\n'.join(lines) + '\n')
+        os.replace(tmp_path, self.prom_path)
+
+    def print_summary(self):
+        self.maybe_emit(force=True)
+        snapshot = self.snapshot()
+        # Seconds of elapsed time per stage: the workers' summed times are
+        # spread over the workers that ran side by side
+        stages = {stage: seconds / self.workers if stage in WORKER_STAGES else seconds
+                  for stage, seconds in snapshot['stage_seconds'].items()}
+        busy = sum(stages.values()) or 1.0
+
+        print("Import metrics:" if self.workers == 1 else
+              f"Import metrics ({', '.join(WORKER_STAGES)} averaged over {self.workers} workers):")
+        for stage, seconds in sorted(stages.items(), key=lambda item: -item[1]):
+            print(f"  {stage:<11} {seconds:>9.2f}s  {100 * seconds / busy:5.1f}%")
+        print(f"  {snapshot['rows']:,} rows, {snapshot['rows_per_sec']:,.0f} rows/s, "
+              f"{self.bytes_in / 2**20:,.1f} MB in, {self.bytes_out / 2**20:,.1f} MB decompressed")
+        if self.commit_count:
+            print(f"  {self.commit_count} commits, mean {1000 * self.commit_sum / self.commit_count:.1f} ms")
+        if self.errors:
+            print(f"  errors: {', '.join(f'{k}={v}' for k, v in sorted(self.errors.items()))}")
+        bottleneck = max(stages, key=stages.get)
+        print(f"  bottleneck: {bottleneck}")
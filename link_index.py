@@ -0,0 +1,315 @@
+import sqlite3
+import argparse
+import glob
+import os
+import time
+from itertools import groupby
+
+from dump_utils import parse_timestamp
+
+DB_PATH = "reddit_data.db"
+
+# Covers the comment columns a thread listing needs, in (link_id,
+# created_utc) order, so the comments of a batch of submissions are read
+# from the index alone, in order, without touching the comment rows.
+COVERING_INDEX = ('idx_comments_link_cover', 'comments(link_id, created_utc, id, parent_id, author, score)')
+COVERED_COLUMNS = ['link_id', 'id', 'parent_id', 'author', 'score', 'created_utc']
+# The importer's plain comments(link_id) index, which the covering index
+# makes redundant: it is dropped while the covering index exists and put
+# back when the covering index is removed.
+REPLACED_INDEX = ('idx_comments_link_id', 'comments(link_id)')
+
+# One row per submission that has comments in this database. orphan = 1
+# when the submission itself is not here (its RS_ file was not imported, or
+# it is in another month or shard); resolved_in then names the shard
+# database that has it, if resolve_shards() found one.
+CREATE_LINKS_SQL = '''
+CREATE TABLE IF NOT EXISTS submission_links (
+    link_id TEXT PRIMARY KEY,
+    comments INTEGER,
+    first_comment_utc INTEGER,
+    last_comment_utc INTEGER,
+    orphan INTEGER,
+    resolved_in TEXT
+) WITHOUT ROWID
+'''
+
+# Recomputes the summary for the link_ids in submission_links_stale from
+# the covering index
+REFRESH_SQL = '''
+INSERT INTO submission_links (link_id, comments, first_comment_utc, last_comment_utc, orphan)
+SELECT s.link_id, COUNT(*), MIN(CAST(c.created_utc AS INTEGER)), MAX(CAST(c.created_utc AS INTEGER)),
+       NOT EXISTS (SELECT 1 FROM submissions WHERE id = s.link_id)
+FROM submission_links_stale s
+JOIN comments c ON c.link_id = s.link_id
+WHERE 1
+GROUP BY s.link_id
+ON CONFLICT(link_id) DO UPDATE SET
+    comments = excluded.comments,
+    first_comment_utc = excluded.first_comment_utc,
+    last_comment_utc = excluded.last_comment_utc,
+    orphan = excluded.orphan,
+    resolved_in = CASE WHEN excluded.orphan THEN resolved_in END
+'''
+
+
+def create_tables(conn):
+    cursor = conn.cursor()
+    cursor.execute(CREATE_LINKS_SQL)
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_submission_links_orphans ON submission_links(comments) '
+                   'WHERE orphan = 1')
+    # Submissions whose summary the importer has changed since the last
+    # refresh: new comments, or an orphan whose submission arrived
+    cursor.execute('CREATE TABLE IF NOT EXISTS submission_links_stale (link_id TEXT PRIMARY KEY) WITHOUT ROWID')
+    conn.commit()
+
+
+def enabled(conn):
+    cursor = conn.cursor()
+    cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'submission_links'")
+    return cursor.fetchone() is not None
+
+
+def create_index(conn):
+    name, target = COVERING_INDEX
+    conn.execute(f'CREATE INDEX IF NOT EXISTS {name} ON {target}')
+    conn.execute(f'DROP INDEX IF EXISTS {REPLACED_INDEX[0]}')
+    conn.commit()
+
+
+def drop_index(conn, restore=True):
+    # restore=False is for bulk loads, which drop every secondary index and
+    # rebuild this one in refresh() instead of maintaining it
+    conn.execute(f'DROP INDEX IF EXISTS {COVERING_INDEX[0]}')
+    if restore:
+        name, target = REPLACED_INDEX
+        conn.execute(f'CREATE INDEX IF NOT EXISTS {name} ON {target}')
+    conn.commit()
+
+
+def mark_stale(cursor, link_ids):
+    """Mark the threads an imported comment batch lands in."""
+    cursor.executemany('INSERT OR IGNORE INTO submission_links_stale (link_id) VALUES (?)',
+                       [(link_id,) for link_id in set(link_ids) if link_id])
+
+
+def mark_resolved(cursor, submission_ids):
+    """Mark the orphans whose submission an imported batch brings in."""
+    cursor.executemany('''
+    INSERT OR IGNORE INTO submission_links_stale (link_id)
+    SELECT link_id FROM submission_links WHERE link_id = ? AND orphan = 1
+    ''', [(submission_id,) for submission_id in submission_ids])
+
+
+def refresh(conn):
+    """Bring submission_links up to date for the submissions marked stale;
+    returns how many were refreshed."""
+    create_index(conn)
+    cursor = conn.cursor()
+    cursor.execute('SELECT COUNT(*) FROM submission_links_stale')
+    stale = cursor.fetchone()[0]
+    if not stale:
+        return 0
+    start = time.perf_counter()
+    cursor.execute(REFRESH_SQL)
+    cursor.execute('''
+    DELETE FROM submission_links
+    WHERE link_id IN (SELECT link_id FROM submission_links_stale)
+      AND NOT EXISTS (SELECT 1 FROM comments WHERE link_id = submission_links.link_id)
+    ''')
+    cursor.execute('DELETE FROM submission_links_stale')
+    conn.commit()
+    print(f"Refreshed links for {stale} submission(s) in {time.perf_counter() - start:.1f}s")
+    return stale
+
+
+def build(conn):
+    """Create the covering index and summarize every submission from scratch."""
+    create_tables(conn)
+    start = time.perf_counter()
+    create_index(conn)
+    cursor = conn.cursor()
+    cursor.execute('DELETE FROM submission_links')
+    cursor.execute('DELETE FROM submission_links_stale')
+    cursor.execute('''
+    INSERT INTO submission_links (link_id, comments, first_comment_utc, last_comment_utc, orphan)
+    SELECT link_id, COUNT(*), MIN(CAST(created_utc AS INTEGER)), MAX(CAST(created_utc AS INTEGER)),
+           NOT EXISTS (SELECT 1 FROM submissions WHERE id = link_id)
+    FROM comments WHERE link_id IS NOT NULL AND link_id != ''
+    GROUP BY link_id
+    ''')
+    conn.commit()
+    print(f"Summarized {cursor.rowcount} submission(s) in {time.perf_counter() - start:.1f}s")
+
+
+def orphan_summary(conn):
+    """(threads, comments) whose submission is not in this database, split
+    into (unresolved, resolved in another shard)."""
+    cursor = conn.cursor()
+    cursor.execute('''
+    SELECT resolved_in IS NOT NULL, COUNT(*), COALESCE(SUM(comments), 0)
+    FROM submission_links WHERE orphan = 1 GROUP BY 1
+    ''')
+    counts = {resolved: (threads, comments) for resolved, threads, comments in cursor.fetchall()}
+    return counts.get(0, (0, 0)), counts.get(1, (0, 0))
+
+
+def orphans(conn, resolved=None, limit=None):
+    """Orphan threads as (link_id, comments, first_comment_utc,
+    last_comment_utc, resolved_in), most comments first. resolved=False
+    keeps only those not found in any shard."""
+    sql = ('SELECT link_id, comments, first_comment_utc, last_comment_utc, resolved_in '
+           'FROM submission_links WHERE orphan = 1')
+    if resolved is not None:
+        sql += ' AND resolved_in IS NOT NULL' if resolved else ' AND resolved_in IS NULL'
+    sql += ' ORDER BY comments DESC'
+    if limit is not None:
+        sql += f' LIMIT {int(limit)}'
+    return conn.execute(sql).fetchall()
+
+
+def resolve_orphans(conn, shard_paths):
+    """Look the orphans of conn up in other databases, one ATTACH at a time,
+    and record the first one holding each submission in resolved_in.
+    Returns how many orphans were resolved."""
+    cursor = conn.cursor()
+    cursor.execute('UPDATE submission_links SET resolved_in = NULL WHERE orphan = 1')
+    conn.commit()
+    resolved = 0
+    for shard_path in shard_paths:
+        cursor.execute("ATTACH DATABASE ? AS other", (shard_path,))
+        try:
+            cursor.execute("SELECT 1 FROM other.sqlite_master WHERE type = 'table' AND name = 'submissions'")
+            if cursor.fetchone() is None:
+                continue
+            cursor.execute('''
+            UPDATE submission_links SET resolved_in = ?
+            WHERE orphan = 1 AND resolved_in IS NULL
+              AND EXISTS (SELECT 1 FROM other.submissions s WHERE s.id = submission_links.link_id)
+            ''', (os.path.basename(shard_path),))
+            resolved += cursor.rowcount
+            conn.commit()
+        finally:
+            cursor.execute('DETACH DATABASE other')
+    return resolved
+
+
+def resolve_shards(shard_dir):
+    """Resolve the orphans of every shard in shard_dir against the others,
+    e.g. comments in month_2023-02.db on submissions in month_2023-01.db."""
+    shards = sorted(glob.glob(os.path.join(shard_dir, '*.db')))
+    for shard_path in shards:
+        conn = sqlite3.connect(shard_path)
+        try:
+            if not enabled(conn):
+                continue
+            others = [path for path in shards if path != shard_path]
+            resolved = resolve_orphans(conn, others)
+            (threads, comments), _ = orphan_summary(conn)
+            print(f"  {os.path.basename(shard_path)}: {resolved} orphan thread(s) found in other shards, "
+                  f"{threads} ({comments} comments) not found")
+        finally:
+            conn.close()
+
+
+def comments_for_submissions(conn, link_ids, chunk=500, with_body=False):
+    """Stream the comments of many submissions, grouped by submission.
+
+    Yields (link_id, rows) in link_id order, each row (link_id, id,
+    parent_id, author, score, created_utc) plus body with with_body, in
+    created_utc order. Submissions without comments are left out. Each
+    chunk of link_ids is one query, answered from the covering index unless
+    bodies are asked for; rows are read lazily, so don't write to conn
+    while iterating.
+    """
+    link_ids = sorted({link_id[3:] if link_id.startswith('t3_') else link_id for link_id in link_ids})
+    columns = ', '.join(COVERED_COLUMNS + (['body'] if with_body else []))
+    cursor = conn.cursor()
+    for i in range(0, len(link_ids), chunk):
+        part = link_ids[i:i + chunk]
+        cursor.execute(f'''
+        SELECT {columns} FROM comments
+        WHERE link_id IN ({', '.join('?' for _ in part)})
+        ORDER BY link_id, created_utc, id
+        ''', part)
+        for link_id, rows in groupby(cursor, key=lambda row: row[0]):
+            yield link_id, list(rows)
+
+
+def submission_ids(conn, subreddit=None, after=None, before=None, title=None):
+    """Ids of the submissions matching the given filters, for feeding
+    comments_for_submissions()."""
+    conditions, params = ['1 = 1'], []
+    if subreddit is not None:
+        conditions.append('subreddit = ?')
+        params.append(subreddit)
+    if after is not None:
+        conditions.append('created_utc >= ?')
+        params.append(after)
+    if before is not None:
+        conditions.append('created_utc < ?')
+        params.append(before)
+    if title is not None:
+        conditions.append('title LIKE ?')
+        params.append(f'%{title}%')
+    cursor = conn.cursor()
+    cursor.execute(f"SELECT id FROM submissions WHERE {' AND '.join(conditions)}", params)
+    return [row[0] for row in cursor.fetchall()]
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Comment-to-submission link index and orphan report")
+    parser.add_argument("--db", default=DB_PATH, help="SQLite database path")
+    parser.add_argument("--build", action="store_true",
+                        help="Create the covering index and per-submission summary from the imported rows")
+    parser.add_argument("--refresh", action="store_true", help="Only refresh the submissions imports changed")
+    parser.add_argument("--orphans", type=int, nargs="?", const=20, default=None,
+                        help="Print the orphan summary and the N largest orphan threads (default 20)")
+    parser.add_argument("--resolve", default=None, metavar="SHARD_DIR",
+                        help="Resolve the orphans of every shard in SHARD_DIR against the other shards")
+    parser.add_argument("--links", nargs="*", default=None, help="Print the comments of these submissions")
+    parser.add_argument("--subreddit", default=None, help="Print the comments of this subreddit's submissions")
+    parser.add_argument("--title", default=None, help="With --subreddit, only submissions whose title contains this")
+    parser.add_argument("--after", type=parse_timestamp, default=None, help="Unix time or YYYY-MM-DD")
+    parser.add_argument("--before", type=parse_timestamp, default=None, help="Unix time or YYYY-MM-DD")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+
+    if args.resolve:
+        resolve_shards(args.resolve)
+        return
+
+    conn = sqlite3.connect(args.db)
+    if args.build:
+        build(conn)
+    elif args.refresh:
+        refresh(conn)
+
+    if args.orphans is not None:
+        (threads, comments), (resolved_threads, resolved_comments) = orphan_summary(conn)
+        print(f"{threads} thread(s) ({comments} comments) have no submission in this database, "
+              f"{resolved_threads} more ({resolved_comments} comments) are in other shards")
+        for link_id, count, first, last, resolved_in in orphans(conn, limit=args.orphans):
+            print(f"  {link_id}  {count} comments  {first}-{last}  {resolved_in or 'not found'}")
+
+    link_ids = args.links
+    if link_ids is None and args.subreddit is not None:
+        link_ids = submission_ids(conn, args.subreddit, args.after, args.before, args.title)
+    if link_ids:
+        threads = total = 0
+        for link_id, rows in comments_for_submissions(conn, link_ids):
+            threads += 1
+            total += len(rows)
+            print(f"t3_{link_id}: {len(rows)} comments")
+            for _, comment_id, parent_id, author, score, created_utc in rows:
+                print(f"  [{score}] {author} ({comment_id}, reply to {parent_id})")
+        print(f"{total} comments on {threads} of {len(link_ids)} submission(s)")
+
+    conn.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,281 @@
+import sqlite3
+import argparse
+import os
+import time
+from datetime import datetime, timezone
+
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.dataset as ds
+
+from dump_utils import parse_timestamp
+from reddit_import_script import (
+    ROW_PARSERS,
+    build_line_filter,
+    file_in_time_range,
+    filter_spec_from_args,
+    find_zst_files,
+    parse_lines,
+    parse_name_list,
+    read_zst_line_batches,
+)
+
+# Column order matches the SQLite tables and the tuples built by
+# parse_submission / parse_comment, so rows from either source line up.
+TABLE_COLUMNS = {
+    'submissions': [
+        ('id', pa.string()),
+        ('subreddit', pa.string()),
+        ('title', pa.string()),
+        ('selftext', pa.string()),
+        ('author', pa.string()),
+        ('created_utc', pa.int64()),
+        ('score', pa.int64()),
+        ('num_comments', pa.int64()),
+        ('is_self', pa.bool_()),
+        ('retrieved_on', pa.int64()),
+        ('stickied', pa.bool_()),
+        ('over_18', pa.bool_()),
+        ('spoiler', pa.bool_()),
+        ('locked', pa.bool_()),
+        ('distinguished', pa.string()),
+        ('permalink', pa.string()),
+        ('has_image', pa.bool_()),
+        ('image_url', pa.string()),
+    ],
+    'comments': [
+        ('id', pa.string()),
+        ('subreddit', pa.string()),
+        ('body', pa.string()),
+        ('author', pa.string()),
+        ('created_utc', pa.int64()),
+        ('score', pa.int64()),
+        ('link_id', pa.string()),
+        ('parent_id', pa.string()),
+        ('retrieved_on', pa.int64()),
+        ('stickied', pa.bool_()),
+        ('distinguished', pa.string()),
+        ('controversiality', pa.int64()),
+    ],
+}
+
+PARTITION_KEYS = ('month', 'subreddit')
+
+
+def table_schema(table: str, partition_by=()) -> pa.Schema:
+    fields = [pa.field(name, dtype) for name, dtype in TABLE_COLUMNS[table]]
+    if 'month' in partition_by:
+        fields.append(pa.field('month', pa.string()))
+    return pa.schema(fields)
+
+
+def _coerce(value, dtype):
+    # Dumps are not consistent about types (created_utc as "123" or 123.0,
+    # booleans as 0/1 once they have been through SQLite).
+    if value is None:
+        return None
+    try:
+        if pa.types.is_integer(dtype):
+            return int(value)
+        if pa.types.is_boolean(dtype):
+            return bool(value)
+    except (TypeError, ValueError):
+        return None
+    return value
+
+
+def rows_to_batch(table: str, rows, partition_by=()) -> pa.RecordBatch:
+    columns = TABLE_COLUMNS[table]
+    values = list(zip(*rows)) if rows else [()] * len(columns)
+    arrays = []
+
+    for (name, dtype), column in zip(columns, values):
+        if pa.types.is_string(dtype):
+            arrays.append(pa.array(column, type=dtype))
+        else:
+            arrays.append(pa.array([_coerce(v, dtype) for v in column], type=dtype))
+
+    if 'month' in partition_by:
+        created = arrays[[name for name, _ in columns].index('created_utc')]
+        months = pc.strftime(pc.cast(pc.multiply(created, 1000), pa.timestamp('ms', tz='UTC')), format='%Y-%m')
+        arrays.append(pc.fill_null(months, 'unknown'))
+
+    return pa.RecordBatch.from_arrays(arrays, schema=table_schema(table, partition_by))
+
+
+def sqlite_batches(db_path: str, table: str, partition_by=(), batch_rows: int = 200000):
+    conn = sqlite3.connect(db_path)
+    try:
+        cursor = conn.cursor()
+        column_names = ', '.join(name for name, _ in TABLE_COLUMNS[table])
+        cursor.execute(f'SELECT {column_names} FROM {table}')
+        while True:
+            rows = cursor.fetchmany(batch_rows)
+            if not rows:
+                break
+            yield rows_to_batch(table, rows, partition_by)
+    finally:
+        conn.close()
+
+
+def zst_batches(file_paths, table: str, partition_by=(), filter_spec=None):
+    parse = ROW_PARSERS[table]
+    line_filter = build_line_filter(filter_spec, table)
+
+    for file_path in file_paths:
+        if not file_in_time_range(file_path, filter_spec):
+            continue
+        print(f"Reading {table} from {file_path}...")
+        for lines, _, _ in read_zst_line_batches(file_path):
+            rows, _ = parse_lines(lines, parse, line_filter)
+            if rows:
+                yield rows_to_batch(table, rows, partition_by)
+
+
+def write_partitioned(batches, out_dir: str, table: str, partition_by=('month',)):
+    target = os.path.join(out_dir, table)
+    schema = table_schema(table, partition_by)
+    partitioning = None
+    if partition_by:
+        partitioning = ds.partitioning(
+            pa.schema([schema.field(key) for key in partition_by]), flavor='hive'
+        )
+
+    # Partitions this export writes to are replaced, not added to, so
+    # exporting the same data twice never double-counts it. Partitions it
+    # doesn't write to (other months) are left alone.
+    start = time.perf_counter()
+    ds.write_dataset(
+        batches,
+        target,
+        schema=schema,
+        format='parquet',
+        partitioning=partitioning,
+        basename_template='part-{i}.parquet',
+        existing_data_behavior='delete_matching',
+        max_partitions=100000,
+        max_rows_per_group=256 * 1024,
+    )
+    print(f"Wrote {table} to {target} in {time.perf_counter() - start:.1f}s")
+
+
+def export_from_sqlite(db_path: str, out_dir: str, tables=('submissions', 'comments'), partition_by=('month',)):
+    for table in tables:
+        write_partitioned(sqlite_batches(db_path, table, partition_by), out_dir, table, partition_by)
+
+
+def export_from_zst(zst_dir: str, out_dir: str, tables=('submissions', 'comments'), partition_by=('month',),
+                    filter_spec=None):
+    submission_files, comment_files = find_zst_files(zst_dir)
+    for table, files in (('submissions', submission_files), ('comments', comment_files)):
+        if table in tables and files:
+            batches = zst_batches(files, table, partition_by, filter_spec)
+            write_partitioned(batches, out_dir, table, partition_by)
+
+
+# --- Query helpers ---
+
+def _month(timestamp: int) -> str:
+    return datetime.fromtimestamp(timestamp, tz=timezone.utc).strftime('%Y-%m')
+
+
+def open_dataset(out_dir: str, table: str) -> ds.Dataset:
+    return ds.dataset(os.path.join(out_dir, table), format='parquet', partitioning='hive')
+
+
+def build_filter(dataset: ds.Dataset, subreddits=None, after: int = None, before: int = None):
+    # Partition columns in the expression let Arrow skip whole directories;
+    # created_utc additionally uses the Parquet row-group statistics.
+    names = set(dataset.schema.names)
+    expression = None
+
+    def add(condition):
+        nonlocal expression
+        expression = condition if expression is None else expression & condition
+
+    if subreddits:
+        add(ds.field('subreddit').isin(list(subreddits)))
+    if after is not None:
+        add(ds.field('created_utc') >= after)
+        if 'month' in names:
+            add(ds.field('month') >= _month(after))
+    if before is not None:
+        add(ds.field('created_utc') < before)
+        if 'month' in names:
+            add(ds.field('month') <= _month(before))
+    return expression
+
+
+def read_columns(out_dir: str, table: str, columns, subreddits=None, after: int = None, before: int = None) -> pa.Table:
+    dataset = open_dataset(out_dir, table)
+    expression = build_filter(dataset, subreddits, after, before)
+    return dataset.to_table(columns=list(columns), filter=expression)
+
+
+def subreddit_score_stats(out_dir: str, table: str = 'comments', subreddits=None,
+                          after: int = None, before: int = None) -> pa.Table:
+    data = read_columns(out_dir, table, ['subreddit', 'score'], subreddits, after, before)
+    stats = data.group_by('subreddit').aggregate([
+        ('score', 'count'),
+        ('score', 'sum'),
+        ('score', 'mean'),
+        ('score', 'max'),
+    ])
+    return stats.sort_by([('score_sum', 'descending')])
+
+
+def author_activity_by_month(out_dir: str, table: str = 'comments', authors=None, subreddits=None,
+                             after: int = None, before: int = None) -> pa.Table:
+    data = read_columns(out_dir, table, ['author', 'created_utc'], subreddits, after, before)
+    if authors:
+        data = data.filter(pc.is_in(data['author'], value_set=pa.array(list(authors))))
+    months = pc.strftime(pc.cast(pc.multiply(data['created_utc'], 1000), pa.timestamp('ms', tz='UTC')),
+                         format='%Y-%m')
+    data = pa.table({'author': data['author'], 'month': months})
+    activity = data.group_by(['author', 'month']).aggregate([('month', 'count')])
+    return activity.rename_columns(['author', 'month', 'rows']).sort_by([('author', 'ascending'), ('month', 'ascending')])
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Export submissions/comments to partitioned Parquet")
+    source = parser.add_mutually_exclusive_group()
+    source.add_argument('--db', default='reddit_data.db', help="Export from this SQLite database")
+    source.add_argument('--zst-dir', default=None, help="Export straight from the .zst dumps instead")
+    parser.add_argument('--out', default='parquet', help="Output directory")
+    parser.add_argument('--tables', nargs='+', default=['submissions', 'comments'],
+                        choices=['submissions', 'comments'])
+    parser.add_argument('--partition-by', nargs='*', default=['month'], choices=PARTITION_KEYS,
+                        help="Hive partition columns (default: month)")
+    filters = parser.add_argument_group("filters (with --zst-dir)")
+    filters.add_argument('--subreddits', type=parse_name_list, default=None,
+                         help="Only export these subreddits (comma-separated, or @file with one per line)")
+    filters.add_argument('--exclude-subreddits', type=parse_name_list, default=None,
+                         help="Skip these subreddits (comma-separated, or @file)")
+    filters.add_argument('--authors', type=parse_name_list, default=None,
+                         help="Only export rows by these authors (comma-separated, or @file)")
+    filters.add_argument('--after', type=parse_timestamp, default=None,
+                         help="Only export rows created at or after this time (unix time or YYYY-MM-DD)")
+    filters.add_argument('--before', type=parse_timestamp, default=None,
+                         help="Only export rows created before this time (unix time or YYYY-MM-DD)")
+    filters.add_argument('--min-score', type=int, default=None,
+                         help="Only export rows with at least this score")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    partition_by = tuple(args.partition_by)
+
+    filter_spec = filter_spec_from_args(args)
+    if args.zst_dir:
+        export_from_zst(args.zst_dir, args.out, args.tables, partition_by, filter_spec)
+    else:
+        if filter_spec:
+            raise SystemExit("Filters apply to --zst-dir exports only")
+        export_from_sqlite(args.db, args.out, args.tables, partition_by)
+
+    print(f"Parquet export saved to: {args.out}")
+
+
+if __name__ == "__main__":
+    main()
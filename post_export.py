@@ -0,0 +1,296 @@
+import argparse
+import time
+import hashlib
+from datetime import datetime, timezone
+
+import compact_db
+import search_index
+from dump_utils import parse_timestamp
+
+DB_PATH = "reddit_data.db"
+OUT_PATH = "posts.txt"
+
+# Rough token estimate shared with codebook_generator: about four characters
+# per token for English text.
+CHARS_PER_TOKEN = 4
+PAGE_SIZE = 1000
+TOP_COMMENTS = 5
+
+# Written between posts by the CLI; pass it to codebook_generator --separator
+# when reading the file back, since posts themselves contain blank lines.
+POST_SEPARATOR = "\n\n=====\n\n"
+
+SUBMISSION_COLUMNS = ['rowid', 'id', 'subreddit', 'title', 'selftext', 'author', 'created_utc', 'score',
+                      'num_comments', 'permalink']
+
+
+def estimate_tokens(text: str) -> int:
+    return len(text) // CHARS_PER_TOKEN + 1
+
+
+def _keyset_pages(cursor, select, conditions, params, keys, page_size):
+    # Pages over an index in (keys) order. Each page is fetched completely
+    # and the next one starts after its last key, so no read cursor stays
+    # open while the caller runs its own queries on the same connection.
+    last = None
+    while True:
+        page_conditions = list(conditions)
+        page_params = list(params)
+        if last is not None:
+            page_conditions.append(f"({', '.join(keys)}) > ({', '.join('?' for _ in keys)})")
+            page_params.extend(last)
+        cursor.execute(f"{select} WHERE {' AND '.join(page_conditions) or '1'} "
+                       f"ORDER BY {', '.join(keys)} LIMIT ?", page_params + [page_size])
+        page = cursor.fetchall()
+        if not page:
+            return
+        yield from page
+        last = page[-1][-len(keys):]
+
+
+def _stored_subreddits(cursor, subreddits):
+    # The names as the database stores them, matched case-insensitively like
+    # the importer's --subreddits filter, so the drivers below can stay on
+    # the subreddit index with an exact match. A compact copy lists every
+    # name in subreddit_names; otherwise the index is walked one character
+    # at a time, following only the casings of a prefix that exist.
+    cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'subreddit_names'")
+    compact = cursor.fetchone() is not None
+    stored = []
+    for name in dict.fromkeys(subreddits):
+        if compact:
+            cursor.execute(f'''
+            SELECT name FROM subreddit_names WHERE name = ? COLLATE NOCASE
+            UNION SELECT subreddit FROM {compact_db.UNCONVERTED_TABLES['submissions']}
+            WHERE subreddit = ? COLLATE NOCASE
+            ''', (name, name))
+            stored.extend(row[0] for row in cursor.fetchall())
+            continue
+        prefixes = ['']
+        for char in name:
+            extended = []
+            for prefix in prefixes:
+                for option in dict.fromkeys((char.lower(), char.upper())):
+                    cursor.execute('SELECT subreddit FROM submissions WHERE subreddit >= ? ORDER BY subreddit LIMIT 1',
+                                   (prefix + option,))
+                    row = cursor.fetchone()
+                    if row is not None and row[0].startswith(prefix + option):
+                        extended.append(prefix + option)
+            prefixes = extended
+        for candidate in prefixes:
+            cursor.execute('SELECT 1 FROM submissions WHERE subreddit = ? LIMIT 1', (candidate,))
+            if cursor.fetchone() is not None:
+                stored.append(candidate)
+    return list(dict.fromkeys(stored))
+
+
+def iter_submissions(conn, subreddits=None, after=None, before=None, keyword=None, min_score=None,
+                     sample=None, seed=0, limit=None, page_size=PAGE_SIZE):
+    """Stream matching submissions as dicts of SUBMISSION_COLUMNS.
+
+    Every query is driven by an index: the FTS index for keyword (FTS5
+    syntax), the subreddit index one subreddit at a time, the created_utc
+    index for a time range, or the rowid. Rows come out in that index's
+    order. Subreddit names match case-insensitively. sample keeps about
+    that fraction of posts, chosen by a hash of the id so the same seed
+    always gives the same sample.
+    """
+    cursor = conn.cursor()
+    # The views of a compact copy have no rowid to page on, and ordering a
+    # view sorts all of it; there each driver is one query, in view order
+    cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'view' AND name = 'submissions'")
+    compact = cursor.fetchone() is not None
+    if subreddits:
+        subreddits = _stored_subreddits(cursor, subreddits)
+        if not subreddits:
+            return
+    conditions, params = [], []
+    if after is not None:
+        conditions.append('t.created_utc >= ?')
+        params.append(after)
+    if before is not None:
+        conditions.append('t.created_utc < ?')
+        params.append(before)
+    if min_score is not None:
+        conditions.append('t.score >= ?')
+        params.append(min_score)
+
+    columns = ', '.join(f't.{col}' for col in SUBMISSION_COLUMNS)
+    if keyword:
+        if 'submissions' in search_index.enabled_kinds(conn):
+            fts, _ = search_index.FTS_TABLES['submissions']
+            docs = search_index.DOC_TABLES['submissions']
+            select = (f'SELECT {columns}, {fts}.rowid FROM {fts} '
+                      f'JOIN {docs} d ON d.docid = {fts}.rowid JOIN submissions t ON t.id = d.id')
+            drivers = [([f'{fts} MATCH ?'], [keyword], [f'{fts}.rowid'])]
+        else:
+            print("No full-text index (run search_index.py --build); matching keyword with a table scan")
+            select = f'SELECT {columns}, t.rowid FROM submissions t'
+            drivers = [(["(t.title LIKE ? OR t.selftext LIKE ?)"], [f'%{keyword}%'] * 2, ['t.rowid'])]
+        if subreddits:
+            conditions.append(f"t.subreddit IN ({', '.join('?' for _ in subreddits)})")
+            params.extend(subreddits)
+    elif subreddits:
+        select = f'SELECT {columns}, t.rowid FROM submissions t'
+        drivers = [(['t.subreddit = ?'], [subreddit], ['t.rowid']) for subreddit in subreddits]
+    elif after is not None or before is not None:
+        select = f'SELECT {columns}, t.created_utc, t.rowid FROM submissions t'
+        drivers = [([], [], ['t.created_utc', 't.rowid'])]
+    else:
+        select = f'SELECT {columns}, t.rowid FROM submissions t'
+        drivers = [([], [], ['t.rowid'])]
+
+    threshold = None if sample is None else int(sample * 2**32)
+    salt = str(seed).encode()
+    yielded = 0
+    for driver_conditions, driver_params, keys in drivers:
+        if compact:
+            rows = conn.execute(f"{select} WHERE {' AND '.join(driver_conditions + conditions) or '1'}",
+                                driver_params + params)
+        else:
+            rows = _keyset_pages(cursor, select, driver_conditions + conditions, driver_params + params, keys,
+                                 page_size)
+        for row in rows:
+            if threshold is not None and int.from_bytes(
+                    hashlib.blake2b(salt + row[1].encode(), digest_size=4).digest(), 'big') >= threshold:
+                continue
+            yield dict(zip(SUBMISSION_COLUMNS, row))
+            yielded += 1
+            if limit is not None and yielded >= limit:
+                return
+
+
+def top_comments(conn, link_id, n=TOP_COMMENTS):
+    """The n highest-scoring comments on a submission, as (author, score,
+    body), using the link_id index."""
+    source, binds = compact_db.lookup_source(conn, 'comments', 'link_id')
+    cursor = conn.cursor()
+    cursor.execute(f'''
+    SELECT author, score, body FROM {source}
+    WHERE body IS NOT NULL AND body NOT IN ('[deleted]', '[removed]')
+    ORDER BY score DESC
+    LIMIT ?
+    ''', (link_id,) * binds + (n,))
+    return cursor.fetchall()
+
+
+def _truncate(text, max_tokens):
+    max_chars = max_tokens * CHARS_PER_TOKEN
+    return text if len(text) <= max_chars else text[:max_chars].rstrip() + " [...]"
+
+
+def format_post(submission, comments, max_tokens=None):
+    """One post as plain text, starting with the 'Post URL:' line the
+    codebook prompts key on. With max_tokens the selftext and then the
+    comments are shortened to fit."""
+    permalink = submission['permalink'] or f"/comments/{submission['id']}/"
+    created = submission['created_utc']
+    date = datetime.fromtimestamp(int(created), timezone.utc).strftime('%Y-%m-%d') if created else 'unknown'
+    header = (f"Post URL: https://www.reddit.com{permalink}\n"
+              f"Subreddit: r/{submission['subreddit']}\n"
+              f"Date: {date}\n"
+              f"Score: {submission['score']}\n"
+              f"Title: {submission['title'] or ''}")
+    selftext = (submission['selftext'] or '').strip()
+    comment_lines = [f"- [{score}] {(body or '').strip()}" for _, score, body in comments]
+
+    if max_tokens is not None:
+        budget = max_tokens - estimate_tokens(header)
+        selftext = _truncate(selftext, max(budget // 2, 0)) if selftext else selftext
+        budget -= estimate_tokens(selftext)
+        fitted = []
+        for line in comment_lines:
+            if budget <= 0:
+                break
+            line = _truncate(line, budget)
+            fitted.append(line)
+            budget -= estimate_tokens(line)
+        comment_lines = fitted
+
+    parts = [header]
+    if selftext:
+        parts.append(selftext)
+    if comment_lines:
+        parts.append("Top comments:\n" + "\n".join(comment_lines))
+    return "\n\n".join(parts)
+
+
+def iter_posts(conn, subreddits=None, after=None, before=None, keyword=None, min_score=None, sample=None,
+               seed=0, limit=None, n_comments=TOP_COMMENTS, max_post_tokens=None):
+    """Formatted posts (submission plus its top comments), one at a time."""
+    for submission in iter_submissions(conn, subreddits, after, before, keyword, min_score, sample, seed, limit):
+        comments = top_comments(conn, submission['id'], n_comments) if n_comments else []
+        yield format_post(submission, comments, max_post_tokens)
+
+
+def iter_chunks(posts, max_tokens, separator="\n\n"):
+    """Pack posts in order into chunks of at most max_tokens (estimated),
+    holding only the current chunk in memory. A post larger than that is
+    its own chunk; use max_post_tokens to keep every post under it."""
+    current = []
+    size = 0
+    for post in posts:
+        tokens = estimate_tokens(post)
+        if current and size + tokens > max_tokens:
+            yield separator.join(current)
+            current = []
+            size = 0
+        current.append(post)
+        size += tokens
+    if current:
+        yield separator.join(current)
+
+
+def add_filter_arguments(parser):
+    parser.add_argument("--db", default=DB_PATH, help="SQLite database path")
+    parser.add_argument("--subreddits", nargs="*", default=None)
+    parser.add_argument("--after", type=parse_timestamp, default=None, help="Unix time or YYYY-MM-DD")
+    parser.add_argument("--before", type=parse_timestamp, default=None, help="Unix time or YYYY-MM-DD")
+    parser.add_argument("--keyword", default=None,
+                        help="Only posts matching this FTS5 query in the title or selftext")
+    parser.add_argument("--min-score", type=int, default=None)
+    parser.add_argument("--sample", type=float, default=None, help="Keep about this fraction of posts (0-1)")
+    parser.add_argument("--seed", type=int, default=0, help="Changes which posts --sample picks")
+    parser.add_argument("--limit", type=int, default=None, help="Stop after this many posts")
+    parser.add_argument("--top-comments", type=int, default=TOP_COMMENTS,
+                        help="Highest-scoring comments to include per post")
+    parser.add_argument("--max-post-tokens", type=int, default=None,
+                        help="Shorten each post (selftext, then comments) to about this many tokens")
+
+
+def iter_posts_from_args(conn, args):
+    return iter_posts(conn, args.subreddits, args.after, args.before, args.keyword, args.min_score, args.sample,
+                      args.seed, args.limit, args.top_comments, args.max_post_tokens)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Export submissions with their top comments as LLM-ready text")
+    add_filter_arguments(parser)
+    parser.add_argument("--out", default=OUT_PATH, help="Output text file")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    conn = compact_db.connect(args.db)
+    start = time.perf_counter()
+    count = 0
+    tokens = 0
+
+    with open(args.out, 'w', encoding='utf-8') as f:
+        for post in iter_posts_from_args(conn, args):
+            if count:
+                f.write(POST_SEPARATOR)
+            f.write(post)
+            count += 1
+            tokens += estimate_tokens(post)
+            if count % 10000 == 0:
+                print(f"  Exported {count} posts...")
+
+    conn.close()
+    print(f"Exported {count} posts (~{tokens:,} tokens) to {args.out} in {time.perf_counter() - start:.1f}s")
+    print(f"Read it back with: python codebook_generator.py --posts {args.out} --separator '\\n=====\\n'")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,395 @@
+import sqlite3
+import argparse
+import queue
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from typing import NamedTuple, Optional
+
+import comment_tree
+import compact_db
+import rollups
+from dump_utils import parse_timestamp
+
+DB_PATH = "reddit_data.db"
+
+DAY = 86400
+POOL_SIZE = 4
+CACHE_ENTRIES = 1024
+CACHE_BYTES = 64 * 1024 ** 2
+MMAP_BYTES = 1024 ** 3
+# Per-connection cache of compiled statements; the service only ever runs
+# a handful of distinct SQL strings, so they stay prepared.
+STATEMENT_CACHE = 256
+
+# Composite indexes that let the timeline and history queries read rows in
+# created_utc order instead of sorting every row of a subreddit or author.
+# Optional: created by --create-indexes, since the importer pays for every
+# index on every batch.
+SERVICE_INDEXES = [
+    ('idx_submissions_subreddit_created', 'submissions(subreddit, created_utc)'),
+    ('idx_submissions_author_created', 'submissions(author, created_utc)'),
+    ('idx_comments_author_created', 'comments(author, created_utc)'),
+]
+
+
+class Submission(NamedTuple):
+    id: str
+    subreddit: str
+    author: Optional[str]
+    created_utc: Optional[int]
+    score: Optional[int]
+    num_comments: Optional[int]
+    title: Optional[str]
+    selftext: Optional[str]
+    permalink: Optional[str]
+
+
+class Comment(NamedTuple):
+    id: str
+    link_id: str
+    parent_id: Optional[str]
+    depth: Optional[int]
+    subreddit: str
+    author: Optional[str]
+    created_utc: Optional[int]
+    score: Optional[int]
+    body: Optional[str]
+
+
+SUBMISSION_COLUMNS = ', '.join(Submission._fields)
+COMMENT_COLUMNS = 'id, link_id, parent_id, NULL, subreddit, author, created_utc, score, body'
+
+
+def enable_wal(db_path):
+    """Switch a database to WAL, so readers keep working while an import
+    commits. The mode is stored in the file; it only has to be done once."""
+    conn = sqlite3.connect(db_path)
+    try:
+        return conn.execute('PRAGMA journal_mode = WAL').fetchone()[0]
+    finally:
+        conn.close()
+
+
+def create_service_indexes(conn):
+    cursor = conn.cursor()
+    for name, target in SERVICE_INDEXES:
+        start = time.perf_counter()
+        cursor.execute(f'CREATE INDEX IF NOT EXISTS {name} ON {target}')
+        conn.commit()
+        print(f"  Created {name} in {time.perf_counter() - start:.1f}s")
+
+
+def _result_bytes(rows):
+    # Rough footprint of a cached result: string and blob lengths plus a
+    # fixed cost per value
+    total = 64
+    for row in rows:
+        total += 64
+        for value in row:
+            total += len(value) if isinstance(value, (str, bytes)) else 16
+    return total
+
+
+class ResultCache:
+    """A thread-safe LRU of query results, bounded by entry count and by an
+    estimate of their size. Results must be immutable (tuples of rows)."""
+
+    def __init__(self, max_entries=CACHE_ENTRIES, max_bytes=CACHE_BYTES):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key, value):
+        size = _result_bytes(value)
+        if size > self.max_bytes:
+            return
+        with self.lock:
+            old = self.entries.pop(key, None)
+            if old is not None:
+                self.bytes -= old[1]
+            self.entries[key] = (value, size)
+            self.bytes += size
+            while len(self.entries) > self.max_entries or self.bytes > self.max_bytes:
+                _, (_, evicted) = self.entries.popitem(last=False)
+                self.bytes -= evicted
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.bytes = 0
+
+
+class QueryService:
+    """Shared read access to an imported database for dashboards and scripts.
+
+    Holds pool_size read-only connections (mmap enabled, statements kept
+    prepared) that threads borrow one query at a time, and caches results
+    in an LRU keyed by query and parameters. Every cached result belongs to
+    a generation of the database: any commit by a writer (an import batch,
+    an index or rollup build) starts a new generation and empties the
+    cache, so results are never staler than the last commit.
+
+    Readers only run alongside an import when the database is in WAL mode
+    (enable_wal, or reddit_import_script.py --wal); otherwise a query waits
+    up to timeout seconds for each commit to finish.
+    """
+
+    def __init__(self, db_path=DB_PATH, pool_size=POOL_SIZE, cache_entries=CACHE_ENTRIES,
+                 cache_bytes=CACHE_BYTES, mmap_bytes=MMAP_BYTES, timeout=30.0):
+        self.db_path = db_path
+        self.mmap_bytes = mmap_bytes
+        self.timeout = timeout
+        self.cache = ResultCache(cache_entries, cache_bytes)
+        self.pool = queue.Queue()
+        self.connections = [self._connect() for _ in range(pool_size)]
+        for conn in self.connections:
+            self.pool.put(conn)
+
+        # PRAGMA data_version changes whenever another connection commits;
+        # one watcher connection turns that into a service-wide generation
+        self._watcher = self._connect()
+        self._watch_lock = threading.Lock()
+        self._data_version = self._watcher.execute('PRAGMA data_version').fetchone()[0]
+        self._generation = 0
+
+        self.journal_mode = self._watcher.execute('PRAGMA journal_mode').fetchone()[0]
+        self.has_comment_tree = self._has_table('comment_tree')
+        # Lookups by id go through the compact tables' indexes on a compact copy
+        self.lookups = {(kind, column): compact_db.lookup_source(self._watcher, kind, column)
+                        for kind, column in (('submissions', 'id'), ('comments', 'link_id'))}
+
+    def _connect(self):
+        conn = compact_db.connect(f'file:{self.db_path}?mode=ro', uri=True, timeout=self.timeout,
+                                  check_same_thread=False, cached_statements=STATEMENT_CACHE)
+        conn.execute(f'PRAGMA mmap_size = {self.mmap_bytes}')
+        conn.execute('PRAGMA query_only = 1')
+        return conn
+
+    def _has_table(self, name):
+        return self._watcher.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?",
+                                     (name,)).fetchone() is not None
+
+    def close(self):
+        for conn in self.connections + [self._watcher]:
+            conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    @contextmanager
+    def connection(self):
+        """Borrow a pooled connection; blocks while all are in use."""
+        conn = self.pool.get()
+        try:
+            yield conn
+        finally:
+            self.pool.put(conn)
+
+    def generation(self):
+        with self._watch_lock:
+            version = self._watcher.execute('PRAGMA data_version').fetchone()[0]
+            if version != self._data_version:
+                self._data_version = version
+                self._generation += 1
+                self.cache.clear()
+                # A writer may have added the optional tables since
+                self.has_comment_tree = self._has_table('comment_tree')
+            return self._generation
+
+    def cached(self, key, compute):
+        """compute(conn) through the cache; key must identify the query and
+        all of its parameters."""
+        generation = self.generation()
+        key = (generation, key)
+        result = self.cache.get(key)
+        if result is None:
+            with self.connection() as conn:
+                result = tuple(compute(conn))
+            # A commit during compute makes the result possibly stale, so it
+            # is only kept if the generation didn't move
+            if self.generation() == generation:
+                self.cache.put(key, result)
+        return result
+
+    def query(self, sql, params=(), row_type=None, cache=True):
+        """Run a read-only query; rows come back as tuples, or row_type."""
+        params = tuple(params)
+
+        def compute(conn):
+            rows = conn.execute(sql, params).fetchall()
+            return rows if row_type is None else [row_type._make(row) for row in rows]
+
+        if not cache:
+            with self.connection() as conn:
+                return tuple(compute(conn))
+        return self.cached(('sql', sql, params, row_type), compute)
+
+    def submission(self, submission_id):
+        submission_id = submission_id[3:] if submission_id.startswith('t3_') else submission_id
+        source, binds = self.lookups['submissions', 'id']
+        rows = self.query(f'SELECT {SUBMISSION_COLUMNS} FROM {source}', (submission_id,) * binds, Submission)
+        return rows[0] if rows else None
+
+    def thread(self, link_id):
+        """All comments on a submission. In depth-first order with depths if
+        comment_tree.py has been run, otherwise by created_utc."""
+        link_id = link_id[3:] if link_id.startswith('t3_') else link_id
+        self.generation()  # refreshes has_comment_tree
+        if self.has_comment_tree:
+            def compute(conn):
+                return [Comment(comment_id, link_id, parent, depth, None, author, created_utc, score, body)
+                        for comment_id, parent, depth, _, _, _, author, body, score, created_utc
+                        in comment_tree.get_thread(conn, link_id)]
+            return self.cached(('thread', link_id), compute)
+        source, binds = self.lookups['comments', 'link_id']
+        return self.query(f'SELECT {COMMENT_COLUMNS} FROM {source} ORDER BY created_utc, id', (link_id,) * binds,
+                          Comment)
+
+    def subreddit_timeline(self, subreddit, after=None, before=None, limit=100):
+        """Newest submissions in a subreddit, optionally within [after, before)."""
+        return self.query(f'''
+        SELECT {SUBMISSION_COLUMNS} FROM submissions
+        WHERE subreddit = ? AND created_utc >= ? AND created_utc < ?
+        ORDER BY created_utc DESC LIMIT ?
+        ''', (subreddit, after if after is not None else -2**63, before if before is not None else 2**63 - 1,
+              limit), Submission)
+
+    def top_posts(self, subreddit, day, limit=10):
+        """Highest-scoring submissions of one UTC day (unix time of any
+        moment in it)."""
+        start = int(day) // DAY * DAY
+        return self.query(f'''
+        SELECT {SUBMISSION_COLUMNS} FROM submissions
+        WHERE subreddit = ? AND created_utc >= ? AND created_utc < ?
+        ORDER BY score DESC LIMIT ?
+        ''', (subreddit, start, start + DAY, limit), Submission)
+
+    def author_history(self, author, after=None, before=None, limit=100):
+        """An author's newest submissions and comments, merged newest first:
+        (submissions, comments) tuples of at most limit rows in total."""
+        params = (author, after if after is not None else -2**63, before if before is not None else 2**63 - 1,
+                  limit)
+        submissions = self.query(f'''
+        SELECT {SUBMISSION_COLUMNS} FROM submissions
+        WHERE author = ? AND created_utc >= ? AND created_utc < ?
+        ORDER BY created_utc DESC LIMIT ?
+        ''', params, Submission)
+        comments = self.query(f'''
+        SELECT {COMMENT_COLUMNS} FROM comments
+        WHERE author = ? AND created_utc >= ? AND created_utc < ?
+        ORDER BY created_utc DESC LIMIT ?
+        ''', params, Comment)
+        newest = sorted(submissions + comments, key=lambda row: row.created_utc or 0, reverse=True)[:limit]
+        return (tuple(row for row in newest if isinstance(row, Submission)),
+                tuple(row for row in newest if isinstance(row, Comment)))
+
+    def subreddit_daily(self, subreddits=None, after=None, before=None):
+        """rollups.subreddit_daily through the pool and cache."""
+        key = ('subreddit_daily', tuple(subreddits or ()), after, before)
+        return self.cached(key, lambda conn: rollups.subreddit_daily(conn, subreddits, after, before))
+
+    def stats(self):
+        return {
+            'generation': self._generation,
+            'journal_mode': self.journal_mode,
+            'cached_results': len(self.cache.entries),
+            'cached_mb': self.cache.bytes / 1024 ** 2,
+            'hits': self.cache.hits,
+            'misses': self.cache.misses,
+        }
+
+
+def _date(ts):
+    return datetime.fromtimestamp(int(ts), timezone.utc).strftime('%Y-%m-%d %H:%M') if ts else 'unknown'
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Query the database through the pooled, cached query service")
+    parser.add_argument("--db", default=DB_PATH, help="SQLite database path")
+    parser.add_argument("--enable-wal", action="store_true",
+                        help="Switch the database to WAL so queries can run during imports")
+    parser.add_argument("--create-indexes", action="store_true",
+                        help="Create the composite indexes the timeline and history queries use")
+    parser.add_argument("--thread", default=None, help="Print the comments on this submission")
+    parser.add_argument("--subreddit", default=None, help="Print this subreddit's newest submissions")
+    parser.add_argument("--top-day", default=None,
+                        help="With --subreddit: print that day's top submissions instead (YYYY-MM-DD)")
+    parser.add_argument("--author", default=None, help="Print this author's newest submissions and comments")
+    parser.add_argument("--after", type=parse_timestamp, default=None, help="Unix time or YYYY-MM-DD")
+    parser.add_argument("--before", type=parse_timestamp, default=None, help="Unix time or YYYY-MM-DD")
+    parser.add_argument("--limit", type=int, default=20)
+    parser.add_argument("--repeat", type=int, default=1, help="Run the query N times and report timings")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    if args.enable_wal:
+        print(f"Journal mode: {enable_wal(args.db)}")
+    if args.create_indexes:
+        conn = sqlite3.connect(args.db)
+        create_service_indexes(conn)
+        conn.close()
+
+    with QueryService(args.db) as service:
+        if service.journal_mode != 'wal':
+            print("Note: the database is not in WAL mode, queries wait for import commits (see --enable-wal)")
+
+        if args.thread:
+            run = lambda: service.thread(args.thread)
+        elif args.subreddit and args.top_day:
+            run = lambda: service.top_posts(args.subreddit, parse_timestamp(args.top_day), args.limit)
+        elif args.subreddit:
+            run = lambda: service.subreddit_timeline(args.subreddit, args.after, args.before, args.limit)
+        elif args.author:
+            run = lambda: service.author_history(args.author, args.after, args.before, args.limit)
+        else:
+            return
+
+        timings = []
+        for _ in range(args.repeat):
+            start = time.perf_counter()
+            result = run()
+            timings.append(time.perf_counter() - start)
+
+        if args.author:
+            submissions, comments = result
+            rows = sorted(submissions + comments, key=lambda row: row.created_utc or 0, reverse=True)
+        else:
+            rows = result
+        for row in rows:
+            if isinstance(row, Submission):
+                print(f"{_date(row.created_utc)}  r/{row.subreddit}  [{row.score}] {row.title}")
+            else:
+                indent = '  ' * (row.depth or 0)
+                text = (row.body or '').replace('\n', ' ')[:80]
+                print(f"{indent}{_date(row.created_utc)}  [{row.score}] {row.author}: {text}")
+
+        print(f"{len(rows)} rows; first run {timings[0] * 1000:.1f} ms", end='')
+        if len(timings) > 1:
+            print(f", cached runs {min(timings[1:]) * 1000:.3f} ms", end='')
+        print(f"  {service.stats()}")
+
+
+if __name__ == "__main__":
+    main()
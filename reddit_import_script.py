@@ -2,9 +2,134 @@ import sqlite3
 import json
 import zstandard as zstd
 import os
-import io
+import argparse
+import hashlib
+import re
+import zlib
+from datetime import datetime, timezone
+import multiprocessing
+import queue
+import time
+from contextlib import contextmanager
 
-def create_database(db_path):
+import comment_tree
+import link_index
+import rollups
+import search_index
+import zst_index
+from dump_utils import parse_timestamp
+from import_memory import BatchSizer, ByteBudget, MB, ROW_MEMORY_FACTOR, current_rss_bytes, plan_memory
+from import_metrics import ImportMetrics
+
+SUBMISSION_INSERT_SQL = '''
+INSERT OR REPLACE INTO submissions 
+VALUES (?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?)
+'''
+
+COMMENT_INSERT_SQL = '''
+INSERT OR REPLACE INTO comments VALUES (?,?,?,?,?,?,?,?,?,?,?,?)
+'''
+
+TABLE_COLUMNS = {
+    'submissions': ['id', 'subreddit', 'title', 'selftext', 'author', 'created_utc', 'score',
+                    'num_comments', 'is_self', 'retrieved_on', 'stickied', 'over_18', 'spoiler',
+                    'locked', 'distinguished', 'permalink', 'has_image', 'image_url'],
+    'comments': ['id', 'subreddit', 'body', 'author', 'created_utc', 'score', 'link_id',
+                 'parent_id', 'retrieved_on', 'stickied', 'distinguished', 'controversiality'],
+}
+
+# Columns that change between scrapes of the same post. --conflict changed
+# only rewrites these, none of which is indexed, so an update never touches
+# the secondary indexes.
+VOLATILE_COLUMNS = {
+    'submissions': ['title', 'selftext', 'score', 'num_comments', 'stickied', 'over_18',
+                    'spoiler', 'locked', 'distinguished'],
+    'comments': ['body', 'score', 'stickied', 'distinguished', 'controversiality'],
+}
+
+# What to do when an imported id is already in the database:
+#   replace  INSERT OR REPLACE, rewriting the row and every index entry
+#   skip     keep the existing row
+#   latest   overwrite the row if the new one has a later retrieved_on
+#   changed  update the volatile columns if any of them differ, unless the
+#            new row was retrieved earlier than the stored one
+CONFLICT_POLICIES = ['replace', 'skip', 'latest', 'changed']
+
+SECONDARY_INDEXES = [
+    ('idx_submissions_subreddit', 'submissions(subreddit)'),
+    ('idx_submissions_author', 'submissions(author)'),
+    ('idx_submissions_created', 'submissions(created_utc)'),
+    ('idx_comments_link_id', 'comments(link_id)'),
+    ('idx_comments_author', 'comments(author)'),
+    ('idx_comments_subreddit', 'comments(subreddit)'),
+    ('idx_comments_parent_id', 'comments(parent_id)'),
+]
+
+# Ingest settings for --bulk-load. The rollback journal is kept in memory and
+# fsync is skipped, so a crash during a bulk load can leave the file unusable;
+# only use it for loads that can be rerun from the dumps.
+BULK_LOAD_PRAGMAS = [
+    ('journal_mode', 'MEMORY'),
+    ('synchronous', 'OFF'),
+    ('cache_size', -1048576),  # KiB, ~1 GB
+    ('temp_store', 'MEMORY'),
+    ('mmap_size', 8 * 1024 ** 3),
+]
+
+# Decompressed bytes per task when --workers splits an indexed dump
+SPLIT_CHUNK_BYTES = 512 * 1024 ** 2
+
+# How often a process waiting on worker processes checks that they are
+# still alive
+WORKER_POLL_SECONDS = 5
+
+# SQLite defaults, restored once the load is finished
+SAFE_PRAGMAS = [
+    ('journal_mode', 'DELETE'),
+    ('synchronous', 'FULL'),
+    ('cache_size', -2000),
+    ('temp_store', 'DEFAULT'),
+    ('mmap_size', 0),
+]
+
+def _load_json_backend():
+    try:
+        import orjson
+        return 'orjson', orjson.loads
+    except ImportError:
+        pass
+
+    try:
+        import simdjson
+        # The parser decodes lazily, so parse_* only materializes the fields
+        # it reads. It refuses to parse again while anything still holds the
+        # previous document (a traceback kept in the error list, a nested
+        # value that ended up in a row); that costs a fresh parser instead.
+        parser = simdjson.Parser()
+
+        def loads(line):
+            nonlocal parser
+            try:
+                return parser.parse(line)
+            except RuntimeError:
+                parser = simdjson.Parser()
+                return parser.parse(line)
+
+        return 'simdjson', loads
+    except ImportError:
+        pass
+
+    return 'json', json.loads
+
+JSON_BACKEND, json_loads = _load_json_backend()
+
+@contextmanager
+def timed(label):
+    start = time.perf_counter()
+    yield
+    print(f"  [{label}] {time.perf_counter() - start:.2f}s")
+
+def create_database(db_path, with_indexes=True):
     conn = sqlite3.connect(db_path)
     cursor = conn.cursor()
     
@@ -50,225 +175,1601 @@ def create_database(db_path):
     )
     ''')
     
-    cursor.execute('CREATE INDEX IF NOT EXISTS idx_submissions_subreddit ON submissions(subreddit)')
-    cursor.execute('CREATE INDEX IF NOT EXISTS idx_submissions_author ON submissions(author)')
-    cursor.execute('CREATE INDEX IF NOT EXISTS idx_submissions_created ON submissions(created_utc)')
-    cursor.execute('CREATE INDEX IF NOT EXISTS idx_comments_link_id ON comments(link_id)')
-    cursor.execute('CREATE INDEX IF NOT EXISTS idx_comments_author ON comments(author)')
-    cursor.execute('CREATE INDEX IF NOT EXISTS idx_comments_subreddit ON comments(subreddit)')
+    create_progress_table(conn)
+    ensure_authors_table(conn)
+    
+    if with_indexes:
+        create_indexes(conn)
     
     conn.commit()
     return conn
 
-def decompress_zst_file(file_path, chunk_size=16384): 
-    dctx = zstd.ZstdDecompressor(max_window_size=2**31)
-    
-    with open(file_path, 'rb') as ifh:
-        reader = dctx.stream_reader(ifh, read_size=chunk_size)
-        text_buffer = io.TextIOWrapper(reader, encoding='utf-8', errors='ignore')
-        
-        for line in text_buffer:
-            line = line.strip()
-            if line:
-                yield line
+def ensure_authors_table(conn):
+    # One row per distinct author, kept up to date by the importer so
+    # fetch_users.py never has to run SELECT DISTINCT over both tables. A
+    # database that predates the table is backfilled once, inside SQLite.
+    cursor = conn.cursor()
+    cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'authors'")
+    if cursor.fetchone():
+        return
+
+    cursor.execute('''
+    CREATE TABLE authors (
+        author TEXT PRIMARY KEY,
+        first_seen_utc INTEGER,
+        last_seen_utc INTEGER
+    ) WITHOUT ROWID
+    ''')
+
+    cursor.execute("SELECT name FROM sqlite_master WHERE type IN ('table', 'view') AND name IN ('submissions', 'comments')")
+    for (table,) in cursor.fetchall():
+        cursor.execute(f'''
+        INSERT INTO authors (author, first_seen_utc, last_seen_utc)
+        SELECT author, MIN(created_utc), MAX(created_utc) FROM {table}
+        WHERE author IS NOT NULL AND author != '[deleted]'
+        GROUP BY author
+        ORDER BY author
+        ''' + AUTHOR_UPSERT_CLAUSE)
+    conn.commit()
 
-def import_submissions(conn, file_path, batch_size=100000):
+AUTHOR_UPSERT_CLAUSE = '''
+ON CONFLICT(author) DO UPDATE SET
+    first_seen_utc = MIN(COALESCE(first_seen_utc, excluded.first_seen_utc), excluded.first_seen_utc),
+    last_seen_utc = MAX(COALESCE(last_seen_utc, excluded.last_seen_utc), excluded.last_seen_utc)
+'''
+
+def update_authors(cursor, kind, rows):
+    author_col = FILTER_COLUMNS[kind]['author']
+    created_col = FILTER_COLUMNS[kind]['created_utc']
+    seen = {}
+
+    for row in rows:
+        author = row[author_col]
+        if not author or author == '[deleted]':
+            continue
+        try:
+            created = int(row[created_col])
+        except (TypeError, ValueError):
+            created = None
+        if author in seen:
+            first, last = seen[author]
+            if created is not None:
+                first = created if first is None else min(first, created)
+                last = created if last is None else max(last, created)
+            seen[author] = (first, last)
+        else:
+            seen[author] = (created, created)
+
+    cursor.executemany(
+        'INSERT INTO authors (author, first_seen_utc, last_seen_utc) VALUES (?, ?, ?)' + AUTHOR_UPSERT_CLAUSE,
+        [(author, first, last) for author, (first, last) in seen.items()]
+    )
+
+def _conflict_condition(kind, policy, old, new):
+    # SQL that is true when the stored row (alias old) should be overwritten
+    # by the incoming one (alias new)
+    if policy == 'skip':
+        return '0'
+    newer = f'{new}.retrieved_on > COALESCE({old}.retrieved_on, -1)'
+    if policy == 'latest':
+        return newer
+    differs = ' OR '.join(f'{new}.{col} IS NOT {old}.{col}' for col in VOLATILE_COLUMNS[kind])
+    return f'({differs}) AND COALESCE({new}.retrieved_on, 0) >= COALESCE({old}.retrieved_on, 0)'
+
+def _upsert_sql(kind, policy):
+    columns = TABLE_COLUMNS[kind]
+    if policy == 'skip':
+        action = 'DO NOTHING'
+    else:
+        updated = columns[1:] if policy == 'latest' else VOLATILE_COLUMNS[kind] + ['retrieved_on']
+        assignments = ', '.join(f'{col} = excluded.{col}' for col in updated)
+        action = f"DO UPDATE SET {assignments} WHERE {_conflict_condition(kind, policy, kind, 'excluded')}"
+    # "WHERE 1" keeps SQLite from reading ON CONFLICT as a join constraint
+    return f'''
+    INSERT INTO main.{kind} SELECT * FROM temp.stage_{kind} WHERE 1 ORDER BY id
+    ON CONFLICT(id) {action}
+    '''
+
+def _stage_rows(cursor, kind, rows):
+    cursor.execute(f'CREATE TEMP TABLE IF NOT EXISTS stage_{kind} AS SELECT * FROM main.{kind} WHERE 0')
+    cursor.execute(f'DELETE FROM temp.stage_{kind}')
+    placeholders = ', '.join('?' for _ in TABLE_COLUMNS[kind])
+    cursor.executemany(f'INSERT INTO temp.stage_{kind} VALUES ({placeholders})', rows)
+
+def _column_store(conn):
+    # analytics.py pulls in NumPy, so it is only imported for a database
+    # that has a column store (python analytics.py --build); everything
+    # else, including post_export.py and codebook_generator.py through it,
+    # never loads NumPy. Returns the analytics module, or None.
     cursor = conn.cursor()
-    submissions = []
-    count = 0
-    errors = 0
+    cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'column_store_state'")
+    if cursor.fetchone() is None:
+        return None
+    import analytics
+    return analytics
 
-    print(f"Importing submissions from {file_path}...")
+def write_rows(cursor, kind, rows, conflict='replace'):
+    # Everything that has to happen per batch besides the INSERT itself:
+    # keep the authors table and, if they exist, the FTS index and the
+    # rollups in step, and mark the comment threads the batch touches for
+    # comment_tree.py and link_index.py and the rewritten rows for
+    # analytics.py. Returns the number of rows inserted or updated.
+    fts_enabled = kind in search_index.enabled_kinds(cursor.connection)
+    rollups_enabled = rollups.enabled(cursor.connection)
+    analytics = _column_store(cursor.connection)
 
-    try:
-        for line in decompress_zst_file(file_path):
-            try:
-                data = json.loads(line)
-                submission_id = data.get("id")
-
-                post_hint = data.get("post_hint")
-                domain = str(data.get("domain") or "")
-                external_url = data.get("url")
-
-                has_image = False
-                image_url = None
-                if post_hint == "image" or domain.startswith(("i.redd.it", "i.imgur.com")):
-                    has_image = True
-                    image_url = external_url or None
-
-                selftext = data.get("selftext")
-                if not selftext:
-                    if not data.get("is_self") and external_url:
-                        selftext = external_url
-                    else:
-                        selftext = None
-
-                submissions.append((
-                    submission_id,
-                    data.get('subreddit'),
-                    data.get('title'),
-                    selftext,          
-                    data.get('author'),
-                    data.get('created_utc'),
-                    data.get('score'),
-                    data.get('num_comments'),
-                    data.get('is_self'),
-                    data.get('retrieved_on'),
-                    data.get('stickied'),
-                    data.get('over_18'),
-                    data.get('spoiler'),
-                    data.get('locked'),
-                    data.get('distinguished'),
-                    data.get('permalink'),
-                    has_image,
-                    image_url
-                ))
-
-                count += 1
-
-                if len(submissions) >= batch_size:
-                    cursor.executemany('''
-                    INSERT OR REPLACE INTO submissions 
-                    VALUES (?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?)
-                    ''', submissions)
-                    conn.commit()
-                    print(f"  Imported {count} submissions...")
-                    submissions = []
-
-            except json.JSONDecodeError as e:
-                errors += 1
-                if errors < 10:
-                    print(f"  JSON error (line {count + errors}): {str(e)[:100]}")
+    if conflict != 'replace':
+        # Stage the batch and find the rows that would actually change, so
+        # a batch that is already in the database is only ever read
+        _stage_rows(cursor, kind, rows)
+        cursor.execute(f'''
+        SELECT s.id FROM temp.stage_{kind} s
+        LEFT JOIN main.{kind} t ON t.id = s.id
+        WHERE t.id IS NULL OR {_conflict_condition(kind, conflict, 't', 's')}
+        ''')
+        changed = {row[0] for row in cursor.fetchall()}
+        if not changed:
+            return 0
+        rows = [row for row in rows if row[0] in changed]
+
+    if fts_enabled:
+        search_index.unindex_rows(cursor, kind, rows)
+    if rollups_enabled:
+        stored = rollups.snapshot(cursor, kind, rows)
+    if analytics:
+        analytics.track(cursor, kind, rows)
+    if conflict == 'replace':
+        cursor.executemany(INSERT_SQL[kind], rows)
+    else:
+        cursor.execute(_upsert_sql(kind, conflict))
+    update_authors(cursor, kind, rows)
+    if fts_enabled:
+        search_index.index_rows(cursor, kind, rows)
+    if rollups_enabled:
+        rollups.apply(cursor, kind, stored, rollups.snapshot(cursor, kind, rows))
+    if analytics:
+        analytics.track(cursor, kind, rows)
+    if kind == 'comments' and comment_tree.enabled(cursor.connection):
+        link_col = TABLE_COLUMNS['comments'].index('link_id')
+        comment_tree.mark_stale(cursor, (row[link_col] for row in rows))
+    if link_index.enabled(cursor.connection):
+        if kind == 'comments':
+            link_col = TABLE_COLUMNS['comments'].index('link_id')
+            link_index.mark_stale(cursor, (row[link_col] for row in rows))
+        else:
+            link_index.mark_resolved(cursor, (row[0] for row in rows))
+    return len(rows)
+
+def create_progress_table(conn):
+    cursor = conn.cursor()
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS import_progress (
+        file_path TEXT PRIMARY KEY,
+        kind TEXT,
+        content_hash TEXT,
+        decompressed_offset INTEGER,
+        compressed_offset INTEGER,
+        lines_done INTEGER,
+        rows_done INTEGER,
+        errors INTEGER,
+        completed BOOLEAN,
+        updated_on INTEGER
+    )
+    ''')
+    conn.commit()
+
+def filter_key(filter_spec):
+    if not filter_spec:
+        return ''
+    return repr(sorted((k, sorted(v) if isinstance(v, set) else v) for k, v in filter_spec.items()))
+
+def file_fingerprint(file_path, filter_spec=None, head_bytes=1024 * 1024):
+    # Size plus a hash of the first MiB: cheap enough to run on every start
+    # and enough to notice a dump that was replaced or re-downloaded. The
+    # filter spec is mixed in so changing filters re-imports the file.
+    digest = hashlib.sha1()
+    digest.update(str(os.path.getsize(file_path)).encode())
+    if filter_spec:
+        digest.update(filter_key(filter_spec).encode())
+    with open(file_path, 'rb') as f:
+        digest.update(f.read(head_bytes))
+    return digest.hexdigest()
+
+def resume_point(conn, file_path, fingerprint):
+    # Returns (decompressed_offset, lines, rows, errors) to continue from, or
+    # None if the file was already imported completely.
+    cursor = conn.cursor()
+    cursor.execute('''
+    SELECT content_hash, decompressed_offset, lines_done, rows_done, errors, completed
+    FROM import_progress WHERE file_path = ?
+    ''', (file_path,))
+    row = cursor.fetchone()
+
+    if row is None:
+        return (0, 0, 0, 0)
+    if row[0] != fingerprint:
+        print(f"  {file_path} or the import filters changed since the last run, importing it from the start")
+        return (0, 0, 0, 0)
+    if row[5]:
+        return None
+    return tuple(row[1:5])
+
+def save_progress(conn, kind, file_path, fingerprint, position, completed=False):
+    # Written in the same transaction as the batch it describes, so the
+    # checkpoint never gets ahead of the committed rows.
+    offset, compressed_offset, lines, rows, errors = position
+    conn.execute('''
+    INSERT OR REPLACE INTO import_progress
+    (file_path, kind, content_hash, decompressed_offset, compressed_offset,
+     lines_done, rows_done, errors, completed, updated_on)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+    ''', (file_path, kind, fingerprint, offset, compressed_offset, lines, rows, errors,
+          completed, int(time.time())))
+
+def create_manifest_table(conn):
+    # Every dump file an incremental import has seen, with the size and
+    # mtime it had then, so unchanged files are skipped without being opened
+    cursor = conn.cursor()
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS import_manifest (
+        file_path TEXT PRIMARY KEY,
+        kind TEXT,
+        size INTEGER,
+        mtime_ns INTEGER,
+        content_hash TEXT,
+        filters TEXT,
+        status TEXT,
+        imported_on INTEGER
+    )
+    ''')
+    conn.commit()
+
+def plan_incremental(db_path, submission_files, comment_files, filter_spec, settle_seconds=60):
+    # Returns [(kind, file_path, size, mtime_ns, fingerprint, needs_import)]
+    # for the files that are new or differ from their manifest row. A file
+    # whose size and mtime match an imported row is not read at all; one
+    # that was only touched (same fingerprint) is listed with needs_import
+    # False so its manifest row can be updated. Files modified in the last
+    # settle_seconds may still be downloading and are left for the next run.
+    known = {}
+    if os.path.exists(db_path):
+        conn = sqlite3.connect(db_path)
+        try:
+            cursor = conn.cursor()
+            cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'import_manifest'")
+            if cursor.fetchone():
+                cursor.execute('SELECT file_path, size, mtime_ns, content_hash, filters, status FROM import_manifest')
+                known = {row[0]: row[1:] for row in cursor.fetchall()}
+        finally:
+            conn.close()
+
+    filters = filter_key(filter_spec)
+    now = time.time()
+    changes = []
+    for kind, files in (('submissions', submission_files), ('comments', comment_files)):
+        for file_path in files:
+            if not file_in_time_range(file_path, filter_spec):
                 continue
-            except Exception as e:
-                errors += 1
-                if errors < 10:
-                    print(f"  Import error (line {count + errors}): {str(e)[:100]}")
+            stat = os.stat(file_path)
+            if now - stat.st_mtime < settle_seconds:
+                print(f"Skipping {file_path} for now (modified in the last {settle_seconds:.0f}s)")
                 continue
+            row = known.get(file_path)
+            if row is not None and row[4] == 'imported' and row[3] == filters:
+                if (row[0], row[1]) == (stat.st_size, stat.st_mtime_ns):
+                    continue
+            fingerprint = file_fingerprint(file_path, filter_spec)
+            unchanged = row is not None and row[4] == 'imported' and row[2] == fingerprint
+            changes.append((kind, file_path, stat.st_size, stat.st_mtime_ns, fingerprint, not unchanged))
+    return changes
 
-        if submissions:
-            cursor.executemany('''
-            INSERT OR REPLACE INTO submissions 
-            VALUES (?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?)
-            ''', submissions)
-            conn.commit()
+def record_manifest(conn, changes, filter_spec):
+    # A file counts as imported once import_progress has it (or all of its
+    # chunks) completed; anything else is retried on the next run
+    filters = filter_key(filter_spec)
+    now = int(time.time())
+    imported = 0
+    for kind, file_path, size, mtime_ns, fingerprint, needs_import in changes:
+        done = not needs_import or not plan_file_tasks(conn, kind, file_path, fingerprint)
+        imported += needs_import and done
+        conn.execute('''
+        INSERT OR REPLACE INTO import_manifest
+        (file_path, kind, size, mtime_ns, content_hash, filters, status, imported_on)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        ''', (file_path, kind, size, mtime_ns, fingerprint, filters, 'imported' if done else 'failed', now))
+    conn.commit()
+    return imported
 
-        print(f"Imported {count} submissions ({errors} errors)\n")
+def secondary_indexes(conn):
+    # link_index.py's covering index stands in for comments(link_id)
+    if link_index.enabled(conn):
+        return [index for index in SECONDARY_INDEXES if index != link_index.REPLACED_INDEX]
+    return SECONDARY_INDEXES
 
-    except Exception as e:
-        print(f"Fatal error reading file: {e}\n")
+def create_indexes(conn):
+    cursor = conn.cursor()
+    for name, target in secondary_indexes(conn):
+        cursor.execute(f'CREATE INDEX IF NOT EXISTS {name} ON {target}')
+    conn.commit()
 
-def import_comments(conn, file_path, batch_size=100000):
+def drop_indexes(conn):
     cursor = conn.cursor()
-    comments = []
-    count = 0
-    errors = 0
-    
-    print(f"Importing comments from {file_path}...")
-    
-    try:
-        for line in decompress_zst_file(file_path):
+    for name, _ in SECONDARY_INDEXES:
+        cursor.execute(f'DROP INDEX IF EXISTS {name}')
+    conn.commit()
+
+def set_pragmas(conn, pragmas):
+    for name, value in pragmas:
+        conn.execute(f'PRAGMA {name} = {value}')
+
+def begin_bulk_load(conn, keep_indexes=False):
+    # keep_indexes is for incremental imports, where rebuilding the indexes
+    # would cost more than maintaining them for the new rows
+    print("Bulk load: tuning PRAGMAs" + ("" if keep_indexes else " and dropping secondary indexes"))
+    with timed("set ingest PRAGMAs"):
+        set_pragmas(conn, BULK_LOAD_PRAGMAS)
+    if not keep_indexes:
+        with timed("drop secondary indexes"):
+            drop_indexes(conn)
+            # Rebuilt by link_index.refresh() at the end of the import
+            link_index.drop_index(conn, restore=False)
+
+def finish_bulk_load(conn, wal=False, incremental=False):
+    if incremental:
+        # Nothing was dropped; only refresh the planner statistics that
+        # the new rows made stale instead of re-analyzing every table
+        with timed("PRAGMA optimize"):
+            conn.execute('PRAGMA optimize')
+        with timed("restore safe PRAGMAs"):
+            set_pragmas(conn, SAFE_PRAGMAS)
+            if wal:
+                conn.execute('PRAGMA journal_mode = WAL')
+        return
+    print("Bulk load: rebuilding secondary indexes")
+    # Index builds sort through temp files; keep those on disk so a large
+    # table doesn't have to be sorted in RAM.
+    conn.execute('PRAGMA temp_store = DEFAULT')
+    cursor = conn.cursor()
+    for name, target in secondary_indexes(conn):
+        with timed(f"create {name}"):
+            cursor.execute(f'CREATE INDEX IF NOT EXISTS {name} ON {target}')
+            conn.commit()
+    if search_index.enabled_kinds(conn):
+        with timed("optimize FTS index"):
+            search_index.optimize(conn)
+    with timed("ANALYZE"):
+        conn.execute('ANALYZE')
+        conn.commit()
+    with timed("restore safe PRAGMAs"):
+        set_pragmas(conn, SAFE_PRAGMAS)
+        if wal:
+            conn.execute('PRAGMA journal_mode = WAL')
+
+def read_zst_line_batches(file_path, block_size=4 * 1024 * 1024, start_offset=0, end_offset=None):
+    # Reads large decompressed blocks and splits them on b"\n" without
+    # decoding to str. Yields (lines, offset, compressed_offset) where offset
+    # is the decompressed position just past the last complete line, i.e. a
+    # valid start_offset for resuming. A dump indexed with zst_index.py is
+    # opened at the nearest index point instead of decompressed from the
+    # start, and can be read up to end_offset.
+    index = zst_index.load_index(file_path)
+    if index is not None:
+        yield from zst_index.read_line_batches(file_path, index, start_offset, end_offset, block_size)
+        return
+    if end_offset is not None:
+        raise ValueError(f"{file_path} has no index, it can only be read to the end")
+
+    dctx = zstd.ZstdDecompressor(max_window_size=2**31)
+
+    with open(file_path, 'rb') as ifh:
+        reader = dctx.stream_reader(ifh, read_size=2**20, read_across_frames=True)
+        if start_offset:
+            # Forward seek decompresses and discards; no JSON work is done
+            reader.seek(start_offset)
+        consumed = start_offset
+        pending = b''
+
+        while True:
+            block = reader.read(block_size)
+            if not block:
+                break
+            consumed += len(block)
+            lines = (pending + block).split(b'\n')
+            pending = lines.pop()
+            yield [line for line in lines if line.strip()], consumed - len(pending), ifh.tell()
+
+        if pending:
+            yield ([pending] if pending.strip() else []), consumed, ifh.tell()
+
+def parse_lines(lines, parse, line_filter=None, timings=None):
+    # timings, if given, is a {'json': s, 'rows': s} dict that gets the time
+    # spent decoding vs. building row tuples, measured line by line
+    rows = []
+    errors = []
+
+    if line_filter is not None:
+        prefilter, keep_row = line_filter
+    else:
+        prefilter = keep_row = None
+
+    for index, line in enumerate(lines):
+        if prefilter is not None and not prefilter(line):
+            continue
+        try:
+            if timings is None:
+                row = parse(json_loads(line))
+            else:
+                start = time.perf_counter()
+                data = json_loads(line)
+                decoded = time.perf_counter()
+                try:
+                    row = parse(data)
+                finally:
+                    # A live simdjson document blocks the next parse
+                    del data
+                timings['json'] += decoded - start
+                timings['rows'] += time.perf_counter() - decoded
+        except ValueError as e:
             try:
-                data = json.loads(line)
-                
-                link_id = data.get('link_id', '').replace('t3_', '')
-                parent_id = data.get('parent_id', '')
-                
-                comments.append((
-                    data['id'],
-                    data.get('subreddit'),
-                    data.get('body'),
-                    data.get('author'),
-                    data.get('created_utc'),
-                    data.get('score'),
-                    link_id,
-                    parent_id,
-                    data.get('retrieved_on'),
-                    data.get('stickied'),
-                    data.get('distinguished'),
-                    data.get('controversiality')
-                ))
-                
-                count += 1
-                
-                if len(comments) >= batch_size:
-                    cursor.executemany('''
-                    INSERT OR REPLACE INTO comments VALUES (?,?,?,?,?,?,?,?,?,?,?,?)
-                    ''', comments)
-                    conn.commit()
-                    print(f"  Imported {count} comments...")
-                    comments = []
-                    
-            except json.JSONDecodeError as e:
-                errors += 1
-                if errors < 10:
-                    print(f"  JSON error (line {count + errors}): {str(e)[:100]}")
+                # Invalid UTF-8 is dropped rather than failing the line, as
+                # the old TextIOWrapper(errors='ignore') reader did.
+                row = parse(json.loads(line.decode('utf-8', errors='ignore')))
+            except ValueError:
+                errors.append(('JSON', index, e))
                 continue
             except Exception as e:
+                errors.append(('Import', index, e))
+                continue
+        except Exception as e:
+            errors.append(('Import', index, e))
+            continue
+        try:
+            # Odd values (a created_utc like "1.6e9", a string score) fail
+            # the filter's conversions; that costs the line, not the file
+            if keep_row is not None and not keep_row(row):
+                continue
+        except Exception as e:
+            errors.append(('Filter', index, e))
+            continue
+        rows.append(row)
+
+    return rows, errors
+
+def metered_line_batches(file_path, start_offset=0, metrics=None, end_offset=None):
+    # read_zst_line_batches, with the time spent inside it (decompressing and
+    # splitting lines) and the bytes read/produced added to metrics
+    batches = read_zst_line_batches(file_path, start_offset=start_offset, end_offset=end_offset)
+    if metrics is None:
+        yield from batches
+        return
+
+    last_offset = start_offset
+    last_compressed = 0
+    while True:
+        start = time.perf_counter()
+        batch = next(batches, None)
+        metrics.add_time('decompress', time.perf_counter() - start)
+        if batch is None:
+            return
+        lines, offset, compressed_offset = batch
+        metrics.add_block(len(lines), compressed_offset - last_compressed, offset - last_offset)
+        last_offset, last_compressed = offset, compressed_offset
+        yield batch
+
+def metered_parse_lines(lines, parse, line_filter=None, metrics=None):
+    if metrics is None:
+        return parse_lines(lines, parse, line_filter)
+    sample = {'json': 0.0, 'rows': 0.0} if metrics.should_sample_parse() else None
+    start = time.perf_counter()
+    rows, errors = parse_lines(lines, parse, line_filter, sample)
+    metrics.add_parse(time.perf_counter() - start, sample)
+    metrics.add_errors(errors)
+    return rows, errors
+
+def metered_write(conn, kind, rows, progress, metrics=None, commit=True, conflict='replace'):
+    # write_rows + save_progress (+ commit), timed as the write/commit stages.
+    # progress is the (kind, file_path, fingerprint, position[, completed])
+    # argument tuple for save_progress. Returns the number of rows written.
+    start = time.perf_counter()
+    written_rows = write_rows(conn.cursor(), kind, rows, conflict) if rows else 0
+    save_progress(conn, *progress)
+    written = time.perf_counter()
+    if commit:
+        conn.commit()
+    if metrics is not None:
+        metrics.add_time('write', written - start)
+        metrics.rows += len(rows)
+        if commit:
+            metrics.add_commit(time.perf_counter() - written)
+        else:
+            metrics.maybe_emit()
+    return written_rows
+
+# Byte patterns for the ingest prefilter. Nested objects (for example
+# crosspost_parent_list) can repeat a key, so every match is collected and a
+# line only passes if any of them could satisfy the filter; the exact check
+# runs on the parsed row afterwards.
+PREFILTER_PATTERNS = {
+    'subreddit': re.compile(rb'"subreddit"\s*:\s*"([^"]*)"'),
+    'author': re.compile(rb'"author"\s*:\s*"([^"]*)"'),
+    'created_utc': re.compile(rb'"created_utc"\s*:\s*"?(-?\d+)'),
+    'score': re.compile(rb'"score"\s*:\s*(-?\d+)'),
+}
+
+FILTER_COLUMNS = {
+    'submissions': {'subreddit': 1, 'author': 4, 'created_utc': 5, 'score': 6},
+    'comments': {'subreddit': 1, 'author': 3, 'created_utc': 4, 'score': 5},
+}
+
+def build_line_filter(filter_spec, kind):
+    # filter_spec is a plain dict so it can be sent to worker processes:
+    # subreddits / exclude_subreddits / authors (sets of lowercase names),
+    # after / before (unix timestamps, before is exclusive), min_score,
+    # shard = (index, count) to keep one subreddit-hash shard.
+    if not filter_spec:
+        return None
+
+    subreddits = filter_spec.get('subreddits')
+    exclude_subreddits = filter_spec.get('exclude_subreddits')
+    authors = filter_spec.get('authors')
+    after = filter_spec.get('after')
+    before = filter_spec.get('before')
+    min_score = filter_spec.get('min_score')
+    shard = filter_spec.get('shard')
+    columns = FILTER_COLUMNS[kind]
+
+    subreddit_bytes = {name.encode() for name in subreddits} if subreddits else None
+    exclude_bytes = {name.encode() for name in exclude_subreddits} if exclude_subreddits else None
+    author_bytes = {name.encode() for name in authors} if authors else None
+
+    def in_time_range(value):
+        return (after is None or value >= after) and (before is None or value < before)
+
+    def prefilter(line):
+        if subreddit_bytes is not None or exclude_bytes is not None:
+            found = [value.lower() for value in PREFILTER_PATTERNS['subreddit'].findall(line)]
+            if subreddit_bytes is not None and not any(value in subreddit_bytes for value in found):
+                return False
+            if exclude_bytes is not None and found and all(value in exclude_bytes for value in found):
+                return False
+        if author_bytes is not None:
+            found = PREFILTER_PATTERNS['author'].findall(line)
+            if not any(value.lower() in author_bytes for value in found):
+                return False
+        if after is not None or before is not None:
+            found = PREFILTER_PATTERNS['created_utc'].findall(line)
+            if found and not any(in_time_range(int(value)) for value in found):
+                return False
+        if min_score is not None:
+            found = PREFILTER_PATTERNS['score'].findall(line)
+            if found and not any(int(value) >= min_score for value in found):
+                return False
+        if shard is not None:
+            found = PREFILTER_PATTERNS['subreddit'].findall(line)
+            if found and not any(shard_for_subreddit(value.decode('utf-8', 'ignore'), shard[1]) == shard[0]
+                                 for value in found):
+                return False
+        return True
+
+    def keep_row(row):
+        subreddit = (row[columns['subreddit']] or '').lower()
+        if subreddits and subreddit not in subreddits:
+            return False
+        if exclude_subreddits and subreddit in exclude_subreddits:
+            return False
+        if authors and (row[columns['author']] or '').lower() not in authors:
+            return False
+        if after is not None or before is not None:
+            created = row[columns['created_utc']]
+            if created is None or not in_time_range(int(created)):
+                return False
+        if min_score is not None:
+            score = row[columns['score']]
+            if score is None or score < min_score:
+                return False
+        if shard is not None and shard_for_subreddit(subreddit, shard[1]) != shard[0]:
+            return False
+        return True
+
+    return prefilter, keep_row
+
+def shard_for_subreddit(subreddit, shard_count):
+    # crc32 rather than hash(): it has to agree across processes and runs
+    return zlib.crc32((subreddit or '').lower().encode()) % shard_count
+
+FILE_MONTH_RE = re.compile(r'R[SC]_(\d{4})-(\d{2})')
+
+def file_in_time_range(file_path, filter_spec):
+    # Monthly dumps outside the created_utc range can be skipped unopened
+    if not filter_spec:
+        return True
+    after = filter_spec.get('after')
+    before = filter_spec.get('before')
+    match = FILE_MONTH_RE.search(os.path.basename(file_path))
+    if match is None or (after is None and before is None):
+        return True
+
+    year, month = int(match.group(1)), int(match.group(2))
+    month_start = datetime(year, month, 1, tzinfo=timezone.utc)
+    month_end = datetime(year + month // 12, month % 12 + 1, 1, tzinfo=timezone.utc)
+    if after is not None and month_end.timestamp() <= after:
+        return False
+    if before is not None and month_start.timestamp() >= before:
+        return False
+    return True
+
+def parse_submission(data):
+    submission_id = data.get("id")
+
+    post_hint = data.get("post_hint")
+    domain = str(data.get("domain") or "")
+    external_url = data.get("url")
+
+    has_image = False
+    image_url = None
+    if post_hint == "image" or domain.startswith(("i.redd.it", "i.imgur.com")):
+        has_image = True
+        image_url = external_url or None
+
+    selftext = data.get("selftext")
+    if not selftext:
+        if not data.get("is_self") and external_url:
+            selftext = external_url
+        else:
+            selftext = None
+
+    return (
+        submission_id,
+        data.get('subreddit'),
+        data.get('title'),
+        selftext,          
+        data.get('author'),
+        data.get('created_utc'),
+        data.get('score'),
+        data.get('num_comments'),
+        data.get('is_self'),
+        data.get('retrieved_on'),
+        data.get('stickied'),
+        data.get('over_18'),
+        data.get('spoiler'),
+        data.get('locked'),
+        data.get('distinguished'),
+        data.get('permalink'),
+        has_image,
+        image_url
+    )
+
+def parse_comment(data):
+    link_id = data.get('link_id', '').replace('t3_', '')
+    parent_id = data.get('parent_id', '')
+
+    return (
+        data['id'],
+        data.get('subreddit'),
+        data.get('body'),
+        data.get('author'),
+        data.get('created_utc'),
+        data.get('score'),
+        link_id,
+        parent_id,
+        data.get('retrieved_on'),
+        data.get('stickied'),
+        data.get('distinguished'),
+        data.get('controversiality')
+    )
+
+ROW_PARSERS = {
+    'submissions': parse_submission,
+    'comments': parse_comment,
+}
+
+INSERT_SQL = {
+    'submissions': SUBMISSION_INSERT_SQL,
+    'comments': COMMENT_INSERT_SQL,
+}
+
+def parsed_bytes(lines, kept):
+    # Raw JSON bytes behind the rows kept from a block, prorated by count
+    if not lines:
+        return 0
+    return sum(map(len, lines)) * kept // len(lines)
+
+def over_memory(memory_limit):
+    # True once this process uses more than three quarters of the ceiling
+    if memory_limit is None:
+        return False
+    rss = current_rss_bytes()
+    return rss is not None and rss > memory_limit * 0.75
+
+def import_file(conn, kind, file_path, batch_size=None, commit_batches=True, resume=True, filter_spec=None,
+                metrics=None, conflict='replace', sizer=None, memory_limit=None):
+    # Batches are cut by size (sizer.target raw JSON bytes, adapted to write
+    # latency), by batch_size rows if given, or early when the process gets
+    # close to memory_limit bytes.
+    parse = ROW_PARSERS[kind]
+    line_filter = build_line_filter(filter_spec, kind)
+    sizer = sizer or BatchSizer()
+    rows = []
+    rows_bytes = 0
+
+    if not file_in_time_range(file_path, filter_spec):
+        print(f"Skipping {file_path} (outside the --after/--before range)\n")
+        return
+
+    fingerprint = file_fingerprint(file_path, filter_spec)
+    start = resume_point(conn, file_path, fingerprint) if resume else (0, 0, 0, 0)
+    if start is None:
+        print(f"Skipping {file_path} (already imported)\n")
+        return
+
+    offset, lines_seen, count, errors = start
+    compressed_offset = 0
+    written = 0
+
+    if offset:
+        print(f"Resuming {kind} from {file_path} at line {lines_seen:,} ({count:,} rows already imported)...")
+    else:
+        print(f"Importing {kind} from {file_path}...")
+
+    try:
+        for lines, offset, compressed_offset in metered_line_batches(file_path, offset, metrics):
+            batch_rows, batch_errors = metered_parse_lines(lines, parse, line_filter, metrics)
+            for label, index, e in batch_errors:
                 errors += 1
                 if errors < 10:
-                    print(f"  Import error (line {count + errors}): {str(e)[:100]}")
-                continue
-        
-        if comments:
-            cursor.executemany('''
-            INSERT OR REPLACE INTO comments VALUES (?,?,?,?,?,?,?,?,?,?,?,?)
-            ''', comments)
-            conn.commit()
-        
-        print(f"Imported {count} comments ({errors} errors)\n")
-        
+                    print(f"  {label} error (line {lines_seen + index + 1}): {str(e)[:100]}")
+            lines_seen += len(lines)
+            count += len(batch_rows)
+            rows.extend(batch_rows)
+            rows_bytes += parsed_bytes(lines, len(batch_rows))
+
+            full = rows_bytes >= sizer.target or (batch_size is not None and len(rows) >= batch_size)
+            if full or (rows_bytes >= sizer.min_bytes and over_memory(memory_limit)):
+                position = (offset, compressed_offset, lines_seen, count, errors)
+                started = time.perf_counter()
+                written += metered_write(conn, kind, rows, (kind, file_path, fingerprint, position), metrics,
+                                         commit=commit_batches, conflict=conflict)
+                if full:
+                    sizer.observe(time.perf_counter() - started)
+                else:
+                    sizer.shrink()
+                print(f"  Imported {count} {kind} (next batch {sizer.target / MB:.0f} MB)...")
+                rows = []
+                rows_bytes = 0
+
+        position = (offset, compressed_offset, lines_seen, count, errors)
+        written += metered_write(conn, kind, rows, (kind, file_path, fingerprint, position, True), metrics,
+                                 conflict=conflict)
+
+        if conflict == 'replace':
+            print(f"Imported {count} {kind} ({errors} errors)\n")
+        else:
+            print(f"Imported {count} {kind} ({written} new or updated, {errors} errors)\n")
+
     except Exception as e:
+        # Drop rows newer than the last checkpoint so a rerun resumes cleanly
+        conn.rollback()
+        if metrics is not None:
+            metrics.errors['fatal'] += 1
         print(f"Fatal error reading file: {e}\n")
 
+def import_submissions(conn, file_path, batch_size=None, commit_batches=True, resume=True, filter_spec=None,
+                       metrics=None, conflict='replace', sizer=None, memory_limit=None):
+    import_file(conn, 'submissions', file_path, batch_size, commit_batches, resume, filter_spec, metrics, conflict,
+                sizer, memory_limit)
+
+def import_comments(conn, file_path, batch_size=None, commit_batches=True, resume=True, filter_spec=None,
+                    metrics=None, conflict='replace', sizer=None, memory_limit=None):
+    import_file(conn, 'comments', file_path, batch_size, commit_batches, resume, filter_spec, metrics, conflict,
+                sizer, memory_limit)
+
+def _parse_worker(task_queue, row_queue, batch_size, filter_spec=None, collect_metrics=False,
+                  target_bytes=None, budget=None, worker_id=None):
+    # Runs in a child process: decompress + parse whole files (or chunks of
+    # indexed ones) and hand row batches to the writer, tagged with the
+    # task's import_progress key. Batches are cut at target_bytes (a shared
+    # value the writer adapts) or batch_size rows. The queue and the byte
+    # budget are bounded, so a slow writer blocks the workers instead of
+    # letting parsed rows pile up in memory. Each task is announced with
+    # worker_id, so the writer knows what a worker was doing if it dies.
+    metrics = ImportMetrics() if collect_metrics else None
+    while True:
+        task = task_queue.get()
+        if task is None:
+            row_queue.put(None)
+            return
+
+        kind, file_path, start, end_offset, key = task
+        row_queue.put(('started', kind, key, worker_id))
+        parse = ROW_PARSERS[kind]
+        line_filter = build_line_filter(filter_spec, kind)
+        rows = []
+        rows_bytes = 0
+        offset, lines_seen, count, errors = start
+        compressed_offset = 0
+
+        def send(rows, rows_bytes, position):
+            cost = int(rows_bytes * ROW_MEMORY_FACTOR)
+            if budget is not None:
+                budget.acquire(cost)
+            stats = metrics.drain() if metrics is not None else None
+            row_queue.put(('rows', kind, key, rows, position, stats, cost))
+
+        try:
+            for lines, offset, compressed_offset in metered_line_batches(file_path, offset, metrics, end_offset):
+                batch_rows, batch_errors = metered_parse_lines(lines, parse, line_filter, metrics)
+                lines_seen += len(lines)
+                count += len(batch_rows)
+                errors += len(batch_errors)
+                rows.extend(batch_rows)
+                rows_bytes += parsed_bytes(lines, len(batch_rows))
+
+                if ((target_bytes is not None and rows_bytes >= target_bytes.value)
+                        or (batch_size is not None and len(rows) >= batch_size)):
+                    send(rows, rows_bytes, (offset, compressed_offset, lines_seen, count, errors))
+                    rows = []
+                    rows_bytes = 0
+
+            position = (offset, compressed_offset, lines_seen, count, errors)
+            send(rows, rows_bytes, position)
+            row_queue.put(('done', kind, key, position))
+
+        except Exception as e:
+            row_queue.put(('failed', kind, key, str(e)))
+
+def _shard_reader(task_queue, shard_queues, filter_spec=None, collect_metrics=False, target_bytes=None,
+                  budget=None):
+    # Runs in a child process for --shard-by subreddit: decompress + parse
+    # each file once and split every batch by subreddit hash across the
+    # shard writers' queues. A task is (kind, file_path, start,
+    # shard_starts): start is the earliest checkpoint of any shard, and
+    # shard_starts[i] is shard i's own (None if it has the file already).
+    # Batches a shard wrote before are not sent to it again.
+    metrics = ImportMetrics() if collect_metrics else None
+    while True:
+        task = task_queue.get()
+        if task is None:
+            for shard_queue in shard_queues:
+                if shard_queue is not None:
+                    shard_queue.put(None)
+            return
+
+        kind, file_path, start, shard_starts = task
+        parse = ROW_PARSERS[kind]
+        line_filter = build_line_filter(filter_spec, kind)
+        column = FILTER_COLUMNS[kind]['subreddit']
+        targets = [index for index, shard_start in enumerate(shard_starts) if shard_start is not None]
+        counts = [shard_start[2] if shard_start is not None else 0 for shard_start in shard_starts]
+        rows = []
+        rows_bytes = 0
+        offset, lines_seen, _, errors = start
+        compressed_offset = 0
+
+        def send(rows, rows_bytes, offset, compressed_offset):
+            parts = {index: [] for index in targets}
+            for row in rows:
+                shard = shard_for_subreddit(row[column], len(shard_queues))
+                if shard in parts:
+                    parts[shard].append(row)
+            # The reader's stage timings go to one shard's metrics only
+            stats = metrics.drain() if metrics is not None else None
+            for index, part in parts.items():
+                if offset <= shard_starts[index][0]:
+                    continue
+                counts[index] += len(part)
+                cost = int(rows_bytes * ROW_MEMORY_FACTOR) * len(part) // len(rows) if rows else 0
+                if budget is not None:
+                    budget.acquire(cost)
+                position = (offset, compressed_offset, lines_seen, counts[index], errors)
+                shard_queues[index].put(('rows', kind, file_path, part, position, stats, cost))
+                stats = None
+            if stats:
+                metrics.merge(stats)
+
+        try:
+            for lines, offset, compressed_offset in metered_line_batches(file_path, start[0], metrics):
+                batch_rows, batch_errors = metered_parse_lines(lines, parse, line_filter, metrics)
+                lines_seen += len(lines)
+                errors += len(batch_errors)
+                rows.extend(batch_rows)
+                rows_bytes += parsed_bytes(lines, len(batch_rows))
+
+                if target_bytes is not None and rows_bytes >= target_bytes.value:
+                    send(rows, rows_bytes, offset, compressed_offset)
+                    rows = []
+                    rows_bytes = 0
+
+            send(rows, rows_bytes, offset, compressed_offset)
+            for index in targets:
+                position = (offset, compressed_offset, lines_seen, counts[index], errors)
+                shard_queues[index].put(('done', kind, file_path, position))
+
+        except Exception as e:
+            for index in targets:
+                shard_queues[index].put(('failed', kind, file_path, str(e)))
+
+def write_batches(conn, row_queue, workers, fingerprints, commit_batches=True, metrics=None, conflict='replace',
+                  sizer=None, budget=None, chunks_left=None, processes=None):
+    # chunks_left counts the unfinished chunk tasks of each split file.
+    # processes are the workers, checked whenever the queue stays empty
+    # for WORKER_POLL_SECONDS: one that died (say, killed for memory) never
+    # sends its end marker, so it is counted as finished and its task as
+    # failed instead of waiting for it forever.
+    chunks_left = dict(chunks_left or {})
+    finished = 0
+    written = {'submissions': 0, 'comments': 0}
+    working = {}
+    dead = set()
+
+    while finished < workers:
+        try:
+            messages = [row_queue.get(timeout=WORKER_POLL_SECONDS)]
+        except queue.Empty:
+            messages = []
+            for worker_id, process in enumerate(processes or []):
+                if worker_id in dead or not process.exitcode:
+                    continue
+                dead.add(worker_id)
+                finished += 1
+                if worker_id in working:
+                    kind, file_path = working.pop(worker_id)
+                    messages.append(('failed', kind, file_path, f"worker exited with code {process.exitcode}"))
+
+        for message in messages:
+            if message is None:
+                finished += 1
+                continue
+
+            status, kind, file_path = message[:3]
+            if status == 'started':
+                working[message[3]] = (kind, file_path)
+            elif status == 'rows':
+                rows, position, stats, cost = message[3:]
+                if metrics is not None and stats:
+                    metrics.merge(stats)
+                started = time.perf_counter()
+                metered_write(conn, kind, rows, (kind, file_path, fingerprints[file_path], position), metrics,
+                              commit=commit_batches, conflict=conflict)
+                written[kind] += len(rows)
+                del rows
+                if budget is not None:
+                    budget.release(cost)
+                if sizer is not None:
+                    sizer.observe(time.perf_counter() - started)
+                    print(f"  Imported {written[kind]} {kind} (next batch {sizer.target / MB:.0f} MB)...")
+                else:
+                    print(f"  Imported {written[kind]} {kind}...")
+            elif status == 'done':
+                working = {worker_id: task for worker_id, task in working.items() if task != (kind, file_path)}
+                position = message[3]
+                save_progress(conn, kind, file_path, fingerprints[file_path], position, completed=True)
+                conn.commit()
+                count, errors = position[3:]
+                print(f"Imported {count} {kind} from {file_path} ({errors} errors)")
+                whole_file = file_path.rsplit('#', 1)[0]
+                if whole_file in chunks_left:
+                    chunks_left[whole_file] -= 1
+                    if not chunks_left[whole_file]:
+                        save_split_progress(conn, kind, whole_file, fingerprints[file_path])
+            else:
+                working = {worker_id: task for worker_id, task in working.items() if task != (kind, file_path)}
+                # Commit rather than roll back: without commit_batches the open
+                # transaction also holds other tasks' batches, and every batch,
+                # including this task's, went in together with its checkpoint.
+                # A rerun resumes this task after its last written batch.
+                conn.commit()
+                if metrics is not None:
+                    metrics.errors['fatal'] += 1
+                print(f"Fatal error reading file {file_path}: {message[3]}")
+
+    return written
+
+def save_split_progress(conn, kind, file_path, fingerprint):
+    # Once every chunk of a split file is complete, record the file itself
+    # as completed with the chunks' totals, so runs that read it whole
+    # (serial imports, or one already started) skip it too
+    prefix = f"{file_path}#"
+    cursor = conn.cursor()
+    cursor.execute('''
+    SELECT MAX(decompressed_offset), MAX(compressed_offset), SUM(lines_done), SUM(rows_done), SUM(errors)
+    FROM import_progress WHERE substr(file_path, 1, ?) = ? AND content_hash = ?
+    ''', (len(prefix), prefix, fingerprint))
+    position = tuple(value or 0 for value in cursor.fetchone())
+    save_progress(conn, kind, file_path, fingerprint, position, completed=True)
+    conn.commit()
+    return position
+
+def plan_file_tasks(conn, kind, file_path, fingerprint, resume=True):
+    # Import tasks (kind, file_path, start, end_offset, progress_key) for one
+    # file. A dump with a zst_index.py index of several frames that has not
+    # been started as a whole is split into line-aligned chunks at frame
+    # starts, each with its own import_progress row (file_path#offset), so
+    # workers share one big file. A single-frame dump is never split: every
+    # chunk would have to decompress the stream from the start.
+    start = resume_point(conn, file_path, fingerprint) if resume else (0, 0, 0, 0)
+    if start is None:
+        return []
+    index = zst_index.load_index(file_path)
+    if index is None or index['frames'] < 2 or start != (0, 0, 0, 0):
+        return [(kind, file_path, start, None, file_path)]
+
+    chunks = zst_index.split(index, chunk_bytes=SPLIT_CHUNK_BYTES, frame_edges=True)
+    if len(chunks) < 2:
+        return [(kind, file_path, start, None, file_path)]
+
+    tasks = []
+    for chunk_start, chunk_end in chunks:
+        key = f"{file_path}#{chunk_start}"
+        start = resume_point(conn, key, fingerprint) if resume else (0, 0, 0, 0)
+        if start is None:
+            continue
+        if not start[0]:
+            start = (chunk_start,) + start[1:]
+        tasks.append((kind, file_path, start, chunk_end, key))
+    if not tasks:
+        # Split by a run that stopped before recording the whole file
+        save_split_progress(conn, kind, file_path, fingerprint)
+    return tasks
+
+def import_parallel(conn, submission_files, comment_files, workers, batch_size=None, queue_size=None,
+                    commit_batches=True, resume=True, filter_spec=None, metrics=None, conflict='replace',
+                    sizer=None, budget_bytes=None):
+    # sizer's target is shared with the workers; budget_bytes caps the
+    # estimated memory of batches queued for the writer
+    if queue_size is None:
+        queue_size = workers * 2
+    if sizer is None:
+        sizer = BatchSizer()
+    target_bytes = multiprocessing.Value('q', sizer.target)
+    sizer.shared = target_bytes
+    budget = ByteBudget(budget_bytes, multiprocessing) if budget_bytes else None
+
+    task_queue = multiprocessing.Queue()
+    row_queue = multiprocessing.Queue(maxsize=queue_size)
+    fingerprints = {}
+    chunks_left = {}
+    task_count = 0
+
+    files = [('submissions', f) for f in submission_files] + [('comments', f) for f in comment_files]
+    for kind, file_path in files:
+        if not file_in_time_range(file_path, filter_spec):
+            print(f"Skipping {file_path} (outside the --after/--before range)")
+            continue
+        fingerprint = file_fingerprint(file_path, filter_spec)
+        tasks = plan_file_tasks(conn, kind, file_path, fingerprint, resume)
+        if not tasks:
+            print(f"Skipping {file_path} (already imported)")
+            continue
+        if len(tasks) > 1 or tasks[0][4] != file_path:
+            print(f"Splitting {file_path} into {len(tasks)} chunk(s)")
+            chunks_left[file_path] = len(tasks)
+        for task in tasks:
+            fingerprints[task[4]] = fingerprint
+            task_queue.put(task)
+        task_count += len(tasks)
+    for _ in range(workers):
+        task_queue.put(None)
+
+    print(f"Importing {task_count} file(s) or chunk(s) with {workers} worker(s)...")
+    if metrics is not None:
+        metrics.workers = workers
+
+    processes = [
+        multiprocessing.Process(target=_parse_worker,
+                                args=(task_queue, row_queue, batch_size, filter_spec, metrics is not None,
+                                      target_bytes, budget, worker_id))
+        for worker_id in range(workers)
+    ]
+    for process in processes:
+        process.start()
+
+    try:
+        written = write_batches(conn, row_queue, workers, fingerprints, commit_batches, metrics, conflict,
+                                sizer, budget, chunks_left, processes)
+    finally:
+        for process in processes:
+            process.join()
+
+    print(f"Imported {written['submissions']} submissions and {written['comments']} comments\n")
+    return written
+
 def get_file_size_mb(file_path):
     size_bytes = os.path.getsize(file_path)
     return size_bytes / (1024 * 1024)
 
-def main():
-    db_path = 'reddit_data.db'
-    
-    if os.path.exists(db_path):
-        print(f"Opening existing database: {db_path}")
-        conn = sqlite3.connect(db_path)
-    else:
-        print(f"Database not found. Creating new database: {db_path}")
-        conn = create_database(db_path)  
-    
+def find_zst_files(zst_dir):
     submission_files = []
     comment_files = []
     
-    for root, dirs, files in os.walk('zst_files'):
+    for root, dirs, files in os.walk(zst_dir):
         for file in files:
             file_path = os.path.join(root, file)
             if file.endswith('_submissions.zst'):
                 submission_files.append(file_path)
             elif file.endswith('_comments.zst'):
                 comment_files.append(file_path)
+
+    return submission_files, comment_files
+
+def parse_name_list(value):
+    # "a,b,c" or "@path" to a file with one name per line
+    if value.startswith('@'):
+        with open(value[1:], 'r', encoding='utf-8') as f:
+            names = [line.strip() for line in f]
+    else:
+        names = value.split(',')
+    return {name.strip().lower() for name in names if name.strip()}
+
+def filter_spec_from_args(args):
+    spec = {
+        'subreddits': args.subreddits,
+        'exclude_subreddits': args.exclude_subreddits,
+        'authors': args.authors,
+        'after': args.after,
+        'before': args.before,
+        'min_score': args.min_score,
+    }
+    return {key: value for key, value in spec.items() if value is not None} or None
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Import Reddit .zst dumps into SQLite")
+    parser.add_argument('--db', default='reddit_data.db', help="SQLite database path")
+    parser.add_argument('--zst-dir', default='zst_files', help="Directory containing the .zst dumps")
+    parser.add_argument('--workers', type=int, default=1,
+                        help="Worker processes for decompress/parse (1 = import serially)")
+    parser.add_argument('--queue-size', type=int, default=None,
+                        help="Max row batches buffered between workers and the writer (default: 2 per worker)")
+    parser.add_argument('--batch-mb', type=float, default=32,
+                        help="Initial batch size in MB of JSON; adapted to --commit-seconds as the import runs")
+    parser.add_argument('--commit-seconds', type=float, default=2.0,
+                        help="Target time to write one batch: slower writes halve the batch size, much faster "
+                             "ones grow it")
+    parser.add_argument('--memory-mb', type=float, default=None,
+                        help="Approximate memory ceiling: caps batch size, batches queued for the writer and "
+                             "the SQLite cache (per shard process with --shard-by)")
+    parser.add_argument('--wal', action='store_true',
+                        help="Put the database in WAL mode so readers (query_service.py) are not blocked by "
+                             "import commits")
+    parser.add_argument('--bulk-load', action='store_true',
+                        help="Fast ingest: relaxed PRAGMAs, one transaction per file and secondary "
+                             "indexes rebuilt after the load (not crash-safe while running)")
+    parser.add_argument('--no-resume', action='store_true',
+                        help="Ignore import_progress and import every file from the start")
+    parser.add_argument('--subreddits', type=parse_name_list, default=None,
+                        help="Only import these subreddits (comma-separated, or @file with one per line)")
+    parser.add_argument('--exclude-subreddits', type=parse_name_list, default=None,
+                        help="Skip these subreddits (comma-separated, or @file)")
+    parser.add_argument('--authors', type=parse_name_list, default=None,
+                        help="Only import rows by these authors (comma-separated, or @file)")
+    parser.add_argument('--after', type=parse_timestamp, default=None,
+                        help="Only import rows created at or after this time (unix time or YYYY-MM-DD)")
+    parser.add_argument('--before', type=parse_timestamp, default=None,
+                        help="Only import rows created before this time (unix time or YYYY-MM-DD)")
+    parser.add_argument('--min-score', type=int, default=None,
+                        help="Only import rows with at least this score")
+    parser.add_argument('--shard-by', choices=['month', 'subreddit'], default=None,
+                        help="Write one SQLite file per month or per subreddit-hash bucket instead of --db")
+    parser.add_argument('--shard-count', type=int, default=16,
+                        help="Number of subreddit-hash shards (with --shard-by subreddit)")
+    parser.add_argument('--shard-dir', default='shards', help="Directory for shard databases")
+    parser.add_argument('--incremental', action='store_true',
+                        help="Only import dump files that are new or changed since they were last imported "
+                             "(tracked by path, size, mtime and content hash in import_manifest)")
+    parser.add_argument('--watch', type=float, default=None, metavar='SECONDS',
+                        help="Keep running and rescan --zst-dir every SECONDS for new dumps (implies "
+                             "--incremental)")
+    parser.add_argument('--settle-seconds', type=float, default=60,
+                        help="With --incremental, leave files modified more recently than this for the next "
+                             "scan, since they may still be copying")
+    parser.add_argument('--fts', action='store_true',
+                        help="Create the full-text search index (kept up to date by every later import)")
+    parser.add_argument('--rollups', action='store_true',
+                        help="Create per-subreddit/day, per-author/month and per-submission rollup tables "
+                             "(kept up to date by every later import)")
+    parser.add_argument('--link-index', action='store_true',
+                        help="Create the comment-to-submission covering index and per-submission summary, "
+                             "and report comments whose submission is missing (kept up to date by every "
+                             "later import)")
+    parser.add_argument('--conflict', choices=CONFLICT_POLICIES, default='replace',
+                        help="What to do with rows whose id is already imported: replace them (default), "
+                             "skip them, keep the one with the latest retrieved_on, or update only the "
+                             "columns that changed")
+    parser.add_argument('--metrics', action='store_true',
+                        help="Time each import stage and print a breakdown at the end")
+    parser.add_argument('--metrics-jsonl', default=None,
+                        help="Append a JSON metrics snapshot to this file every --metrics-interval seconds")
+    parser.add_argument('--metrics-prom', default=None,
+                        help="Keep a Prometheus textfile-collector file with the current metrics here")
+    parser.add_argument('--metrics-interval', type=float, default=10.0,
+                        help="Seconds between metrics snapshots (default: 10)")
+    return parser.parse_args()
+
+def metrics_from_args(args, suffix=None):
+    if not (args.metrics or args.metrics_jsonl or args.metrics_prom):
+        return None
+
+    def path(value):
+        # Shards each write their own file next to the requested one
+        if value is None or suffix is None:
+            return value
+        base, ext = os.path.splitext(value)
+        return f"{base}.{suffix}{ext}"
+
+    return ImportMetrics(path(args.metrics_jsonl), path(args.metrics_prom), args.metrics_interval)
+
+def open_database(db_path, args):
+    if os.path.exists(db_path):
+        print(f"Opening existing database: {db_path}")
+        conn = sqlite3.connect(db_path)
+    else:
+        print(f"Database not found. Creating new database: {db_path}")
+        conn = create_database(db_path, with_indexes=not args.bulk_load)  
     
-    print(f"Found {len(submission_files)} submission file(s)")
-    for file_path in submission_files:
-        size_mb = get_file_size_mb(file_path)
-        print(f"File size: {size_mb:.2f} MB")
-        import_submissions(conn, file_path)
-    
-    print(f"Found {len(comment_files)} comment file(s)")
-    for file_path in comment_files:
-        size_mb = get_file_size_mb(file_path)
-        print(f"File size: {size_mb:.2f} MB")
-        import_comments(conn, file_path)
+    create_progress_table(conn)
+    ensure_authors_table(conn)
+    if args.wal:
+        # Persistent; lets query_service.py readers run during the import
+        conn.execute('PRAGMA journal_mode = WAL')
+    if args.fts:
+        search_index.create_search_index(conn)
+    elif search_index.enabled_kinds(conn):
+        # Moves indexes from before the docid mapping over to it
+        search_index.create_search_index(conn, search_index.enabled_kinds(conn))
+    if args.rollups:
+        rollups.create_rollups(conn)
+    if args.link_index and not link_index.enabled(conn):
+        link_index.build(conn)
+    if comment_tree.enabled(conn):
+        # Adds the stale-thread table to trees built before it existed
+        comment_tree.create_tree_table(conn)
+    create_manifest_table(conn)
+    return conn
+
+def memory_plan_from_args(args, conn):
+    # (BatchSizer, in-flight byte budget, memory ceiling in bytes) for the
+    # --batch-mb / --memory-mb / --commit-seconds options
+    memory_limit = int(args.memory_mb * MB) if args.memory_mb else None
+    max_batch, budget_bytes, cache_kib = plan_memory(memory_limit, args.workers)
+    if cache_kib is not None:
+        # Overrides the 1 GB bulk-load cache when the ceiling is smaller
+        conn.execute(f'PRAGMA cache_size = -{cache_kib}')
+        print(f"Memory ceiling {args.memory_mb:.0f} MB: batches up to {max_batch / MB:.0f} MB, "
+              f"{budget_bytes / MB:.0f} MB queued, {cache_kib // 1024} MB SQLite cache")
+    sizer = BatchSizer(int(args.batch_mb * MB), max_bytes=max_batch, commit_seconds=args.commit_seconds)
+    return sizer, budget_bytes, memory_limit
+
+def run_import(conn, submission_files, comment_files, args, filter_spec, metrics=None):
+    commit_batches = not args.bulk_load
+    resume = not args.no_resume
+    if args.bulk_load:
+        begin_bulk_load(conn, keep_indexes=args.incremental)
+    sizer, budget_bytes, memory_limit = memory_plan_from_args(args, conn)
     
+    if args.workers > 1:
+        print(f"Found {len(submission_files)} submission file(s) and {len(comment_files)} comment file(s)")
+        with timed("parallel import"):
+            import_parallel(conn, submission_files, comment_files, args.workers, queue_size=args.queue_size,
+                            commit_batches=commit_batches, resume=resume, filter_spec=filter_spec,
+                            metrics=metrics, conflict=args.conflict, sizer=sizer, budget_bytes=budget_bytes)
+    else:
+        print(f"Found {len(submission_files)} submission file(s)")
+        for file_path in submission_files:
+            size_mb = get_file_size_mb(file_path)
+            print(f"File size: {size_mb:.2f} MB")
+            with timed(f"import {os.path.basename(file_path)}"):
+                import_submissions(conn, file_path, commit_batches=commit_batches, resume=resume,
+                                   filter_spec=filter_spec, metrics=metrics, conflict=args.conflict,
+                                   sizer=sizer, memory_limit=memory_limit)
+        
+        print(f"Found {len(comment_files)} comment file(s)")
+        for file_path in comment_files:
+            size_mb = get_file_size_mb(file_path)
+            print(f"File size: {size_mb:.2f} MB")
+            with timed(f"import {os.path.basename(file_path)}"):
+                import_comments(conn, file_path, commit_batches=commit_batches, resume=resume,
+                                filter_spec=filter_spec, metrics=metrics, conflict=args.conflict,
+                                sizer=sizer, memory_limit=memory_limit)
+    finish_import(conn, args, metrics)
+
+def finish_import(conn, args, metrics=None):
+    # The post-import stages, once every batch is written
+    if args.bulk_load:
+        finish_bulk_load(conn, wal=args.wal, incremental=args.incremental)
+    if comment_tree.enabled(conn):
+        # Only the threads this import added comments to
+        comment_tree.refresh_stale(conn)
+    if link_index.enabled(conn):
+        link_index.refresh(conn)
+        (threads, comments), _ = link_index.orphan_summary(conn)
+        if threads:
+            print(f"{comments:,} comment(s) in {threads:,} thread(s) have no submission in this database; "
+                  f"see python link_index.py --orphans")
+    analytics = _column_store(conn)
+    if analytics:
+        analytics.refresh(conn)
+    if metrics is not None:
+        metrics.print_summary()
+
+def table_counts(conn):
     cursor = conn.cursor()
     cursor.execute('SELECT COUNT(*) FROM submissions')
     sub_count = cursor.fetchone()[0]
     cursor.execute('SELECT COUNT(*) FROM comments')
     com_count = cursor.fetchone()[0]
-    
-    print("IMPORT COMPLETE!")
-    print(f"Total submissions: {sub_count:,}")
-    print(f"Total comments: {com_count:,}")
-    print(f"Database saved to: {db_path}")
-    
+    return sub_count, com_count
+
+def file_month(file_path):
+    match = FILE_MONTH_RE.search(os.path.basename(file_path))
+    return f"{match.group(1)}-{match.group(2)}" if match else None
+
+def plan_shards(shard_by, shard_dir, submission_files, comment_files, shard_count, filter_spec):
+    # Returns (shard_path, submission_files, comment_files, filter_spec) jobs.
+    # Month shards take whole files (the month comes from the RS_/RC_ name).
+    # Subreddit shards all list every file, but the files are read once and
+    # their rows routed (import_subreddit_shards); the shard key in their
+    # filter_spec keeps each shard's fingerprints and manifest its own.
+    jobs = []
+    if shard_by == 'month':
+        by_month = {}
+        for kind_index, files in enumerate((submission_files, comment_files)):
+            for file_path in files:
+                month = file_month(file_path) or 'unknown'
+                by_month.setdefault(month, ([], []))[kind_index].append(file_path)
+        for month, (subs, coms) in sorted(by_month.items()):
+            jobs.append((os.path.join(shard_dir, f"month_{month}.db"), subs, coms, filter_spec))
+    else:
+        for index in range(shard_count):
+            spec = dict(filter_spec or {}, shard=(index, shard_count))
+            shard_path = os.path.join(shard_dir, f"subreddit_{index:03d}_of_{shard_count:03d}.db")
+            jobs.append((shard_path, submission_files, comment_files, spec))
+    return jobs
+
+def import_database(db_path, submission_files, comment_files, args, filter_spec, metrics=None):
+    # Opens (or creates) one database and imports into it. Returns the row
+    # counts, or None for incremental imports: counting every row would
+    # cost more than importing one new month.
+    changes = None
+    if args.incremental:
+        changes = plan_incremental(db_path, submission_files, comment_files, filter_spec, args.settle_seconds)
+        submission_files = [c[1] for c in changes if c[5] and c[0] == 'submissions']
+        comment_files = [c[1] for c in changes if c[5] and c[0] == 'comments']
+        if not submission_files and not comment_files:
+            if changes:
+                conn = sqlite3.connect(db_path)
+                create_manifest_table(conn)
+                record_manifest(conn, changes, filter_spec)
+                conn.close()
+            print(f"{db_path}: no new or changed dump files")
+            return None
+
+    conn = open_database(db_path, args)
+    run_import(conn, submission_files, comment_files, args, filter_spec, metrics)
+    if changes is not None:
+        imported = record_manifest(conn, changes, filter_spec)
+        print(f"{db_path}: imported {imported} of {len(submission_files) + len(comment_files)} new or "
+              f"changed file(s)")
+        counts = None
+    else:
+        counts = table_counts(conn)
+    conn.close()
+    return counts
+
+def import_shard(job):
+    # Runs in its own process: every shard has exactly one writer
+    shard_path, submission_files, comment_files, filter_spec, args = job
+    metrics = metrics_from_args(args, suffix=os.path.splitext(os.path.basename(shard_path))[0])
+    return shard_path, import_database(shard_path, submission_files, comment_files, args, filter_spec, metrics)
+
+def plan_routed_files(jobs, args):
+    # For --shard-by subreddit: returns (tasks, shard_plans). tasks are the
+    # (kind, file_path, start, shard_starts) reads for _shard_reader, one
+    # per file that any shard still needs. shard_plans[i] is (fingerprints,
+    # changes) for shard i's writer, or None if an incremental run has
+    # nothing for it; changes is None unless the run is incremental.
+    shard_starts = {}
+    shard_plans = []
+    for index, (shard_path, subs, coms, spec) in enumerate(jobs):
+        files = [('submissions', f) for f in subs] + [('comments', f) for f in coms]
+        changes = None
+        if args.incremental:
+            changes = plan_incremental(shard_path, subs, coms, spec, args.settle_seconds)
+            files = [(c[0], c[1]) for c in changes if c[5]]
+            if not changes:
+                shard_plans.append(None)
+                continue
+
+        conn = None
+        if os.path.exists(shard_path) and not args.no_resume:
+            conn = sqlite3.connect(shard_path)
+            create_progress_table(conn)
+        fingerprints = {}
+        for kind, file_path in files:
+            if not file_in_time_range(file_path, spec):
+                continue
+            fingerprint = file_fingerprint(file_path, spec)
+            start = resume_point(conn, file_path, fingerprint) if conn is not None else (0, 0, 0, 0)
+            if start is None:
+                continue
+            fingerprints[file_path] = fingerprint
+            shard_starts.setdefault((kind, file_path), [None] * len(jobs))[index] = start
+        if conn is not None:
+            conn.close()
+        shard_plans.append((fingerprints, changes))
+
+    tasks = []
+    for (kind, file_path), starts in shard_starts.items():
+        # Read from the earliest checkpoint; shards that are further along
+        # skip the batches they already have
+        start = min((start for start in starts if start is not None), key=lambda start: start[0])
+        tasks.append((kind, file_path, start, starts))
+    return tasks, shard_plans
+
+def _shard_writer(shard_path, row_queue, readers, fingerprints, changes, filter_spec, args, sizer, budget,
+                  results):
+    # Runs in its own process: the only writer of one subreddit shard,
+    # taking the rows every reader routes to it
+    metrics = metrics_from_args(args, suffix=os.path.splitext(os.path.basename(shard_path))[0])
+    if metrics is not None:
+        metrics.workers = readers
+    conn = open_database(shard_path, args)
+    if args.bulk_load:
+        begin_bulk_load(conn, keep_indexes=args.incremental)
+    memory_plan_from_args(args, conn)
+    write_batches(conn, row_queue, readers, fingerprints, not args.bulk_load, metrics, args.conflict, sizer,
+                  budget)
+    finish_import(conn, args, metrics)
+    if changes is not None:
+        imported = record_manifest(conn, changes, filter_spec)
+        print(f"{shard_path}: imported {imported} of {len(fingerprints)} new or changed file(s)")
+        counts = None
+    else:
+        counts = table_counts(conn)
     conn.close()
+    results.put((shard_path, counts))
+
+def import_subreddit_shards(args, jobs, filter_spec):
+    # Every dump is decompressed and parsed once, by up to --workers reader
+    # processes, and each batch is split by subreddit hash across one writer
+    # process per shard. Returns [(shard_path, counts)].
+    tasks, shard_plans = plan_routed_files(jobs, args)
+    readers = max(min(args.workers, len(tasks)), 1)
+    writers = sum(plan is not None for plan in shard_plans)
+    # The ceiling is split between the writers' SQLite caches and the
+    # batches in flight between readers and writers
+    memory_limit = int(args.memory_mb * MB) if args.memory_mb else None
+    max_batch, budget_bytes, _ = plan_memory(memory_limit, readers)
+    memory_mb = args.memory_mb / (writers + 1) if args.memory_mb else None
+    shard_args = argparse.Namespace(**dict(vars(args), workers=1, memory_mb=memory_mb))
+    sizer = BatchSizer(int(args.batch_mb * MB), max_bytes=max_batch, commit_seconds=args.commit_seconds,
+                       shared=multiprocessing.Value('q', 0))
+    budget = ByteBudget(budget_bytes, multiprocessing) if budget_bytes else None
+    print(f"Importing {len(tasks)} file(s) into {writers} of {len(jobs)} shard(s) in {args.shard_dir} "
+          f"with {readers} reader(s)")
+
+    task_queue = multiprocessing.Queue()
+    for task in tasks:
+        task_queue.put(task)
+    for _ in range(readers):
+        task_queue.put(None)
+    queue_size = args.queue_size or readers * 2
+    shard_queues = [multiprocessing.Queue(maxsize=queue_size) if plan is not None else None
+                    for plan in shard_plans]
+    results = multiprocessing.Queue()
+
+    writer_processes = [
+        multiprocessing.Process(target=_shard_writer,
+                                args=(job[0], shard_queue, readers, plan[0], plan[1], job[3], shard_args,
+                                      sizer, budget, results))
+        for job, plan, shard_queue in zip(jobs, shard_plans, shard_queues) if plan is not None
+    ]
+    reader_processes = [
+        multiprocessing.Process(target=_shard_reader,
+                                args=(task_queue, shard_queues, filter_spec,
+                                      bool(args.metrics or args.metrics_jsonl or args.metrics_prom),
+                                      sizer.shared, budget))
+        for _ in range(readers)
+    ]
+    for process in writer_processes + reader_processes:
+        process.start()
+
+    collected = []
+    running = list(reader_processes)
+    while len(collected) < len(writer_processes):
+        try:
+            collected.append(results.get(timeout=WORKER_POLL_SECONDS))
+        except queue.Empty:
+            pass
+        for process in list(running):
+            if process.exitcode is None:
+                continue
+            running.remove(process)
+            if process.exitcode:
+                # Its file stays incomplete and resumes from the shards'
+                # checkpoints on the next run; stand in for its end-of-work
+                # marker so the writers still finish
+                print(f"A reader process exited with code {process.exitcode}; "
+                      f"the file it was reading resumes on the next run")
+                for shard_queue in shard_queues:
+                    if shard_queue is not None:
+                        shard_queue.put(None)
+        if not any(process.is_alive() for process in writer_processes) and results.empty():
+            break
+    for process in reader_processes + writer_processes:
+        process.join()
+
+    done = dict(collected)
+    results = []
+    for job, plan in zip(jobs, shard_plans):
+        if job[0] in done:
+            results.append((job[0], done[job[0]]))
+        elif plan is None:
+            print(f"{job[0]}: no new or changed dump files")
+    return results
+
+def import_sharded(args, submission_files, comment_files, filter_spec):
+    os.makedirs(args.shard_dir, exist_ok=True)
+    jobs = plan_shards(args.shard_by, args.shard_dir, submission_files, comment_files,
+                       args.shard_count, filter_spec)
+    if args.shard_by == 'subreddit':
+        results = import_subreddit_shards(args, jobs, filter_spec)
+    else:
+        # Parallelism is across shards; inside a shard the import is serial
+        processes = min(args.workers, len(jobs)) or 1
+        memory_mb = args.memory_mb / processes if args.memory_mb else None
+        shard_args = argparse.Namespace(**dict(vars(args), workers=1, memory_mb=memory_mb))
+        print(f"Importing {len(jobs)} shard(s) into {args.shard_dir} with {processes} process(es)")
+
+        with multiprocessing.Pool(processes) as pool:
+            results = pool.map(import_shard, [job + (shard_args,) for job in jobs], chunksize=1)
+
+    if args.shard_by == 'month':
+        # Comments late in a month often reply to the previous month's posts
+        print("Resolving orphan comments across shards")
+        link_index.resolve_shards(args.shard_dir)
+
+    print("IMPORT COMPLETE!")
+    if args.incremental:
+        return
+    total_submissions = sum(counts[0] for _, counts in results)
+    total_comments = sum(counts[1] for _, counts in results)
+    for shard_path, (sub_count, com_count) in results:
+        print(f"  {shard_path}: {sub_count:,} submissions, {com_count:,} comments")
+    print(f"Total submissions: {total_submissions:,}")
+    print(f"Total comments: {total_comments:,}")
+    print(f"Shards saved to: {args.shard_dir}")
+
+def import_once(args, filter_spec):
+    submission_files, comment_files = find_zst_files(args.zst_dir)
+
+    if args.shard_by:
+        import_sharded(args, submission_files, comment_files, filter_spec)
+        return
+
+    counts = import_database(args.db, submission_files, comment_files, args, filter_spec, metrics_from_args(args))
+    print("IMPORT COMPLETE!")
+    if counts is not None:
+        sub_count, com_count = counts
+        print(f"Total submissions: {sub_count:,}")
+        print(f"Total comments: {com_count:,}")
+    print(f"Database saved to: {args.db}")
+
+def main():
+    args = parse_args()
+    if args.watch:
+        args.incremental = True
+    filter_spec = filter_spec_from_args(args)
+    if filter_spec:
+        print(f"Import filters: {', '.join(sorted(filter_spec))}")
+    print(f"JSON backend: {JSON_BACKEND}")
+
+    while True:
+        import_once(args, filter_spec)
+        if not args.watch:
+            return
+        print(f"Watching {args.zst_dir} for new dumps, next scan in {args.watch:.0f}s (Ctrl-C to stop)")
+        try:
+            time.sleep(args.watch)
+        except KeyboardInterrupt:
+            return
 if __name__ == '__main__':
     main()
\ No newline at end of file
@@ -0,0 +1,391 @@
+import sqlite3
+import argparse
+import time
+from datetime import datetime, timezone
+from functools import lru_cache
+
+from dump_utils import parse_timestamp
+
+DB_PATH = "reddit_data.db"
+
+DAY = 86400
+
+# Pre-aggregated counts kept next to submissions/comments. Once the tables
+# exist the importer keeps them up to date batch by batch (see snapshot /
+# apply): every written row's old contribution is subtracted and its new one
+# added with merge upserts, so overlapping, re-scraped and resumed imports
+# leave them exact. Each entry: (table, key columns, value columns).
+ROLLUP_TABLES = {
+    'subreddit_day': ('rollup_subreddit_day', ['subreddit', 'day'],
+                      ['submissions', 'comments', 'submission_score', 'comment_score']),
+    # One row per author active in a subreddit on a day, so distinct authors
+    # stay countable when rows are updated or replaced
+    'subreddit_day_authors': ('rollup_subreddit_day_authors', ['subreddit', 'day', 'author'], ['rows']),
+    'author_month': ('rollup_author_month', ['author', 'month'], ['submissions', 'comments', 'score']),
+    'submission_comments': ('rollup_submission_comments', ['link_id'], ['comments', 'score']),
+}
+
+COLUMN_TYPES = {
+    'subreddit': 'TEXT', 'author': 'TEXT', 'month': 'TEXT', 'link_id': 'TEXT',
+}
+
+# Columns read from a stored row to work out what it contributes
+SNAPSHOT_COLUMNS = {
+    'submissions': ['id', 'subreddit', 'author', 'created_utc', 'score'],
+    'comments': ['id', 'subreddit', 'author', 'created_utc', 'score', 'link_id'],
+}
+
+# Both tables as one row source for the aggregate queries; {where} is
+# applied to each side
+SOURCE_SQL = '''
+SELECT subreddit, author, CAST(created_utc AS INTEGER) AS created, COALESCE(score, 0) AS score,
+       1 AS is_submission FROM submissions {where}
+UNION ALL
+SELECT subreddit, author, CAST(created_utc AS INTEGER) AS created, COALESCE(score, 0) AS score,
+       0 AS is_submission FROM comments {where}
+'''
+
+NAMED_AUTHOR = "author IS NOT NULL AND author != '[deleted]'"
+
+AGGREGATE_SQL = {
+    'subreddit_day': f'''
+    SELECT subreddit, created / {DAY} * {DAY} AS day, SUM(is_submission), SUM(1 - is_submission),
+           SUM(is_submission * score), SUM((1 - is_submission) * score)
+    FROM ({SOURCE_SQL}) WHERE subreddit IS NOT NULL AND created IS NOT NULL
+    GROUP BY subreddit, day
+    ''',
+    'subreddit_day_authors': f'''
+    SELECT subreddit, created / {DAY} * {DAY} AS day, author, COUNT(*)
+    FROM ({SOURCE_SQL}) WHERE subreddit IS NOT NULL AND created IS NOT NULL AND {NAMED_AUTHOR}
+    GROUP BY subreddit, day, author
+    ''',
+    'author_month': f'''
+    SELECT author, strftime('%Y-%m', created, 'unixepoch') AS month, SUM(is_submission),
+           SUM(1 - is_submission), SUM(score)
+    FROM ({SOURCE_SQL}) WHERE created IS NOT NULL AND {NAMED_AUTHOR}
+    GROUP BY author, month
+    ''',
+    'submission_comments': '''
+    SELECT link_id, COUNT(*), SUM(COALESCE(score, 0)) FROM comments {where}
+    GROUP BY link_id
+    ''',
+}
+
+
+def enabled(conn):
+    cursor = conn.cursor()
+    cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?",
+                   (ROLLUP_TABLES['subreddit_day'][0],))
+    return cursor.fetchone() is not None
+
+
+def create_rollups(conn, rebuild=False):
+    """Create the rollup tables and fill them from the rows already imported."""
+    if enabled(conn) and not rebuild:
+        return
+    cursor = conn.cursor()
+    start = time.perf_counter()
+
+    for name, (table, keys, values) in ROLLUP_TABLES.items():
+        columns = [f'{col} {COLUMN_TYPES.get(col, "INTEGER")}' for col in keys + values]
+        cursor.execute(f'''
+        CREATE TABLE IF NOT EXISTS {table} (
+            {', '.join(columns)},
+            PRIMARY KEY ({', '.join(keys)})
+        ) WITHOUT ROWID
+        ''')
+        cursor.execute(f'DELETE FROM {table}')
+        if name == 'submission_comments':
+            sql = AGGREGATE_SQL[name].format(where="WHERE link_id IS NOT NULL AND link_id != ''")
+        else:
+            sql = AGGREGATE_SQL[name].format(where='')
+        cursor.execute(f'INSERT INTO {table} {sql}')
+    conn.commit()
+    print(f"Built rollup tables in {time.perf_counter() - start:.1f}s")
+
+
+def _int(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+@lru_cache(maxsize=4096)
+def _month_of_day(day):
+    return datetime.fromtimestamp(day, timezone.utc).strftime('%Y-%m')
+
+
+def snapshot(cursor, kind, rows, chunk=500):
+    """The stored state of the rows with the same ids as rows, as far as the
+    rollups are concerned. Taken before and after a batch is written."""
+    ids = list(dict.fromkeys(row[0] for row in rows))
+    columns = ', '.join(SNAPSHOT_COLUMNS[kind])
+    stored = []
+    for i in range(0, len(ids), chunk):
+        part = ids[i:i + chunk]
+        cursor.execute(f"SELECT {columns} FROM main.{kind} WHERE id IN ({', '.join('?' for _ in part)})", part)
+        stored.extend(cursor.fetchall())
+    return stored
+
+
+def _add(totals, key, values):
+    current = totals.get(key)
+    totals[key] = values if current is None else tuple(a + b for a, b in zip(current, values))
+
+
+def _accumulate(deltas, kind, rows, sign):
+    submission = kind == 'submissions'
+    for row in rows:
+        subreddit, author, created = row[1], row[2], _int(row[3])
+        score = sign * (_int(row[4]) or 0)
+        named = author is not None and author != '[deleted]'
+
+        if created is not None:
+            day = created // DAY * DAY
+            if subreddit is not None:
+                counts = (sign, 0, score, 0) if submission else (0, sign, 0, score)
+                _add(deltas['subreddit_day'], (subreddit, day), counts)
+                if named:
+                    _add(deltas['subreddit_day_authors'], (subreddit, day, author), (sign,))
+            if named:
+                counts = (sign, 0, score) if submission else (0, sign, score)
+                _add(deltas['author_month'], (author, _month_of_day(day)), counts)
+        if not submission and row[5]:
+            _add(deltas['submission_comments'], (row[5],), (sign, score))
+
+
+def apply(cursor, kind, before, after):
+    """Move the rollups from the before snapshot to the after snapshot.
+
+    Deltas are summed in memory first, so a batch touches each rollup key
+    once, and written with merge upserts. Keys that drop to zero are
+    deleted so that distinct-author counts stay correct.
+    """
+    deltas = {name: {} for name in ROLLUP_TABLES}
+    _accumulate(deltas, kind, before, -1)
+    _accumulate(deltas, kind, after, 1)
+
+    for name, (table, keys, values) in ROLLUP_TABLES.items():
+        changes = [(key, delta) for key, delta in deltas[name].items() if any(delta)]
+        if not changes:
+            continue
+        assignments = ', '.join(f'{col} = {col} + excluded.{col}' for col in values)
+        placeholders = ', '.join('?' for _ in keys + values)
+        cursor.executemany(f'''
+        INSERT INTO {table} VALUES ({placeholders})
+        ON CONFLICT({', '.join(keys)}) DO UPDATE SET {assignments}
+        ''', [key + delta for key, delta in sorted(changes)])
+
+        shrunk = [key for key, delta in changes if any(v < 0 for v in delta)]
+        if shrunk:
+            conditions = ' AND '.join([f'{col} = ?' for col in keys] + [f'{col} = 0' for col in values])
+            cursor.executemany(f'DELETE FROM {table} WHERE {conditions}', shrunk)
+
+
+def _day_floor(ts):
+    return ts // DAY * DAY
+
+
+def _day_ceil(ts):
+    return -(-ts // DAY) * DAY
+
+
+def _month_floor(ts):
+    moment = datetime.fromtimestamp(ts, timezone.utc)
+    return int(datetime(moment.year, moment.month, 1, tzinfo=timezone.utc).timestamp())
+
+
+def _month_ceil(ts):
+    start = _month_floor(ts)
+    if start == ts:
+        return ts
+    moment = datetime.fromtimestamp(start, timezone.utc)
+    return int(datetime(moment.year + moment.month // 12, moment.month % 12 + 1, 1,
+                        tzinfo=timezone.utc).timestamp())
+
+
+def _split_range(after, before, floor, ceil):
+    # [after, before) as the whole buckets the rollups can answer plus the
+    # partial buckets at either end, which need a raw scan. Returns
+    # ((start, end) or None, raw ranges); None bounds are open.
+    start = None if after is None else ceil(after)
+    end = None if before is None else floor(before)
+    if start is not None and end is not None and start >= end:
+        return None, [(after, before)]
+    raw = []
+    if after is not None and after < start:
+        raw.append((after, start))
+    if before is not None and end < before:
+        raw.append((end, before))
+    return (start, end), raw
+
+
+def _where(conditions):
+    return f"WHERE {' AND '.join(conditions)}" if conditions else ''
+
+
+def _time_conditions(after, before, column='created_utc'):
+    conditions, params = [], []
+    if after is not None:
+        conditions.append(f'{column} >= ?')
+        params.append(after)
+    if before is not None:
+        conditions.append(f'{column} < ?')
+        params.append(before)
+    return conditions, params
+
+
+def _in(column, values):
+    return f"{column} IN ({', '.join('?' for _ in values)})"
+
+
+def _scan_subreddit_daily(cursor, subreddits, after, before):
+    conditions, params = _time_conditions(after, before)
+    if subreddits:
+        conditions.append(_in('subreddit', subreddits))
+        params.extend(subreddits)
+    source = SOURCE_SQL.format(where=_where(conditions))
+    cursor.execute(f'''
+    SELECT subreddit, created / {DAY} * {DAY} AS day, SUM(is_submission), SUM(1 - is_submission),
+           SUM(is_submission * score), SUM((1 - is_submission) * score),
+           COUNT(DISTINCT CASE WHEN {NAMED_AUTHOR} THEN author END)
+    FROM ({source}) WHERE subreddit IS NOT NULL AND created IS NOT NULL
+    GROUP BY subreddit, day
+    ''', params + params)
+    return cursor.fetchall()
+
+
+def subreddit_daily(conn, subreddits=None, after=None, before=None):
+    """Activity per subreddit and UTC day: (subreddit, day, submissions,
+    comments, submission_score, comment_score, authors), where day is the
+    unix time the day starts and authors counts distinct named authors.
+
+    Whole days come from the rollups. Days cut by after/before, or every
+    day if the rollups were never built, are scanned from the raw tables.
+    """
+    cursor = conn.cursor()
+    if not enabled(conn):
+        return sorted(_scan_subreddit_daily(cursor, subreddits, after, before))
+
+    covered, raw = _split_range(after, before, _day_floor, _day_ceil)
+    results = []
+    for start, end in raw:
+        results.extend(_scan_subreddit_daily(cursor, subreddits, start, end))
+    if covered is not None:
+        conditions, params = _time_conditions(*covered, column='d.day')
+        if subreddits:
+            conditions.append(_in('d.subreddit', subreddits))
+            params.extend(subreddits)
+        cursor.execute(f'''
+        SELECT d.subreddit, d.day, d.submissions, d.comments, d.submission_score, d.comment_score,
+               (SELECT COUNT(*) FROM rollup_subreddit_day_authors a
+                WHERE a.subreddit = d.subreddit AND a.day = d.day)
+        FROM rollup_subreddit_day d {_where(conditions)}
+        ''', params)
+        results.extend(cursor.fetchall())
+    return sorted(results)
+
+
+def _scan_author_monthly(cursor, authors, after, before):
+    conditions, params = _time_conditions(after, before)
+    if authors:
+        conditions.append(_in('author', authors))
+        params.extend(authors)
+    source = SOURCE_SQL.format(where=_where(conditions))
+    cursor.execute(f'''
+    SELECT author, strftime('%Y-%m', created, 'unixepoch') AS month, SUM(is_submission),
+           SUM(1 - is_submission), SUM(score)
+    FROM ({source}) WHERE created IS NOT NULL AND {NAMED_AUTHOR}
+    GROUP BY author, month
+    ''', params + params)
+    return cursor.fetchall()
+
+
+def author_monthly(conn, authors=None, after=None, before=None):
+    """Activity per author and UTC month: (author, 'YYYY-MM', submissions,
+    comments, score). Partial months at either end are scanned raw."""
+    cursor = conn.cursor()
+    if not enabled(conn):
+        return sorted(_scan_author_monthly(cursor, authors, after, before))
+
+    covered, raw = _split_range(after, before, _month_floor, _month_ceil)
+    results = []
+    for start, end in raw:
+        results.extend(_scan_author_monthly(cursor, authors, start, end))
+    if covered is not None:
+        conditions, params = [], []
+        start, end = covered
+        if start is not None:
+            conditions.append('month >= ?')
+            params.append(_month_of_day(start))
+        if end is not None:
+            conditions.append('month < ?')
+            params.append(_month_of_day(end))
+        if authors:
+            conditions.append(_in('author', authors))
+            params.extend(authors)
+        cursor.execute(f'''
+        SELECT author, month, submissions, comments, score FROM rollup_author_month {_where(conditions)}
+        ''', params)
+        results.extend(cursor.fetchall())
+    return sorted(results)
+
+
+def submission_comment_counts(conn, link_ids, chunk=500):
+    """{link_id: (comments, score_sum)} for the given submissions, counting
+    the comments imported for each. Submissions without comments get (0, 0)."""
+    link_ids = [link_id[3:] if link_id.startswith('t3_') else link_id for link_id in link_ids]
+    if enabled(conn):
+        sql = 'SELECT link_id, comments, score FROM rollup_submission_comments WHERE {}'
+    else:
+        sql = 'SELECT link_id, COUNT(*), SUM(COALESCE(score, 0)) FROM comments WHERE {} GROUP BY link_id'
+
+    counts = {link_id: (0, 0) for link_id in link_ids}
+    cursor = conn.cursor()
+    for i in range(0, len(link_ids), chunk):
+        part = link_ids[i:i + chunk]
+        cursor.execute(sql.format(_in('link_id', part)), part)
+        for link_id, comments, score in cursor.fetchall():
+            counts[link_id] = (comments, score)
+    return counts
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Build or query the pre-aggregated rollup tables")
+    parser.add_argument("--db", default=DB_PATH, help="SQLite database path")
+    parser.add_argument("--build", action="store_true", help="Create the rollups from the imported rows")
+    parser.add_argument("--rebuild", action="store_true", help="Recompute existing rollups from scratch")
+    parser.add_argument("--subreddits", nargs="*", default=None, help="Print daily stats for these subreddits")
+    parser.add_argument("--authors", nargs="*", default=None, help="Print monthly stats for these authors")
+    parser.add_argument("--links", nargs="*", default=None, help="Print comment counts for these submissions")
+    parser.add_argument("--after", default=None, help="Unix time or YYYY-MM-DD")
+    parser.add_argument("--before", default=None, help="Unix time or YYYY-MM-DD")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    conn = sqlite3.connect(args.db)
+    after, before = parse_timestamp(args.after), parse_timestamp(args.before)
+
+    if args.build or args.rebuild:
+        create_rollups(conn, rebuild=args.rebuild)
+    if args.subreddits is not None:
+        for subreddit, day, subs, coms, sub_score, com_score, authors in subreddit_daily(
+                conn, args.subreddits, after, before):
+            date = datetime.fromtimestamp(day, timezone.utc).strftime('%Y-%m-%d')
+            print(f"r/{subreddit}  {date}  {subs} submissions ({sub_score} points)  "
+                  f"{coms} comments ({com_score} points)  {authors} authors")
+    if args.authors is not None:
+        for author, month, subs, coms, score in author_monthly(conn, args.authors, after, before):
+            print(f"{author}  {month}  {subs} submissions  {coms} comments  {score} points")
+    if args.links:
+        for link_id, (comments, score) in submission_comment_counts(conn, args.links).items():
+            print(f"{link_id}  {comments} comments  {score} points")
+
+    conn.close()
+
+
+if __name__ == "__main__":
+    main()
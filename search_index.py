@@ -0,0 +1,192 @@
+import sqlite3
+import argparse
+import time
+
+from dump_utils import parse_timestamp
+
+DB_PATH = "reddit_data.db"
+
+# Contentless FTS5 tables: the text lives only in submissions/comments.
+# Their implicit rowids are not stable (VACUUM can renumber a table with a
+# TEXT primary key), so the index is keyed by a docid from a mapping table
+# whose INTEGER PRIMARY KEY never changes. Once a table exists the importer
+# keeps it up to date batch by batch (see index_rows / unindex_rows).
+FTS_TABLES = {
+    'submissions': ('submissions_fts', ['title', 'selftext']),
+    'comments': ('comments_fts', ['body']),
+}
+
+# FTS docid <-> row id
+DOC_TABLES = {
+    'submissions': 'submissions_fts_docs',
+    'comments': 'comments_fts_docs',
+}
+
+TOKENIZER = 'porter unicode61 remove_diacritics 2'
+
+# bm25 column weights: a hit in a title counts twice as much as one in selftext
+BM25_WEIGHTS = {
+    'submissions': (2.0, 1.0),
+    'comments': (1.0,),
+}
+
+
+def enabled_kinds(conn):
+    cursor = conn.cursor()
+    cursor.execute(
+        "SELECT name FROM sqlite_master WHERE type = 'table' AND name IN (?, ?)",
+        (FTS_TABLES['submissions'][0], FTS_TABLES['comments'][0])
+    )
+    names = {row[0] for row in cursor.fetchall()}
+    return {kind for kind, (fts, _) in FTS_TABLES.items() if fts in names}
+
+
+def _legacy_kinds(conn):
+    # Indexes from before the docid mapping, keyed on the tables' rowids
+    cursor = conn.cursor()
+    cursor.execute("SELECT name FROM sqlite_master WHERE type = 'table'")
+    names = {row[0] for row in cursor.fetchall()}
+    return {kind for kind in enabled_kinds(conn) if DOC_TABLES[kind] not in names}
+
+
+def create_search_index(conn, kinds=('submissions', 'comments')):
+    """Create the FTS5 tables and index whatever is already in the database.
+    An index from before the docid mapping is dropped and rebuilt."""
+    cursor = conn.cursor()
+    legacy = _legacy_kinds(conn)
+    existing = enabled_kinds(conn) - legacy
+
+    for kind in kinds:
+        fts, columns = FTS_TABLES[kind]
+        docs = DOC_TABLES[kind]
+        if kind in existing:
+            continue
+        if kind in legacy:
+            print(f"Rebuilding the {kind} search index with stable document ids")
+            cursor.execute(f'DROP TABLE {fts}')
+        cursor.execute(f'''
+        CREATE VIRTUAL TABLE {fts} USING fts5(
+            {', '.join(columns)},
+            content='',
+            tokenize='{TOKENIZER}'
+        )
+        ''')
+        cursor.execute(f'CREATE TABLE IF NOT EXISTS {docs} (docid INTEGER PRIMARY KEY, id TEXT NOT NULL UNIQUE)')
+        start = time.perf_counter()
+        cursor.execute(f'INSERT OR IGNORE INTO {docs} (id) SELECT id FROM {kind}')
+        cursor.execute(f'''
+        INSERT INTO {fts}(rowid, {', '.join(columns)})
+        SELECT d.docid, {', '.join(f't.{col}' for col in columns)}
+        FROM {docs} d JOIN {kind} t ON t.id = d.id
+        ORDER BY d.docid
+        ''')
+        conn.commit()
+        print(f"Indexed existing {kind} in {time.perf_counter() - start:.1f}s")
+
+
+def unindex_rows(cursor, kind, rows):
+    # Must run before INSERT OR REPLACE: a contentless index can only drop a
+    # document given the exact text it was indexed with.
+    fts, columns = FTS_TABLES[kind]
+    cursor.executemany(f'''
+    INSERT INTO {fts}({fts}, rowid, {', '.join(columns)})
+    SELECT 'delete', d.docid, {', '.join(f't.{col}' for col in columns)}
+    FROM {kind} t JOIN {DOC_TABLES[kind]} d ON d.id = t.id
+    WHERE t.id = ?
+    ''', [(row[0],) for row in rows])
+
+
+def index_rows(cursor, kind, rows):
+    fts, columns = FTS_TABLES[kind]
+    ids = [(row[0],) for row in rows]
+    cursor.executemany(f'INSERT OR IGNORE INTO {DOC_TABLES[kind]} (id) VALUES (?)', ids)
+    cursor.executemany(f'''
+    INSERT INTO {fts}(rowid, {', '.join(columns)})
+    SELECT d.docid, {', '.join(f't.{col}' for col in columns)}
+    FROM {kind} t JOIN {DOC_TABLES[kind]} d ON d.id = t.id
+    WHERE t.id = ?
+    ''', ids)
+
+
+def optimize(conn, kinds=('submissions', 'comments')):
+    # Merges the b-tree segments left by many small batch inserts
+    for kind in enabled_kinds(conn) & set(kinds):
+        fts, _ = FTS_TABLES[kind]
+        conn.execute(f"INSERT INTO {fts}({fts}) VALUES ('optimize')")
+    conn.commit()
+
+
+def search(conn, query, kind='submissions', subreddits=None, after=None, before=None, limit=50):
+    """Full-text search ranked by BM25 (best first).
+
+    query uses FTS5 syntax ("exact phrase", OR, NEAR, prefix*). Returns
+    (id, subreddit, author, created_utc, score, text, rank) rows, where text
+    is the title for submissions and the body for comments.
+    """
+    fts, _ = FTS_TABLES[kind]
+    weights = ', '.join(str(w) for w in BM25_WEIGHTS[kind])
+    text_column = 'title' if kind == 'submissions' else 'body'
+
+    conditions = [f'{fts} MATCH ?']
+    params = [query]
+    if subreddits:
+        conditions.append(f"t.subreddit IN ({', '.join('?' for _ in subreddits)})")
+        params.extend(subreddits)
+    if after is not None:
+        conditions.append('t.created_utc >= ?')
+        params.append(after)
+    if before is not None:
+        conditions.append('t.created_utc < ?')
+        params.append(before)
+    params.append(limit)
+
+    cursor = conn.cursor()
+    cursor.execute(f'''
+    SELECT t.id, t.subreddit, t.author, t.created_utc, t.score, t.{text_column},
+           bm25({fts}, {weights}) AS rank
+    FROM {fts}
+    JOIN {DOC_TABLES[kind]} d ON d.docid = {fts}.rowid
+    JOIN {kind} t ON t.id = d.id
+    WHERE {' AND '.join(conditions)}
+    ORDER BY rank
+    LIMIT ?
+    ''', params)
+    return cursor.fetchall()
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Build or query the full-text search index")
+    parser.add_argument("query", nargs="?", help="FTS5 query; omit with --build")
+    parser.add_argument("--db", default=DB_PATH, help="SQLite database path")
+    parser.add_argument("--build", action="store_true", help="Create the index and index existing rows")
+    parser.add_argument("--optimize", action="store_true", help="Merge index segments after a large import")
+    parser.add_argument("--kind", choices=['submissions', 'comments'], default='submissions')
+    parser.add_argument("--subreddits", nargs="*", default=None)
+    parser.add_argument("--after", default=None, help="Unix time or YYYY-MM-DD")
+    parser.add_argument("--before", default=None, help="Unix time or YYYY-MM-DD")
+    parser.add_argument("--limit", type=int, default=20)
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    conn = sqlite3.connect(args.db)
+
+    if args.build:
+        create_search_index(conn)
+    if args.optimize:
+        optimize(conn)
+    if args.query:
+        start = time.perf_counter()
+        results = search(conn, args.query, args.kind, args.subreddits,
+                         parse_timestamp(args.after), parse_timestamp(args.before), args.limit)
+        for row_id, subreddit, author, created_utc, score, text, rank in results:
+            text = (text or "").replace("\n", " ")[:100]
+            print(f"{rank:8.2f}  r/{subreddit}  {row_id}  [{score}] {author}: {text}")
+        print(f"{len(results)} result(s) in {(time.perf_counter() - start) * 1000:.1f} ms")
+
+    conn.close()
+
+
+if __name__ == "__main__":
+    main()
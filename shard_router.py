@@ -0,0 +1,152 @@
+import sqlite3
+import argparse
+import glob
+import heapq
+import os
+import re
+from datetime import datetime, timezone
+
+from dump_utils import parse_timestamp
+from reddit_import_script import shard_for_subreddit
+
+# SQLite's default compile-time limit on attached databases
+MAX_ATTACHED = 10
+
+MONTH_SHARD_RE = re.compile(r'month_(\d{4})-(\d{2})\.db$')
+SUBREDDIT_SHARD_RE = re.compile(r'subreddit_(\d+)_of_(\d+)\.db$')
+
+
+class ShardRouter:
+    """Fans queries out over the shard databases written by
+    reddit_import_script.py --shard-by.
+
+    SQL is written against {submissions} / {comments} placeholders. Shards
+    that cannot match the time range or subreddits are pruned by file name.
+    The rest are ATTACHed to an in-memory connection in groups of up to
+    MAX_ATTACHED, and each placeholder becomes a UNION ALL over the group.
+    """
+
+    def __init__(self, shard_dir):
+        self.shard_dir = shard_dir
+        self.shards = sorted(glob.glob(os.path.join(shard_dir, '*.db')))
+
+    def select_shards(self, after=None, before=None, subreddits=None):
+        selected = []
+        wanted_buckets = {}
+
+        for shard_path in self.shards:
+            name = os.path.basename(shard_path)
+            month = MONTH_SHARD_RE.search(name)
+            bucket = SUBREDDIT_SHARD_RE.search(name)
+
+            if month and (after is not None or before is not None):
+                year, mon = int(month.group(1)), int(month.group(2))
+                start = datetime(year, mon, 1, tzinfo=timezone.utc).timestamp()
+                end = datetime(year + mon // 12, mon % 12 + 1, 1, tzinfo=timezone.utc).timestamp()
+                if after is not None and end <= after:
+                    continue
+                if before is not None and start >= before:
+                    continue
+
+            if bucket and subreddits:
+                index, count = int(bucket.group(1)), int(bucket.group(2))
+                if count not in wanted_buckets:
+                    wanted_buckets[count] = {shard_for_subreddit(s, count) for s in subreddits}
+                if index not in wanted_buckets[count]:
+                    continue
+
+            selected.append(shard_path)
+        return selected
+
+    def _run_group(self, group, sql, params):
+        conn = sqlite3.connect('file::memory:', uri=True)
+        try:
+            aliases = []
+            for i, shard_path in enumerate(group):
+                alias = f's{i}'
+                conn.execute(f"ATTACH DATABASE ? AS {alias}", (f"file:{shard_path}?mode=ro",))
+                aliases.append(alias)
+
+            tables = {
+                table: '(' + ' UNION ALL '.join(f'SELECT * FROM {alias}.{table}' for alias in aliases) + ')'
+                for table in ('submissions', 'comments')
+            }
+            return conn.execute(sql.format(**tables), params).fetchall()
+        finally:
+            conn.close()
+
+    def query(self, sql, params=(), after=None, before=None, subreddits=None,
+              order_by=None, reverse=False, limit=None):
+        """Run sql on every relevant shard group and merge the rows.
+
+        If order_by (a column index) is given, each group's query must
+        already sort by that column; groups are merge-sorted and cut at limit.
+        Otherwise the rows are concatenated.
+        """
+        shards = self.select_shards(after, before, subreddits)
+        groups = [shards[i:i + MAX_ATTACHED] for i in range(0, len(shards), MAX_ATTACHED)]
+        results = [self._run_group(group, sql, params) for group in groups]
+
+        if order_by is not None:
+            merged = heapq.merge(*results, key=lambda row: row[order_by], reverse=reverse)
+        else:
+            merged = (row for rows in results for row in rows)
+
+        if limit is not None:
+            return [row for _, row in zip(range(limit), merged)]
+        return list(merged)
+
+    def query_grouped(self, sql, params=(), key_columns=1, after=None, before=None, subreddits=None):
+        """Merge GROUP BY results from several shard groups: rows with the
+        same leading key_columns are combined by summing the remaining
+        columns. That is right for COUNT and SUM; MIN/MAX/AVG columns have to
+        be re-aggregated by the caller from query()."""
+        totals = {}
+        for row in self.query(sql, params, after, before, subreddits):
+            key, values = row[:key_columns], row[key_columns:]
+            if key in totals:
+                totals[key] = [a + (b or 0) for a, b in zip(totals[key], values)]
+            else:
+                totals[key] = [v or 0 for v in values]
+        return [key + tuple(values) for key, values in totals.items()]
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Count rows per subreddit across shard databases")
+    parser.add_argument("--shard-dir", default="shards")
+    parser.add_argument("--table", choices=['submissions', 'comments'], default='comments')
+    parser.add_argument("--subreddits", nargs="*", default=None)
+    parser.add_argument("--after", type=parse_timestamp, default=None, help="Unix time or YYYY-MM-DD")
+    parser.add_argument("--before", type=parse_timestamp, default=None, help="Unix time or YYYY-MM-DD")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    router = ShardRouter(args.shard_dir)
+    after, before = args.after, args.before
+
+    conditions = ['1 = 1']
+    params = []
+    if args.subreddits:
+        conditions.append(f"subreddit IN ({', '.join('?' for _ in args.subreddits)})")
+        params.extend(args.subreddits)
+    if after is not None:
+        conditions.append('created_utc >= ?')
+        params.append(after)
+    if before is not None:
+        conditions.append('created_utc < ?')
+        params.append(before)
+
+    shards = router.select_shards(after, before, args.subreddits)
+    print(f"Querying {len(shards)} of {len(router.shards)} shard(s)")
+    rows = router.query_grouped(
+        f"SELECT subreddit, COUNT(*) FROM {{{args.table}}} WHERE {' AND '.join(conditions)} GROUP BY subreddit",
+        params, after=after, before=before, subreddits=args.subreddits
+    )
+    for subreddit, count in sorted(rows, key=lambda row: -row[1]):
+        print(f"{count:>12,}  r/{subreddit}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,169 @@
+import asyncio
+import json
+import os
+import re
+import sys
+import tempfile
+import threading
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import codebook_generator
+
+PARTIAL_CODEBOOK = "### Code Family: Effects\n- **Code Name:** Lasting Anxiety"
+MERGED_CODEBOOK = "### Code Family: Effects\n- **Code Name:** Lasting Anxiety (merged)"
+SUMMARY = "### 2. Thematic Interpretation\nStub interpretation."
+
+
+class StubServer(ThreadingHTTPServer):
+    """A local OpenAI-compatible chat completions endpoint. It answers each
+    pipeline step from the system prompt, and returns 429 for the first
+    fail_first requests."""
+
+    def __init__(self, fail_first=0):
+        super().__init__(('127.0.0.1', 0), StubHandler)
+        self.fail_first = fail_first
+        self.lock = threading.Lock()
+        self.requests = []
+        self.failures = 0
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.server_address[1]}/v1"
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+    def _reply(self, status, payload):
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        request = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+        system, user = (message['content'] for message in request['messages'])
+        server = self.server
+        with server.lock:
+            if server.failures < server.fail_first:
+                server.failures += 1
+                self._reply(429, {'error': {'message': 'rate limited', 'type': 'rate_limit'}})
+                return
+            server.requests.append((system, user))
+
+        if 'several partial **Codebooks**' in system:
+            content = MERGED_CODEBOOK
+        elif 'develop a **Codebook**' in system:
+            content = PARTIAL_CODEBOOK
+        elif 'qualitative data coder' in system:
+            urls = re.findall(r'Post URL: (\S+)', user.split('POSTS CONTENT:', 1)[1])
+            content = "\n".join(f"Post URL: {url}\nCode applied: Lasting Anxiety\nReason: stub" for url in urls)
+        else:
+            content = SUMMARY
+
+        self._reply(200, {
+            'id': 'chatcmpl-stub',
+            'object': 'chat.completion',
+            'created': 0,
+            'model': request['model'],
+            'choices': [{'index': 0, 'finish_reason': 'stop',
+                         'message': {'role': 'assistant', 'content': content}}],
+        })
+
+
+def steps(requests):
+    counts = {'codebook': 0, 'merge': 0, 'classification': 0, 'summary': 0}
+    for system, _ in requests:
+        if 'several partial **Codebooks**' in system:
+            counts['merge'] += 1
+        elif 'develop a **Codebook**' in system:
+            counts['codebook'] += 1
+        elif 'qualitative data coder' in system:
+            counts['classification'] += 1
+        else:
+            counts['summary'] += 1
+    return counts
+
+
+class MapReduceTest(unittest.TestCase):
+    POSTS = 12
+
+    def setUp(self):
+        self.cache_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.cache_dir.cleanup)
+        self.original = (codebook_generator.OPENROUTER_URL, codebook_generator.OPENROUTER_API_KEY,
+                         codebook_generator.BACKOFF_SEC)
+        codebook_generator.OPENROUTER_API_KEY = 'stub-key'
+        codebook_generator.BACKOFF_SEC = 0.01
+        self.posts = "\n\n".join(f"Post URL: https://reddit.com/p{i}\nI was bullied in grade {i}. " + "word " * 40
+                                 for i in range(self.POSTS))
+
+    def tearDown(self):
+        (codebook_generator.OPENROUTER_URL, codebook_generator.OPENROUTER_API_KEY,
+         codebook_generator.BACKOFF_SEC) = self.original
+
+    def start_server(self, fail_first=0):
+        server = StubServer(fail_first)
+        thread = threading.Thread(target=server.serve_forever, daemon=True)
+        thread.start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        codebook_generator.OPENROUTER_URL = server.url
+        return server
+
+    def run_pipeline(self, retries=codebook_generator.MAX_RETRIES):
+        # Small chunks, so there are several partial codebooks to merge
+        return asyncio.run(codebook_generator.run_map_reduce(
+            self.posts, model='stub-model', chunk_tokens=200, concurrency=3, retries=retries,
+            cache_dir=self.cache_dir.name))
+
+    def test_map_reduce_output(self):
+        server = self.start_server()
+        codebook, report, summary = self.run_pipeline()
+
+        counts = steps(server.requests)
+        self.assertGreater(counts['codebook'], 1)
+        self.assertEqual(counts['classification'], counts['codebook'])
+        self.assertGreaterEqual(counts['merge'], 1)
+        self.assertEqual(counts['summary'], 1)
+
+        self.assertEqual(codebook, MERGED_CODEBOOK)
+        for i in range(self.POSTS):
+            self.assertIn(f"Post URL: https://reddit.com/p{i}\n", report + "\n")
+        self.assertIn(f"**Total Posts Analyzed:** {self.POSTS}", summary)
+        self.assertIn(f"**Total Posts Classified:** {self.POSTS}", summary)
+        self.assertIn(f"Lasting Anxiety: {self.POSTS}", summary)
+        self.assertTrue(summary.endswith(SUMMARY))
+
+    def test_rerun_is_served_from_cache(self):
+        server = self.start_server()
+        first = self.run_pipeline()
+        calls = len(server.requests)
+
+        second = self.run_pipeline()
+        self.assertEqual(second, first)
+        self.assertEqual(len(server.requests), calls)
+        self.assertEqual(len(os.listdir(self.cache_dir.name)), calls)
+
+    def test_rate_limits_are_retried(self):
+        server = self.start_server(fail_first=4)
+        codebook, report, _ = self.run_pipeline()
+        self.assertEqual(server.failures, 4)
+        self.assertEqual(codebook, MERGED_CODEBOOK)
+        self.assertEqual(report.count("Post URL:"), self.POSTS)
+
+    def test_failed_chunks_are_reported_after_retries(self):
+        self.start_server(fail_first=1000)
+        with self.assertRaises(RuntimeError):
+            self.run_pipeline(retries=1)
+        self.assertEqual(os.listdir(self.cache_dir.name), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,202 @@
+import json
+import os
+import sqlite3
+import sys
+import threading
+import time
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import fetch_users
+
+ABOUT = {
+    'alice': {'id': 't2_alice', 'name': 'alice', 'created_utc': 1500000000, 'comment_karma': 12,
+              'link_karma': 3, 'is_mod': False, 'subreddit': {'display_name': 'u_alice',
+                                                              'public_description': 'hi'}},
+    'banned': {'name': 'banned', 'is_suspended': True},
+}
+
+
+class StubServer(ThreadingHTTPServer):
+    """A local stand-in for Reddit's token endpoint and /user/{name}/about.
+
+    responses maps a username to the (status, headers, body) replies to
+    give, in order, the last one repeating; users without an entry get 200
+    with their ABOUT data, or 404. Tokens issued before revoke() are
+    answered with 401.
+    """
+
+    def __init__(self, responses=None):
+        super().__init__(('127.0.0.1', 0), StubHandler)
+        self.responses = {name: list(replies) for name, replies in (responses or {}).items()}
+        self.lock = threading.Lock()
+        self.tokens = 0
+        self.valid_from = 1
+        self.requests = []
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.server_address[1]}"
+
+    def revoke(self):
+        with self.lock:
+            self.valid_from = self.tokens + 1
+
+    def reply_for(self, username, token):
+        with self.lock:
+            self.requests.append((username, token))
+            if int(token.rsplit('-', 1)[1]) < self.valid_from:
+                return 401, {}, {'message': 'Unauthorized', 'error': 401}
+            replies = self.responses.get(username)
+            if replies:
+                return replies.pop(0) if len(replies) > 1 else replies[0]
+        if username in ABOUT:
+            return 200, {}, {'kind': 't2', 'data': ABOUT[username]}
+        return 404, {}, {'message': 'Not Found', 'error': 404}
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+    def _reply(self, status, headers, body):
+        data = body.encode() if isinstance(body, str) else json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get('Content-Length') or 0))
+        with self.server.lock:
+            self.server.tokens += 1
+            token = f"token-{self.server.tokens}"
+        self._reply(200, {}, {'access_token': token, 'token_type': 'bearer', 'expires_in': 3600})
+
+    def do_GET(self):
+        username = self.path.split('/')[2]
+        token = self.headers['Authorization'].split()[1]
+        self._reply(*self.server.reply_for(username, token))
+
+
+class FakeClock:
+    """time for fetch_users: sleeping moves the clock forward instead of
+    waiting, and every requested sleep is recorded."""
+
+    def __init__(self):
+        self.offset = 0.0
+        self.sleeps = []
+        self.lock = threading.Lock()
+
+    def time(self):
+        return time.time() + self.offset
+
+    def monotonic(self):
+        return time.monotonic() + self.offset
+
+    def sleep(self, seconds):
+        with self.lock:
+            self.sleeps.append(seconds)
+            self.offset += seconds
+
+
+class FetchUsersTest(unittest.TestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+        self.original_time = fetch_users.time
+        fetch_users.time = self.clock
+        self.conn = sqlite3.connect(':memory:', check_same_thread=False)
+        fetch_users.create_users_tables(self.conn)
+
+    def tearDown(self):
+        fetch_users.time = self.original_time
+        self.conn.close()
+
+    def start_server(self, responses=None):
+        server = StubServer(responses)
+        thread = threading.Thread(target=server.serve_forever, daemon=True)
+        thread.start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        return server
+
+    def client(self, server, limiter=None, max_retries=2):
+        return fetch_users.RedditUserClient('id', 'secret', limiter or fetch_users.RateLimiter(rate=100, burst=100),
+                                            auth_url=f"{server.url}/api/v1/access_token", api_url=server.url,
+                                            max_retries=max_retries)
+
+    def fetch(self, client, usernames, workers=2):
+        fetch_users.fetch_and_store_users_concurrent(self.conn, usernames, client, workers)
+        users = {row[0]: row[1:] for row in self.conn.execute(
+            'SELECT username, id, comment_karma, profile_name FROM reddit_users')}
+        failed = {row[0]: row[1:] for row in self.conn.execute(
+            'SELECT username, reason, failure_class, attempts FROM reddit_users_failed')}
+        return users, failed
+
+    def test_success_and_permanent_failures(self):
+        server = self.start_server()
+        users, failed = self.fetch(self.client(server), ['alice', 'ghost', 'banned'])
+
+        self.assertEqual(users, {'alice': ('t2_alice', 12, 'u_alice')})
+        self.assertEqual(failed, {'ghost': ('http_404', 'permanent', 1),
+                                  'banned': ('suspended_or_none', 'permanent', 1)})
+        self.assertEqual(server.tokens, 1)
+
+    def test_rate_limited_request_is_retried_after_retry_after(self):
+        server = self.start_server({'alice': [(429, {'Retry-After': '7'}, {'message': 'Too Many Requests'}),
+                                              (200, {}, {'data': ABOUT['alice']})]})
+        users, failed = self.fetch(self.client(server), ['alice'])
+
+        self.assertIn('alice', users)
+        self.assertEqual(failed, {})
+        self.assertEqual(len(server.requests), 2)
+        self.assertIn(7, [round(seconds) for seconds in self.clock.sleeps])
+
+    def test_ratelimit_headers_throttle_requests(self):
+        limiter = fetch_users.RateLimiter(rate=100, burst=100)
+        headers = {'X-Ratelimit-Remaining': '0', 'X-Ratelimit-Reset': '30', 'X-Ratelimit-Used': '600'}
+        server = self.start_server({'alice': [(200, headers, {'data': ABOUT['alice']})]})
+        client = self.client(server, limiter)
+
+        self.assertEqual(client.fetch_user('alice')[0], 'ok')
+        self.assertEqual(self.clock.sleeps, [])
+        # The window is used up: the next request waits for the reset
+        self.assertEqual(client.fetch_user('ghost')[0], 'failed')
+        self.assertGreaterEqual(sum(self.clock.sleeps), 29)
+
+        # Plenty left: the rate spreads it over the rest of the window
+        limiter.update({'X-Ratelimit-Remaining': '50', 'X-Ratelimit-Reset': '100'})
+        self.assertAlmostEqual(limiter.rate, 0.5)
+
+    def test_unauthorized_forces_a_token_refresh(self):
+        server = self.start_server()
+        client = self.client(server)
+        self.assertEqual(client.fetch_user('alice')[0], 'ok')
+        server.revoke()
+
+        users, failed = self.fetch(client, ['alice'])
+        self.assertIn('alice', users)
+        self.assertEqual(failed, {})
+        self.assertEqual(server.tokens, 2)
+        self.assertEqual([token for _, token in server.requests], ['token-1', 'token-1', 'token-2'])
+
+    def test_non_json_body_is_a_transient_failure(self):
+        server = self.start_server({'alice': [(200, {}, '<html>Our CDN was unable to reach our servers</html>')]})
+        users, failed = self.fetch(self.client(server, max_retries=2), ['alice'])
+
+        self.assertEqual(users, {})
+        self.assertEqual(failed, {'alice': ('invalid_response', 'transient', 1)})
+        self.assertEqual(len(server.requests), 3)
+
+        # Failing the same way again counts as another attempt
+        users, failed = self.fetch(self.client(server, max_retries=0), ['alice'])
+        self.assertEqual(failed, {'alice': ('invalid_response', 'transient', 2)})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,308 @@
+import argparse
+import bisect
+import json
+import os
+import random
+import time
+
+import zstandard as zstd
+
+# A sidecar index (<dump>.zst.idx) of line starts that a reader can jump to.
+# Every zstd frame decompresses on its own, so each point records the frame
+# it falls in: seeking to a point means opening the file at that frame and
+# discarding output up to the point, never decompressing anything before
+# the frame. There is a point at the first line of every frame and at least
+# every CHECKPOINT_BYTES of decompressed data inside a frame.
+#
+# The Pushshift dumps are usually one huge frame, where checkpoints still
+# cost a decompress from the start of the file. reframe() rewrites a dump
+# as many small line-aligned frames so that every point is a real seek.
+INDEX_VERSION = 1
+CHECKPOINT_BYTES = 64 * 1024 ** 2
+REFRAME_BYTES = 16 * 1024 ** 2
+
+SKIPPABLE_MAGIC = 0x184D2A50
+MAX_FRAME_HEADER = 18
+
+
+def index_path(file_path):
+    return file_path + '.idx'
+
+
+def _stat_key(file_path):
+    stat = os.stat(file_path)
+    return stat.st_size, stat.st_mtime_ns
+
+
+def iter_frames(fh):
+    """Yield (start, end) compressed offsets of every zstd frame, reading
+    only frame and block headers."""
+    offset = 0
+    while True:
+        fh.seek(offset)
+        head = fh.read(MAX_FRAME_HEADER)
+        if not head:
+            return
+        magic = int.from_bytes(head[:4], 'little')
+        if magic & 0xFFFFFFF0 == SKIPPABLE_MAGIC:
+            offset += 8 + int.from_bytes(head[4:8], 'little')
+            continue
+
+        position = offset + zstd.frame_header_size(head)
+        while True:
+            fh.seek(position)
+            header = int.from_bytes(fh.read(3), 'little')
+            block_type = (header >> 1) & 3
+            # RLE blocks store one byte however long the block is
+            position += 3 + (1 if block_type == 1 else header >> 3)
+            if header & 1:
+                break
+        if zstd.get_frame_parameters(head).has_checksum:
+            position += 4
+        yield offset, position
+        offset = position
+
+
+def build_index(file_path, checkpoint_bytes=CHECKPOINT_BYTES, read_size=2**20):
+    """Scan a dump once and return its index.
+
+    points are [offset, frame_compressed_offset, frame_offset, line]: a line
+    start in decompressed bytes, where its frame starts in the file and in
+    the decompressed stream, and how many newlines come before it.
+    """
+    dctx = zstd.ZstdDecompressor(max_window_size=2**31)
+    points = []
+    frames = 0
+    position = 0
+    newlines = 0
+    at_line_start = True
+
+    with open(file_path, 'rb') as fh:
+        for frame_start, frame_end in list(iter_frames(fh)):
+            frames += 1
+            frame_offset = position
+            want = position
+            decompressor = dctx.decompressobj()
+            fh.seek(frame_start)
+
+            for compressed_at in range(frame_start, frame_end, read_size):
+                block = decompressor.decompress(fh.read(min(read_size, frame_end - compressed_at)))
+                if not block:
+                    continue
+                end = position + len(block)
+                while True:
+                    if at_line_start and want <= position:
+                        start = position
+                    else:
+                        found = block.find(b'\n', max(want - position - 1, 0))
+                        if found < 0 or position + found + 1 >= end:
+                            break
+                        start = position + found + 1
+                    points.append([start, frame_start, frame_offset,
+                                   newlines + block.count(b'\n', 0, start - position)])
+                    want = start + checkpoint_bytes
+                newlines += block.count(b'\n')
+                at_line_start = block.endswith(b'\n')
+                position = end
+
+    size, mtime_ns = _stat_key(file_path)
+    return {
+        'version': INDEX_VERSION,
+        'file_size': size,
+        'mtime_ns': mtime_ns,
+        'frames': frames,
+        'decompressed_size': position,
+        'lines': newlines + (0 if at_line_start else 1),
+        'points': points,
+    }
+
+
+def write_index(file_path, index):
+    tmp_path = index_path(file_path) + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(index, f)
+    os.replace(tmp_path, index_path(file_path))
+
+
+def load_index(file_path):
+    """The sidecar index for file_path, or None if there is none or the dump
+    changed since it was written."""
+    try:
+        with open(index_path(file_path), 'r', encoding='utf-8') as f:
+            index = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if index.get('version') != INDEX_VERSION:
+        return None
+    if (index['file_size'], index['mtime_ns']) != _stat_key(file_path):
+        return None
+    return index
+
+
+def _open_at(fh, index, offset):
+    # A reader positioned at decompressed offset, started from the last
+    # point at or before it
+    points = index['points']
+    i = bisect.bisect_right(points, [offset, float('inf')]) - 1
+    if i < 0:
+        frame_start, frame_offset = 0, 0
+    else:
+        _, frame_start, frame_offset, _ = points[i]
+    fh.seek(frame_start)
+    dctx = zstd.ZstdDecompressor(max_window_size=2**31)
+    reader = dctx.stream_reader(fh, read_size=2**20, read_across_frames=True, closefd=False)
+    if offset > frame_offset:
+        reader.seek(offset - frame_offset)
+    return reader
+
+
+def read_line_batches(file_path, index, start_offset=0, end_offset=None, block_size=4 * 1024 * 1024):
+    """Like read_zst_line_batches, for the lines starting in
+    [start_offset, end_offset). Both must be line starts (index points, or
+    resume offsets from import_progress)."""
+    with open(file_path, 'rb') as ifh:
+        reader = _open_at(ifh, index, start_offset)
+        consumed = start_offset
+        pending = b''
+
+        while True:
+            block = reader.read(block_size)
+            if not block:
+                break
+            data = pending + block
+            data_start = consumed - len(pending)
+            consumed += len(block)
+            if end_offset is not None and consumed >= end_offset:
+                lines = data[:end_offset - data_start].split(b'\n')
+                yield [line for line in lines if line.strip()], end_offset, ifh.tell()
+                return
+            lines = data.split(b'\n')
+            pending = lines.pop()
+            yield [line for line in lines if line.strip()], consumed - len(pending), ifh.tell()
+
+        if pending:
+            yield ([pending] if pending.strip() else []), consumed, ifh.tell()
+
+
+def split(index, parts=None, chunk_bytes=None, frame_edges=False):
+    """Cut the file into line-aligned [start, end) chunks (end None for the
+    last one), either parts of about equal size or chunks of about
+    chunk_bytes. Chunk edges are index points, so there can be fewer
+    chunks than asked for. With frame_edges, only points at the start of a
+    frame are used, so no chunk has to decompress data before its start."""
+    total = index['decompressed_size']
+    if parts is None:
+        parts = max(1, -(-total // chunk_bytes))
+    points = index['points']
+    if frame_edges:
+        points = [point for point in points if point[0] == point[2]]
+    offsets = [point[0] for point in points]
+
+    edges = [0]
+    for i in range(1, parts):
+        j = bisect.bisect_left(offsets, total * i // parts)
+        if j < len(offsets) and offsets[j] > edges[-1]:
+            edges.append(offsets[j])
+    return [(start, end) for start, end in zip(edges, edges[1:] + [None])]
+
+
+def sample_lines(file_path, count, index=None, seed=None):
+    """count lines from random positions in the file: each is the first
+    line starting after a uniformly chosen byte, so only the data between
+    the nearest index point and that byte is decompressed."""
+    index = index or load_index(file_path)
+    if index is None:
+        raise ValueError(f"{file_path} has no index, run zst_index.py on it first")
+    rng = random.Random(seed)
+    samples = []
+
+    with open(file_path, 'rb') as fh:
+        for target in sorted(rng.randrange(index['decompressed_size']) for _ in range(count)):
+            reader = _open_at(fh, index, target)
+            data = b''
+            while True:
+                block = reader.read(64 * 1024)
+                if not block:
+                    break
+                data += block
+                first = data.find(b'\n')
+                if first >= 0 and data.find(b'\n', first + 1) >= 0:
+                    break
+            line = data.split(b'\n')[1:2]
+            if line and line[0].strip():
+                samples.append(line[0])
+    return samples
+
+
+def reframe(file_path, out_path, frame_bytes=REFRAME_BYTES, level=3):
+    """Rewrite a dump as independent zstd frames of about frame_bytes
+    decompressed data, each ending on a line boundary."""
+    dctx = zstd.ZstdDecompressor(max_window_size=2**31)
+    cctx = zstd.ZstdCompressor(level=level, write_checksum=True)
+    frames = 0
+
+    with open(file_path, 'rb') as ifh, open(out_path, 'wb') as ofh:
+        reader = dctx.stream_reader(ifh, read_size=2**20, read_across_frames=True)
+        pending = b''
+        while True:
+            block = reader.read(frame_bytes)
+            data = pending + block
+            if block:
+                cut = data.rfind(b'\n') + 1
+                if cut == 0:
+                    pending = data
+                    continue
+                data, pending = data[:cut], data[cut:]
+            if data:
+                ofh.write(cctx.compress(data))
+                frames += 1
+            if not block:
+                break
+    return frames
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Index .zst dumps for seeking, splitting and sampling")
+    parser.add_argument("files", nargs="+", help=".zst files")
+    parser.add_argument("--checkpoint-mb", type=float, default=CHECKPOINT_BYTES / 1024 ** 2,
+                        help="Max decompressed MB between index points inside a frame")
+    parser.add_argument("--reframe", metavar="DIR", default=None,
+                        help="Write a copy of each file split into small frames to DIR, then index the copy")
+    parser.add_argument("--frame-mb", type=float, default=REFRAME_BYTES / 1024 ** 2,
+                        help="Decompressed MB per frame with --reframe")
+    parser.add_argument("--split", type=int, default=None, help="Print N line-aligned chunks of each file")
+    parser.add_argument("--sample", type=int, default=None, help="Print N random lines from each file")
+    parser.add_argument("--seed", type=int, default=None)
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    for file_path in args.files:
+        if args.reframe:
+            os.makedirs(args.reframe, exist_ok=True)
+            out_path = os.path.join(args.reframe, os.path.basename(file_path))
+            start = time.perf_counter()
+            frames = reframe(file_path, out_path, int(args.frame_mb * 1024 ** 2))
+            print(f"Wrote {out_path} ({frames} frames) in {time.perf_counter() - start:.1f}s")
+            file_path = out_path
+
+        index = load_index(file_path)
+        if index is None:
+            start = time.perf_counter()
+            index = build_index(file_path, int(args.checkpoint_mb * 1024 ** 2))
+            write_index(file_path, index)
+            print(f"Indexed {file_path}: {index['frames']} frame(s), {len(index['points'])} points, "
+                  f"{index['decompressed_size'] / 1024 ** 2:.1f} MB decompressed, {index['lines']:,} lines "
+                  f"in {time.perf_counter() - start:.1f}s")
+
+        if args.split:
+            for start, end in split(index, args.split):
+                print(f"  {start}-{'' if end is None else end}")
+        if args.sample:
+            for line in sample_lines(file_path, args.sample, index, args.seed):
+                print(line.decode('utf-8', errors='replace')[:200])
+
+
+if __name__ == "__main__":
+    main()